@@ -1,7 +1,8 @@
 from django.contrib import admin
-from .models import Contact, Group
+from .models import Contact, ContactImport, Group
 # Register your models here.
 
 
 admin.site.register(Group)
-admin.site.register(Contact)
\ No newline at end of file
+admin.site.register(Contact)
+admin.site.register(ContactImport)
@@ -0,0 +1,150 @@
+import csv
+import io
+import json
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from .models import Contact
+
+
+CSV = 'csv'
+JSONL = 'jsonl'
+
+FILE_FORMATS = {
+    '.csv': CSV,
+    '.jsonl': JSONL,
+    '.ndjson': JSONL,
+    '.json': JSONL,
+}
+
+
+class ContactFileError(ValueError):
+    """
+    Raised while parsing a contact file that is not UTF-8 text or not valid CSV.
+    """
+
+
+def normalize_email(value):
+    """
+    Normalizes an email address the way contacts are stored.
+    """
+    return value.lower().strip()
+
+
+def detect_format(filename):
+    """
+    Returns the import format for a file name, or None if the extension is not supported.
+    """
+    name = filename.lower()
+    for extension, file_format in FILE_FORMATS.items():
+        if name.endswith(extension):
+            return file_format
+    return None
+
+
+def parse_contacts(binary_file, file_format):
+    """
+    Lazily parses an uploaded contact file into rows.
+
+    Args:
+        binary_file (file): The file opened in binary mode.
+        file_format (str): Either 'csv' (with an `email` header) or 'jsonl' (one object per line).
+
+    Yields:
+        dict: The row's fields, or None for a line that could not be parsed.
+
+    Raises:
+        ContactFileError: If the file is not UTF-8 or its CSV cannot be read, when
+            the rows are consumed.
+    """
+    text = io.TextIOWrapper(binary_file, encoding='utf-8-sig', newline='')
+    try:
+        if file_format == CSV:
+            reader = csv.DictReader(text)
+            if reader.fieldnames:
+                reader.fieldnames = [field.strip().lower() for field in reader.fieldnames]
+            yield from reader
+        else:
+            for line in text:
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    row = None
+                yield row if isinstance(row, dict) else None
+    except UnicodeDecodeError:
+        raise ContactFileError("The file is not UTF-8 encoded text") from None
+    except csv.Error as e:
+        raise ContactFileError(f"The file is not a valid CSV file: {e}") from None
+
+
+def clean_row(row):
+    """
+    Validates a parsed row and returns (email, first_name, last_name), or None if it is invalid.
+    """
+    if not row or not isinstance(row.get('email'), str):
+        return None
+    email = normalize_email(row['email'])
+    try:
+        validate_email(email)
+    except ValidationError:
+        return None
+    first_name = str(row.get('first_name') or '').strip() or None
+    last_name = str(row.get('last_name') or '').strip() or None
+    return email, first_name, last_name
+
+
+def import_contacts(group, rows, batch_size=None, progress=None):
+    """
+    Inserts parsed rows into a group, skipping invalid rows and duplicate emails.
+
+    Duplicates are detected with a set holding the group's existing emails and the
+    emails already seen in the file. Contacts are written with bulk_create every
+    `batch_size` rows, so memory does not grow with the size of the file. Rows added
+    to the group by a concurrent import are skipped by the (group, email) constraint,
+    and counted as duplicates: each batch's inserts are the batch's emails found in
+    the group after bulk_create that were not there before.
+
+    Args:
+        group (Group): The group the contacts are added to.
+        rows (iterable): Rows produced by parse_contacts.
+        batch_size (int): Contacts inserted per bulk_create call.
+        progress (callable): Called with the running summary after each batch.
+
+    Returns:
+        dict: The number of inserted, duplicate and invalid rows.
+    """
+    batch_size = batch_size or settings.CONTACT_IMPORT_BATCH_SIZE
+    seen = set(Contact.objects.filter(group=group).values_list('email', flat=True).iterator())
+    summary = {"inserted": 0, "duplicates": 0, "invalid": 0}
+    pending = []
+
+    def flush():
+        stored = Contact.objects.filter(group=group, email__in=[contact.email for contact in pending])
+        before = stored.count()
+        Contact.objects.bulk_create(pending, batch_size=batch_size, ignore_conflicts=True)
+        inserted = stored.count() - before
+        summary["inserted"] += inserted
+        summary["duplicates"] += len(pending) - inserted
+        pending.clear()
+        if progress:
+            progress(summary)
+
+    for row in rows:
+        cleaned = clean_row(row)
+        if cleaned is None:
+            summary["invalid"] += 1
+            continue
+        email, first_name, last_name = cleaned
+        if email in seen:
+            summary["duplicates"] += 1
+            continue
+        seen.add(email)
+        pending.append(Contact(group=group, email=email, first_name=first_name, last_name=last_name))
+        if len(pending) >= batch_size:
+            flush()
+
+    if pending:
+        flush()
+    return summary
@@ -0,0 +1,72 @@
+import time
+import tracemalloc
+import uuid
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from emailcontacts.models import Contact, Group
+from emailcontacts.recipients import stream_recipients
+
+User = get_user_model()
+
+
+def measure(func):
+    """
+    Runs func and returns its wall time in seconds and peak traced memory in MiB.
+    """
+    tracemalloc.start()
+    started = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / (1024 * 1024)
+
+
+class Command(BaseCommand):
+    help = "Compares peak memory of loading a group's contacts as model instances against streaming them"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--contacts', type=int, default=100_000, help="Number of contacts in the benchmark group")
+
+    def handle(self, *args, **options):
+        count = options['contacts']
+
+        # Everything seeded here is rolled back once the measurements are taken
+        with transaction.atomic():
+            user = User.objects.create_user(email=f'benchmark-{uuid.uuid4().hex}@liftsmail.local')
+            group = Group.objects.create(name=f'benchmark-{uuid.uuid4().hex}', user=user)
+            Contact.objects.bulk_create(
+                (
+                    Contact(first_name=f'First{i}', last_name=f'Last{i}', email=f'contact{i}@example.com', group=group)
+                    for i in range(count)
+                ),
+                batch_size=5000,
+            )
+
+            def load_instances():
+                # What the send paths did before: full instances, then one dict per contact
+                contacts = group.contacts.all()
+                return [
+                    {
+                        "first_name": contact.first_name or "Guest",
+                        'last_name': contact.last_name or "Guest",
+                        'email': contact.email,
+                        "id": contact.id
+                    }
+                    for contact in contacts
+                ]
+
+            def stream():
+                for _ in stream_recipients(group.id):
+                    pass
+
+            results = [
+                ('model instances', measure(load_instances)),
+                ('stream_recipients', measure(stream)),
+            ]
+            transaction.set_rollback(True)
+
+        self.stdout.write(f"{count} contacts")
+        for name, (elapsed, peak) in results:
+            self.stdout.write(f"{name:<20} {elapsed:8.3f}s {peak:10.2f} MiB peak")
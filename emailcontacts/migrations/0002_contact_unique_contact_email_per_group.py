@@ -0,0 +1,34 @@
+# Generated by Django 4.2.16 on 2026-10-18 14:20
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def collapse_duplicate_contacts(apps, schema_editor):
+    # Keep the oldest contact for each (group, email) pair so the constraint can be added
+    Contact = apps.get_model('emailcontacts', 'Contact')
+    duplicates = (
+        Contact.objects.order_by()
+        .values('group_id', 'email')
+        .annotate(keep_id=Min('id'), total=Count('id'))
+        .filter(total__gt=1)
+    )
+    for duplicate in duplicates.iterator():
+        Contact.objects.filter(
+            group_id=duplicate['group_id'], email=duplicate['email'],
+        ).exclude(id=duplicate['keep_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emailcontacts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(collapse_duplicate_contacts, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='contact',
+            constraint=models.UniqueConstraint(fields=('group', 'email'), name='unique_contact_email_per_group'),
+        ),
+    ]
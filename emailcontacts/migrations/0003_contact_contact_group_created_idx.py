@@ -0,0 +1,17 @@
+# Generated by Django 4.2.16 on 2026-10-18 14:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emailcontacts', '0002_contact_unique_contact_email_per_group'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='contact',
+            index=models.Index(fields=['group', 'created_at', 'id'], name='contact_group_created_idx'),
+        ),
+    ]
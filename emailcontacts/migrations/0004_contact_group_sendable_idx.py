@@ -0,0 +1,17 @@
+# Generated by Django 4.2.16 on 2026-10-18 14:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emailcontacts', '0003_contact_contact_group_created_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='contact',
+            index=models.Index(condition=models.Q(('is_subscribed', True), ('is_valid', True)), fields=['group', 'id'], name='contact_group_sendable_idx'),
+        ),
+    ]
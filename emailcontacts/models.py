@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import Count, Q
 from django.contrib.auth import get_user_model
 from liftsmail.models import TimeStampBaseModel
 
@@ -6,10 +7,24 @@ from liftsmail.models import TimeStampBaseModel
 User = get_user_model()
 
 
+class GroupQuerySet(models.QuerySet):
+    def with_contact_counts(self):
+        """
+        Annotates each group with its total, subscribed and valid contact counts in one aggregate query.
+        """
+        return self.annotate(
+            contact_count=Count('contacts'),
+            subscribed_count=Count('contacts', filter=Q(contacts__is_subscribed=True)),
+            valid_count=Count('contacts', filter=Q(contacts__is_valid=True)),
+        )
+
+
 class Group(TimeStampBaseModel):
     name = models.CharField(max_length=255, unique=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="emailgroups")
 
+    objects = GroupQuerySet.as_manager()
+
     def __str__(self):
         return f'{self.name} by <{self.user.email}>'
     
@@ -29,3 +44,26 @@ class Contact(TimeStampBaseModel):
     
     class Meta:
         ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['group', 'email'], name='unique_contact_email_per_group'),
+        ]
+        indexes = [
+            # Keyset pagination of a group's contacts
+            models.Index(fields=['group', 'created_at', 'id'], name='contact_group_created_idx'),
+            # Recipient selection only reads contacts that can be mailed
+            models.Index(
+                fields=['group', 'id'],
+                condition=Q(is_subscribed=True, is_valid=True),
+                name='contact_group_sendable_idx',
+            ),
+        ]
+
+
+# A contact import handed off to a worker. Records the group of the task, as its
+# result only names the group once the task has started.
+class ContactImport(TimeStampBaseModel):
+    task_id = models.CharField(max_length=255, unique=True)
+    group = models.ForeignKey(Group, related_name='imports', on_delete=models.CASCADE)
+
+    def __str__(self):
+        return f"Import {self.task_id} into {self.group_id}"
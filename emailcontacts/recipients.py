@@ -0,0 +1,82 @@
+from collections import namedtuple
+from functools import lru_cache
+from .models import Contact
+
+
+# Contact columns the email templates can reference
+RECIPIENT_FIELDS = ('id', 'email', 'first_name', 'last_name')
+
+RECIPIENT_CHUNK_SIZE = 2000
+
+
+@lru_cache(maxsize=None)
+def recipient_type(fields):
+    """
+    Returns the lightweight record type used for recipients with the given fields.
+    """
+    return namedtuple('Recipient', fields)
+
+
+def recipient_queryset(group_id, after_id=None, upto_id=None):
+    """
+    Returns the subscribed, valid contacts of a group, optionally limited to the (after_id, upto_id] id range.
+
+    The filter matches the condition of the contact_group_sendable_idx partial index,
+    so unsubscribed and invalid contacts are skipped by the index rather than read.
+    """
+    queryset = Contact.objects.filter(group_id=group_id, is_subscribed=True, is_valid=True)
+    if after_id is not None:
+        queryset = queryset.filter(id__gt=after_id)
+    if upto_id is not None:
+        queryset = queryset.filter(id__lte=upto_id)
+    return queryset.order_by('id')
+
+
+def stream_recipients(group_id, fields=RECIPIENT_FIELDS, after_id=None, upto_id=None, chunk_size=RECIPIENT_CHUNK_SIZE):
+    """
+    Yields the recipients of a group as namedtuples holding only the requested columns.
+
+    Rows are read with values_list().iterator(), so no model instances are built and
+    at most `chunk_size` rows are held in memory at a time.
+
+    Args:
+        group_id (int): The group whose contacts are streamed.
+        fields (iterable): The contact columns to read. `id` and `email` are always included.
+        after_id (int): Only stream contacts with a greater id.
+        upto_id (int): Only stream contacts up to and including this id.
+        chunk_size (int): Rows fetched from the database per round trip.
+    """
+    fields = ('id', 'email') + tuple(field for field in fields if field not in ('id', 'email'))
+    record = recipient_type(fields)
+    rows = recipient_queryset(group_id, after_id, upto_id).values_list(*fields)
+    for row in rows.iterator(chunk_size=chunk_size):
+        yield record._make(row)
+
+
+def chunk_bounds(group_id, chunk_size):
+    """
+    Splits a group's contacts into (after_id, upto_id] keyset ranges of `chunk_size` contacts.
+
+    Each boundary is found with an index seek past the previous one, so the contact
+    ids are never loaded into memory.
+    """
+    bounds = []
+    after_id = 0
+    contact_ids = recipient_queryset(group_id).values_list('id', flat=True)
+    while True:
+        remaining = contact_ids.filter(id__gt=after_id)
+        upto_id = next(iter(remaining[chunk_size - 1:chunk_size]), None)
+        if upto_id is None:
+            upto_id = remaining.last()
+            if upto_id is not None:
+                bounds.append((after_id, upto_id))
+            return bounds
+        bounds.append((after_id, upto_id))
+        after_id = upto_id
+
+
+def has_recipients(group_id):
+    """
+    Checks whether a group has any contact to send to, without loading them.
+    """
+    return recipient_queryset(group_id).exists()
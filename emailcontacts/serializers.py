@@ -1,4 +1,7 @@
+from django.urls import reverse
 from rest_framework import serializers
+from liftsmail.pagination import CreatedAtCursorPagination
+from .importers import detect_format, normalize_email, CSV, JSONL
 from .models import Group, Contact
 
 
@@ -9,14 +12,50 @@ class ContactSerializer(serializers.ModelSerializer):
         read_only_fields = ('group','is_subscribed','is_valid')
         
     def validate_email(self,value):
-        value = value.lower().strip()
+        value = normalize_email(value)
         return value
 
 
 class GroupSerializer(serializers.ModelSerializer):
-    contacts = ContactSerializer(many=True, read_only=True)
+    contact_count = serializers.SerializerMethodField()
+    subscribed_count = serializers.SerializerMethodField()
+    valid_count = serializers.SerializerMethodField()
 
     class Meta:
         model = Group
         fields = '__all__'
-        read_only_fields = ('user',)
\ No newline at end of file
+        read_only_fields = ('user',)
+
+    # Counts are annotated by Group.objects.with_contact_counts(), a group that was just created has none
+    def get_contact_count(self, group):
+        return getattr(group, 'contact_count', 0)
+
+    def get_subscribed_count(self, group):
+        return getattr(group, 'subscribed_count', 0)
+
+    def get_valid_count(self, group):
+        return getattr(group, 'valid_count', 0)
+
+    def to_representation(self, group):
+        data = super().to_representation(group)
+        if hasattr(group, 'contact_page'):
+            request = self.context.get('request')
+            url = reverse('contact-list-create', kwargs={'pk': group.id})
+            has_more = self.get_contact_count(group) > len(group.contact_page)
+            data['contacts'] = {
+                'next': CreatedAtCursorPagination().get_next_url(request, url, group.contact_page[-1]) if has_more else None,
+                'results': ContactSerializer(group.contact_page, many=True, context=self.context).data,
+            }
+        return data
+
+
+class ContactImportSerializer(serializers.Serializer):
+    file = serializers.FileField()
+    format = serializers.ChoiceField(choices=[CSV, JSONL], required=False)
+
+    def validate(self, attrs):
+        if not attrs.get('format'):
+            attrs['format'] = detect_format(attrs['file'].name)
+        if not attrs['format']:
+            raise serializers.ValidationError("Upload a .csv or .jsonl file, or set the format")
+        return attrs
@@ -0,0 +1,73 @@
+from celery import shared_task
+from celery.utils.log import get_task_logger
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Max
+from emailcontacts.importers import ContactFileError, import_contacts, parse_contacts
+from emailcontacts.models import Contact, Group
+from emailcontacts.validation import validate_contacts
+
+logger = get_task_logger(__name__)
+
+
+@shared_task(bind=True)
+def import_contacts_task(self, group_id, path, file_format):
+    """
+    Imports a stored contact file into a group, reporting progress after each batch.
+
+    A file that turns out unreadable stops the import with an `error` in the summary,
+    the contacts of the batches already written are kept.
+    """
+    group = Group.objects.get(pk=group_id)
+    summary = {"inserted": 0, "duplicates": 0, "invalid": 0}
+
+    def progress(batch_summary):
+        summary.update(batch_summary)
+        if self.request.id:
+            self.update_state(state='PROGRESS', meta={"group_id": group_id, **summary})
+
+    last_id = last_contact_id(group_id)
+    try:
+        with default_storage.open(path, 'rb') as upload:
+            summary.update(import_contacts(group, parse_contacts(upload.file, file_format), progress=progress))
+    except ContactFileError as e:
+        summary["error"] = str(e)
+    finally:
+        default_storage.delete(path)
+
+    logger.info("Imported contacts into group %s: %s", group_id, summary)
+    if summary["inserted"]:
+        schedule_validation(group_id, last_id)
+    return {"group_id": group_id, **summary}
+
+
+def last_contact_id(group_id):
+    return Contact.objects.filter(group_id=group_id).aggregate(last=Max('id'))['last']
+
+
+def schedule_validation(group_id, after_id=None):
+    """
+    Validates the contacts added to a group after `after_id` once the current transaction commits.
+    """
+    transaction.on_commit(lambda: validate_contacts_task.delay(group_id, after_id))
+
+
+@shared_task
+def validate_contacts_task(group_id, after_id=None):
+    """
+    Recomputes the `is_valid` flag of a group's contacts.
+    """
+    summary = validate_contacts(group_id, after_id=after_id)
+    logger.info("Validated contacts of group %s: %s", group_id, summary)
+    return {"group_id": group_id, **summary}
+
+
+@shared_task
+def validate_all_contacts():
+    """
+    Queues a validation job for every group with contacts, run on a schedule
+    so addresses whose domain stopped accepting mail are flagged.
+    """
+    group_ids = Contact.objects.order_by().values_list('group_id', flat=True).distinct()
+    for group_id in group_ids.iterator():
+        validate_contacts_task.delay(group_id)
@@ -0,0 +1,38 @@
+import os
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TransactionTestCase
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'liftsmail.settings')
+
+
+class CollapseDuplicateContactsTest(TransactionTestCase):
+    migrate_from = [('emailcontacts', '0001_initial')]
+    migrate_to = [('emailcontacts', '0002_contact_unique_contact_email_per_group')]
+
+    def test_duplicates_collapsed_to_oldest(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.migrate_from)
+        apps = executor.loader.project_state(self.migrate_from).apps
+        User = apps.get_model('account', 'CustomUser')
+        Group = apps.get_model('emailcontacts', 'Group')
+        Contact = apps.get_model('emailcontacts', 'Contact')
+
+        user = User.objects.create(email='testuser@app.com', password="password")
+        group = Group.objects.create(name="Test Group", user=user)
+        other_group = Group.objects.create(name="Other Group", user=user)
+        kept = Contact.objects.create(group=group, email="john@example.com", first_name="First")
+        Contact.objects.create(group=group, email="john@example.com", first_name="Second")
+        Contact.objects.create(group=other_group, email="john@example.com")
+
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(self.migrate_to)
+        apps = executor.loader.project_state(self.migrate_to).apps
+        Contact = apps.get_model('emailcontacts', 'Contact')
+
+        self.assertEqual(list(Contact.objects.filter(group_id=group.id).values_list('id', flat=True)), [kept.id])
+        self.assertEqual(Contact.objects.filter(group_id=other_group.id).count(), 1)
+
+        executor.loader.build_graph()
+        executor.migrate(executor.loader.graph.leaf_nodes())
@@ -0,0 +1,54 @@
+import os
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from emailcontacts.models import Group, Contact
+from emailcontacts.recipients import chunk_bounds, has_recipients, stream_recipients
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'liftsmail.settings')
+
+User = get_user_model()
+
+
+class StreamRecipientsTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email='testuser@app.com', password="password")
+        self.group = Group.objects.create(name="Test Group", user=self.user)
+        self.contacts = [
+            Contact.objects.create(group=self.group, first_name=f"First{i}", last_name=f"Last{i}", email=f"user{i}@example.com")
+            for i in range(5)
+        ]
+
+    def test_stream_yields_records_in_id_order(self):
+        recipients = list(stream_recipients(self.group.id, chunk_size=2))
+        self.assertEqual([recipient.email for recipient in recipients], [f"user{i}@example.com" for i in range(5)])
+        self.assertEqual(recipients[0].first_name, "First0")
+        self.assertEqual(recipients[0]._fields, ('id', 'email', 'first_name', 'last_name'))
+
+    def test_stream_only_reads_requested_fields(self):
+        recipient = next(stream_recipients(self.group.id, fields=('first_name',)))
+        self.assertEqual(recipient._fields, ('id', 'email', 'first_name'))
+
+    def test_stream_limits_to_id_range(self):
+        ids = [contact.id for contact in self.contacts]
+        recipients = stream_recipients(self.group.id, after_id=ids[1], upto_id=ids[3])
+        self.assertEqual([recipient.id for recipient in recipients], ids[2:4])
+
+    def test_chunk_bounds_cover_every_contact(self):
+        ids = [contact.id for contact in self.contacts]
+        self.assertEqual(chunk_bounds(self.group.id, 2), [(0, ids[1]), (ids[1], ids[3]), (ids[3], ids[4])])
+        self.assertEqual(chunk_bounds(self.group.id, 5), [(0, ids[4])])
+
+    def test_unsubscribed_and_invalid_contacts_are_skipped(self):
+        Contact.objects.filter(pk=self.contacts[1].pk).update(is_subscribed=False)
+        Contact.objects.filter(pk=self.contacts[3].pk).update(is_valid=False)
+        ids = [contact.id for contact in self.contacts]
+        self.assertEqual([recipient.id for recipient in stream_recipients(self.group.id)], [ids[0], ids[2], ids[4]])
+        self.assertEqual(chunk_bounds(self.group.id, 2), [(0, ids[2]), (ids[2], ids[4])])
+
+        Contact.objects.filter(group=self.group).update(is_subscribed=False)
+        self.assertFalse(has_recipients(self.group.id))
+
+    def test_has_recipients(self):
+        empty_group = Group.objects.create(name="Empty Group", user=self.user)
+        self.assertTrue(has_recipients(self.group.id))
+        self.assertFalse(has_recipients(empty_group.id))
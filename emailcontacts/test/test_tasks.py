@@ -0,0 +1,74 @@
+import os
+import tempfile
+from unittest.mock import call, patch
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.test import TestCase, override_settings
+from emailcontacts.importers import import_contacts
+from emailcontacts.models import Group, Contact
+from emailcontacts.tasks import import_contacts_task, validate_all_contacts, validate_contacts_task
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'liftsmail.settings')
+
+User = get_user_model()
+
+
+class ImportContactsTaskTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email='testuser@app.com', password="password")
+        self.group = Group.objects.create(name="Test Group", user=self.user)
+
+    def test_import_stored_file(self):
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            path = default_storage.save('contact_imports/upload', ContentFile(b"email,first_name\na@example.com,A\nb@example.com,B\n"))
+            with patch('emailcontacts.tasks.validate_contacts_task.delay') as validate, self.captureOnCommitCallbacks(execute=True):
+                result = import_contacts_task(self.group.id, path, 'csv')
+            validate.assert_called_once_with(self.group.id, None)
+            self.assertFalse(default_storage.exists(path))
+        self.assertEqual(result, {"group_id": self.group.id, "inserted": 2, "duplicates": 0, "invalid": 0})
+        self.assertEqual(Contact.objects.filter(group=self.group).count(), 2)
+
+    @override_settings(CONTACT_IMPORT_BATCH_SIZE=100)
+    def test_import_stops_at_undecodable_text(self):
+        content = "email\n" + "".join(f"user{i}@example.com\n" for i in range(1000))
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            path = default_storage.save('contact_imports/upload', ContentFile(content.encode() + b"\xff\n"))
+            with patch('emailcontacts.tasks.validate_contacts_task.delay'):
+                result = import_contacts_task(self.group.id, path, 'csv')
+        self.assertEqual(result["error"], "The file is not UTF-8 encoded text")
+        # The batches read before the bad bytes are kept and reported
+        self.assertGreater(result["inserted"], 0)
+        self.assertEqual(result["inserted"], Contact.objects.filter(group=self.group).count())
+
+    def test_import_counts_contacts_added_meanwhile_as_duplicates(self):
+        Contact.objects.create(group=self.group, email="existing@example.com")
+
+        def rows():
+            yield {"email": "existing@example.com"}
+            yield {"email": "new@example.com"}
+            # Added by a concurrent import after the group's emails were read
+            Contact.objects.create(group=self.group, email="late@example.com")
+            yield {"email": "late@example.com"}
+
+        summary = import_contacts(self.group, rows(), batch_size=10)
+        self.assertEqual(summary, {"inserted": 1, "duplicates": 2, "invalid": 0})
+        self.assertEqual(Contact.objects.filter(group=self.group).count(), 3)
+
+    @override_settings(CONTACT_DOMAIN_RESOLVER='emailcontacts.validation.StaticResolver', CONTACT_INVALID_DOMAINS=['invalid.test'])
+    def test_validate_contacts_task(self):
+        Contact.objects.create(group=self.group, email="a@example.com")
+        Contact.objects.create(group=self.group, email="b@invalid.test")
+        result = validate_contacts_task(self.group.id)
+        self.assertEqual(result["invalid"], 1)
+        self.assertFalse(Contact.objects.get(email="b@invalid.test").is_valid)
+
+    def test_validate_all_contacts_queues_groups_with_contacts(self):
+        other = Group.objects.create(name="Other Group", user=self.user)
+        Group.objects.create(name="Empty Group", user=self.user)
+        for group in (self.group, other):
+            Contact.objects.create(group=group, email="a@example.com")
+            Contact.objects.create(group=group, email="b@example.com")
+        with patch('emailcontacts.tasks.validate_contacts_task.delay') as validate:
+            validate_all_contacts()
+        self.assertCountEqual(validate.call_args_list, [call(self.group.id), call(other.id)])
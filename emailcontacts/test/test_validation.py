@@ -0,0 +1,94 @@
+import os
+from unittest.mock import patch
+import dns.name
+import dns.resolver
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from emailcontacts.models import Group, Contact
+from emailcontacts.validation import DNSResolver, DomainCache, StaticResolver, validate_contacts
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'liftsmail.settings')
+
+User = get_user_model()
+
+
+class CountingResolver:
+    def __init__(self, results):
+        self.results = results
+        self.calls = []
+
+    def resolve(self, domain):
+        self.calls.append(domain)
+        return self.results.get(domain, True)
+
+
+class MX:
+    def __init__(self, exchange):
+        self.exchange = dns.name.from_text(exchange)
+
+
+class DNSResolverTests(SimpleTestCase):
+    def lookup(self, answers):
+        def resolve(domain, record_type):
+            answer = answers.get(record_type, dns.resolver.NoAnswer())
+            if isinstance(answer, Exception):
+                raise answer
+            return answer
+
+        resolver = DNSResolver()
+        with patch.object(resolver.resolver, 'resolve', side_effect=resolve):
+            return resolver.resolve('example.com')
+
+    def test_mail_domains(self):
+        self.assertTrue(self.lookup({'MX': [MX('mail.example.com.')]}))
+        self.assertTrue(self.lookup({'A': ['93.184.216.34']}))
+        self.assertFalse(self.lookup({'MX': [MX('.')]}))
+        self.assertFalse(self.lookup({'MX': dns.resolver.NXDOMAIN()}))
+        self.assertFalse(self.lookup({}))
+
+    def test_failed_lookup_is_unknown(self):
+        self.assertIsNone(self.lookup({'MX': dns.resolver.LifetimeTimeout()}))
+        self.assertIsNone(self.lookup({'A': dns.resolver.NoNameservers()}))
+
+    @override_settings(CONTACT_INVALID_DOMAINS=['invalid.test'])
+    def test_static_resolver(self):
+        self.assertTrue(StaticResolver().resolve('example.com'))
+        self.assertFalse(StaticResolver().resolve('invalid.test'))
+
+
+class ValidateContactsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(email='testuser@app.com', password="password")
+        self.group = Group.objects.create(name="Test Group", user=self.user)
+        Contact.objects.bulk_create(
+            [Contact(group=self.group, email=f"user{i}@domain{i % 3}.com") for i in range(30)]
+            + [
+                Contact(group=self.group, email="not-an-email", is_valid=True),
+                Contact(group=self.group, email="user@nomail.com", is_valid=True),
+                Contact(group=self.group, email="user@timeout.com", is_valid=False),
+                Contact(group=self.group, email="fixed@domain0.com", is_valid=False),
+            ]
+        )
+
+    def test_validates_in_batches_with_one_lookup_per_domain(self):
+        resolver = CountingResolver({"nomail.com": False, "timeout.com": None})
+        summary = validate_contacts(self.group.id, batch_size=10, domains=DomainCache(resolver))
+        self.assertEqual(summary, {"checked": 34, "valid": 31, "invalid": 2, "unknown": 1, "updated": 3, "lookups": 5})
+        self.assertEqual(sorted(resolver.calls), ["domain0.com", "domain1.com", "domain2.com", "nomail.com", "timeout.com"])
+        self.assertEqual(
+            sorted(Contact.objects.filter(group=self.group, is_valid=False).values_list('email', flat=True)),
+            ["not-an-email", "user@nomail.com", "user@timeout.com"],
+        )
+
+        # A later job reads the cached results, only the failed lookup is retried
+        resolver = CountingResolver({"timeout.com": False})
+        summary = validate_contacts(self.group.id, domains=DomainCache(resolver))
+        self.assertEqual(resolver.calls, ["timeout.com"])
+        self.assertEqual(summary["updated"], 0)
+
+    def test_after_id_only_checks_newer_contacts(self):
+        last = Contact.objects.filter(group=self.group).order_by('id').values_list('id', flat=True)[31]
+        summary = validate_contacts(self.group.id, after_id=last, domains=DomainCache(CountingResolver({})))
+        self.assertEqual(summary["checked"], 2)
@@ -1,9 +1,12 @@
 import os
+from unittest.mock import patch
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 from rest_framework import status
 from rest_framework.test import APITestCase
-from emailcontacts.models import Group, Contact
+from emailcontacts.models import ContactImport, Group, Contact
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'liftsmail.settings')
 
@@ -33,6 +36,50 @@ class GroupViewTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(Group.objects.count(), 2)
 
+    def test_list_groups_with_counts(self):
+        Contact.objects.create(group=self.group, **self.contact_data)
+        Contact.objects.create(group=self.group, email="unsubscribed@example.com", is_subscribed=False)
+        Contact.objects.create(group=self.group, email="invalid@example.com", is_valid=False)
+        url = reverse('group-list-create')
+        self.client.force_authenticate(self.user)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNone(response.data['next'])
+        group = response.data['results'][0]
+        self.assertNotIn('contacts', group)
+        self.assertEqual((group['contact_count'], group['subscribed_count'], group['valid_count']), (3, 2, 2))
+
+    def test_list_groups_is_cursor_paginated(self):
+        for i in range(55):
+            Group.objects.create(name=f"Group {i}", user=self.user)
+        url = reverse('group-list-create')
+        self.client.force_authenticate(self.user)
+        response = self.client.get(url)
+        self.assertEqual(len(response.data['results']), 50)
+        response = self.client.get(response.data['next'])
+        self.assertEqual(len(response.data['results']), 6)
+
+    def test_list_groups_expand_contacts(self):
+        Contact.objects.create(group=self.group, **self.contact_data)
+        url = reverse('group-list-create')
+        self.client.force_authenticate(self.user)
+        response = self.client.get(url, {'expand': 'contacts'})
+        contacts = response.data['results'][0]['contacts']
+        self.assertIsNone(contacts['next'])
+        self.assertEqual([contact['email'] for contact in contacts['results']], ['john.doe@example.com'])
+
+    def test_expand_contacts_links_to_next_contact_page(self):
+        for i in range(3):
+            Contact.objects.create(group=self.group, email=f"user{i}@example.com")
+        url = reverse('group-detail', kwargs={'pk': self.group.id})
+        self.client.force_authenticate(self.user)
+        with patch('liftsmail.pagination.CreatedAtCursorPagination.page_size', 2):
+            response = self.client.get(url, {'expand': 'contacts'})
+            contacts = response.data['contacts']
+            self.assertEqual(len(contacts['results']), 2)
+            response = self.client.get(contacts['next'])
+        self.assertEqual([contact['email'] for contact in response.data['results']], ['user0@example.com'])
+
     def test_add_contact_to_group(self):
         url = reverse('contact-list-create', kwargs={'pk': self.group.id})
         self.client.force_authenticate(self.user)
@@ -55,14 +102,60 @@ class GroupViewTest(APITestCase):
         response = self.client.post(url, self.contact_data)
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
 
+    def test_update_contact_to_duplicate_email(self):
+        Contact.objects.create(group=self.group, **self.contact_data)
+        contact = Contact.objects.create(group=self.group, email="other@example.com")
+        url = reverse('contact-detail', kwargs={'group_id': self.group.id, 'pk': contact.id})
+        self.client.force_authenticate(self.user)
+        response = self.client.patch(url, {"email": "John.Doe@example.com"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('email', response.data)
+
     def test_get_group_contacts(self):
         Contact.objects.create(group=self.group, **self.contact_data)
         url = reverse('contact-list-create', kwargs={'pk': self.group.id})
         self.client.force_authenticate(self.user)
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['email'], 'john.doe@example.com')
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['email'], 'john.doe@example.com')
+
+    def test_get_group_contacts_keyset_pages(self):
+        contacts = [Contact.objects.create(group=self.group, email=f"user{i}@example.com") for i in range(5)]
+        # Same created_at for some rows, so the id breaks the tie
+        Contact.objects.filter(id__in=[contacts[1].id, contacts[2].id, contacts[3].id]).update(created_at=contacts[1].created_at)
+        url = reverse('contact-list-create', kwargs={'pk': self.group.id})
+        self.client.force_authenticate(self.user)
+
+        seen = []
+        response = self.client.get(url, {'page_size': 2})
+        self.assertIsNone(response.data['previous'])
+        while True:
+            seen.extend(contact['email'] for contact in response.data['results'])
+            if not response.data['next']:
+                break
+            response = self.client.get(response.data['next'])
+        self.assertEqual(sorted(seen), sorted(contact.email for contact in contacts))
+        self.assertEqual(len(seen), 5)
+
+        previous = self.client.get(response.data['previous'])
+        self.assertEqual(len(previous.data['results']), 2)
+        self.assertEqual([contact['email'] for contact in previous.data['results']], seen[2:4])
+
+    def test_get_group_contacts_page_size_capped(self):
+        url = reverse('contact-list-create', kwargs={'pk': self.group.id})
+        self.client.force_authenticate(self.user)
+        with patch('liftsmail.pagination.CreatedAtCursorPagination.max_page_size', 3):
+            for i in range(5):
+                Contact.objects.create(group=self.group, email=f"user{i}@example.com")
+            response = self.client.get(url, {'page_size': 1000})
+        self.assertEqual(len(response.data['results']), 3)
+
+    def test_get_group_contacts_invalid_cursor(self):
+        url = reverse('contact-list-create', kwargs={'pk': self.group.id})
+        self.client.force_authenticate(self.user)
+        response = self.client.get(url, {'cursor': 'bogus'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
     def test_delete_contact(self):
         contact = Contact.objects.create(group=self.group, **self.contact_data)
@@ -70,4 +163,92 @@ class GroupViewTest(APITestCase):
         self.client.force_authenticate(self.user)
         response = self.client.delete(url)
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
-        self.assertEqual(Contact.objects.count(), 0)
\ No newline at end of file
+        self.assertEqual(Contact.objects.count(), 0)
+
+
+class ContactImportTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(email='testuser@app.com', password="password")
+        self.group = Group.objects.create(name="Test Group", user=self.user)
+        Contact.objects.create(group=self.group, first_name="Existing", last_name="Contact", email="existing@example.com")
+        self.url = reverse('contact-import', kwargs={'pk': self.group.id})
+        self.client.force_authenticate(self.user)
+
+    def test_import_csv(self):
+        content = (
+            "Email,First_Name,Last_Name\n"
+            "John.Doe@Example.com ,John,Doe\n"
+            "jane@example.com,Jane,\n"
+            "john.doe@example.com,John,Again\n"
+            "EXISTING@example.com,Ex,Isting\n"
+            "not-an-email,Bad,Row\n"
+        )
+        upload = SimpleUploadedFile("contacts.csv", content.encode(), content_type="text/csv")
+        response = self.client.post(self.url, {"file": upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data, {"inserted": 2, "duplicates": 2, "invalid": 1})
+        jane = Contact.objects.get(email="jane@example.com")
+        self.assertEqual((jane.first_name, jane.last_name), ("Jane", None))
+        self.assertTrue(Contact.objects.filter(group=self.group, email="john.doe@example.com").exists())
+
+    def test_import_json_lines(self):
+        content = (
+            '{"email": "a@example.com", "first_name": "A"}\n'
+            '\n'
+            '{"email": "b@example.com"}\n'
+            'not json\n'
+        )
+        upload = SimpleUploadedFile("contacts.jsonl", content.encode())
+        existing = Contact.objects.get(email="existing@example.com")
+        with patch('emailcontacts.tasks.validate_contacts_task.delay') as validate, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.url, {"file": upload}, format='multipart')
+        # Only the imported contacts are validated
+        validate.assert_called_once_with(self.group.id, existing.id)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data, {"inserted": 2, "duplicates": 0, "invalid": 1})
+
+    def test_import_unsupported_file(self):
+        upload = SimpleUploadedFile("contacts.txt", b"a@example.com")
+        response = self.client.post(self.url, {"file": upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_import_unreadable_file(self):
+        for name, content in (("contacts.csv", b"email\na@example.com\n\xff\xfe\n"), ("contacts.csv", b"email\n" + b"a" * 200000)):
+            upload = SimpleUploadedFile(name, content)
+            response = self.client.post(self.url, {"file": upload}, format='multipart')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn("file", response.data)
+        self.assertEqual(Contact.objects.filter(group=self.group).count(), 1)
+
+    def test_not_group_owner_import(self):
+        user = User.objects.create(email='user@app.com', password="password")
+        self.client.force_authenticate(user)
+        upload = SimpleUploadedFile("contacts.csv", b"email\na@example.com\n")
+        response = self.client.post(self.url, {"file": upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    @override_settings(CONTACT_IMPORT_ASYNC_THRESHOLD=0)
+    @patch('emailcontacts.views.default_storage.save', return_value='contact_imports/upload')
+    @patch('emailcontacts.views.import_contacts_task.delay')
+    def test_large_import_handed_to_task(self, delay, save):
+        delay.return_value.id = 'task-id'
+        upload = SimpleUploadedFile("contacts.csv", b"email\na@example.com\n")
+        response = self.client.post(self.url, {"file": upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data["task_id"], 'task-id')
+        delay.assert_called_once_with(self.group.id, 'contact_imports/upload', 'csv')
+        self.assertEqual(ContactImport.objects.get(task_id='task-id').group, self.group)
+
+    def test_import_status_only_for_imports_into_group(self):
+        ContactImport.objects.create(task_id='task-id', group=self.group)
+        url = reverse('contact-import-status', kwargs={"pk": self.group.pk, "task_id": 'task-id'})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {"task_id": 'task-id', "status": 'PENDING'})
+
+        # A pending task of another group, or one never queued, is not found
+        other = Group.objects.create(name="Other Group", user=self.user)
+        other_url = reverse('contact-import-status', kwargs={"pk": other.pk, "task_id": 'task-id'})
+        self.assertEqual(self.client.get(other_url).status_code, status.HTTP_404_NOT_FOUND)
+        unknown_url = reverse('contact-import-status', kwargs={"pk": self.group.pk, "task_id": 'unknown'})
+        self.assertEqual(self.client.get(unknown_url).status_code, status.HTTP_404_NOT_FOUND)
@@ -1,11 +1,13 @@
 from django.urls import path
 
-from emailcontacts.views import ContactDetailView, ContactListCreateView, GroupDetailView, GroupListCreateView
+from emailcontacts.views import ContactDetailView, ContactImportStatusView, ContactImportView, ContactListCreateView, GroupDetailView, GroupListCreateView
 
 
 urlpatterns = [
     path('', GroupListCreateView.as_view(), name='group-list-create'),
     path('<int:pk>/', GroupDetailView.as_view(), name='group-detail'),
     path('<int:pk>/contacts/', ContactListCreateView.as_view(), name='contact-list-create'),
+    path('<int:pk>/contacts/import/', ContactImportView.as_view(), name='contact-import'),
+    path('<int:pk>/contacts/import/<str:task_id>/', ContactImportStatusView.as_view(), name='contact-import-status'),
     path('<int:group_id>/contacts/<int:pk>/', ContactDetailView.as_view(), name='contact-detail'),
 ]
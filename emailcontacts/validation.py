@@ -0,0 +1,151 @@
+import dns.exception
+import dns.name
+import dns.resolver
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.utils.module_loading import import_string
+from .models import Contact
+
+
+class DNSResolver:
+    """
+    Checks that a domain can receive mail.
+
+    A domain accepts mail when it has MX records, or failing those an A or AAAA
+    record (RFC 5321 implicit MX). A null MX (RFC 7505) or a domain that does not
+    exist is rejected. Timeouts and server failures return None, so the contact's
+    current flag is kept and the domain is looked up again on the next run.
+    """
+    def __init__(self, timeout=5):
+        self.resolver = dns.resolver.Resolver()
+        self.resolver.lifetime = timeout
+
+    def resolve(self, domain):
+        try:
+            answer = self.resolver.resolve(domain, 'MX')
+            return not all(record.exchange == dns.name.root for record in answer)
+        except dns.resolver.NXDOMAIN:
+            return False
+        except dns.resolver.NoAnswer:
+            pass
+        except dns.exception.DNSException:
+            return None
+        for record_type in ('A', 'AAAA'):
+            try:
+                self.resolver.resolve(domain, record_type)
+                return True
+            except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+                continue
+            except dns.exception.DNSException:
+                return None
+        return False
+
+
+class StaticResolver:
+    """
+    Accepts every domain except CONTACT_INVALID_DOMAINS, for running without network access.
+    """
+    def resolve(self, domain):
+        return domain not in settings.CONTACT_INVALID_DOMAINS
+
+
+def get_resolver():
+    return import_string(settings.CONTACT_DOMAIN_RESOLVER)()
+
+
+class DomainCache:
+    """
+    Domain check results shared by every validation job through the Django cache.
+
+    Each domain is resolved at most once per CONTACT_DOMAIN_CACHE_TTL seconds, so a
+    group's contacts cost one lookup per distinct domain rather than one per contact.
+    """
+    def __init__(self, resolver=None, timeout=None):
+        self.resolver = resolver or get_resolver()
+        self.timeout = settings.CONTACT_DOMAIN_CACHE_TTL if timeout is None else timeout
+        self.lookups = 0
+
+    @staticmethod
+    def key(domain):
+        return f'emailcontacts:domain:{domain}'
+
+    def check(self, domains):
+        """
+        Returns {domain: True, False or None} for a set of domains.
+        """
+        cached = cache.get_many([self.key(domain) for domain in domains])
+        results = {}
+        resolved = {}
+        for domain in domains:
+            key = self.key(domain)
+            if key in cached:
+                results[domain] = cached[key]
+                continue
+            self.lookups += 1
+            results[domain] = self.resolver.resolve(domain)
+            if results[domain] is not None:
+                resolved[key] = results[domain]
+        if resolved:
+            cache.set_many(resolved, self.timeout)
+        return results
+
+
+def check_syntax(email):
+    try:
+        validate_email(email)
+    except ValidationError:
+        return False
+    return True
+
+
+def validate_contacts(group_id, after_id=None, batch_size=None, domains=None):
+    """
+    Recomputes `is_valid` for a group's contacts.
+
+    Contacts are read in id order, `batch_size` at a time. Addresses that fail the
+    syntax check are invalid without a lookup, the rest are valid when their domain
+    accepts mail. Only contacts whose flag changed are written, with bulk_update.
+
+    Args:
+        group_id (int): The group whose contacts are validated.
+        after_id (int): Only contacts with a greater id are checked, such as those added by an import.
+        batch_size (int): Contacts read and written per query.
+        domains (DomainCache): Domain results, defaults to one using CONTACT_DOMAIN_RESOLVER.
+
+    Returns:
+        dict: The number of contacts checked, valid, invalid, left unchanged because
+        their domain could not be checked, and updated, with the domain lookups made.
+    """
+    batch_size = batch_size or settings.CONTACT_VALIDATION_BATCH_SIZE
+    domains = domains or DomainCache()
+    summary = {"checked": 0, "valid": 0, "invalid": 0, "unknown": 0, "updated": 0}
+    queryset = Contact.objects.filter(group_id=group_id).order_by('id').only('id', 'email', 'is_valid')
+    last_id = after_id or 0
+
+    while True:
+        contacts = list(queryset.filter(id__gt=last_id)[:batch_size])
+        if not contacts:
+            break
+        last_id = contacts[-1].id
+
+        syntax = {contact.id: check_syntax(contact.email) for contact in contacts}
+        results = domains.check({contact.email.rpartition('@')[2] for contact in contacts if syntax[contact.id]})
+        changed = []
+        for contact in contacts:
+            valid = syntax[contact.id] and results[contact.email.rpartition('@')[2]]
+            summary["checked"] += 1
+            if valid is None:
+                summary["unknown"] += 1
+                continue
+            summary["valid" if valid else "invalid"] += 1
+            if valid != contact.is_valid:
+                contact.is_valid = valid
+                changed.append(contact)
+        if changed:
+            Contact.objects.bulk_update(changed, ['is_valid'])
+            summary["updated"] += len(changed)
+
+    summary["lookups"] = domains.lookups
+    return summary
@@ -1,16 +1,49 @@
+import uuid
+from celery.result import AsyncResult
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import Prefetch
 from django.shortcuts import get_object_or_404
 from rest_framework import generics, status, serializers
+from rest_framework.parsers import MultiPartParser
 from rest_framework.permissions import IsAuthenticated
-from emailcontacts.serializers import ContactSerializer, GroupSerializer
-from .models import Group, Contact
-from .permissions import IsGroupOwner
+from rest_framework.response import Response
+from liftsmail.pagination import CreatedAtCursorPagination
+from emailcontacts.importers import ContactFileError, import_contacts, parse_contacts
+from emailcontacts.serializers import ContactImportSerializer, ContactSerializer, GroupSerializer
+from emailcontacts.tasks import import_contacts_task, last_contact_id, schedule_validation
+from .models import ContactImport, Group, Contact
+from .permissions import IsGroupOwner, IsOwner
 # Create your views here.
 
+DUPLICATE_CONTACT_ERROR = {'email': ['Contact with this email already exists in the group.']}
+
+
+class GroupQuerysetMixin:
+    """
+    Annotates groups with their contact counts, and prefetches the first page of
+    contacts when the request opts in with `?expand=contacts`.
+    """
+    def expand_contacts(self):
+        expand = self.request.query_params.get('expand', '')
+        return 'contacts' in expand.split(',')
+
+    def get_queryset(self):
+        queryset = super().get_queryset().with_contact_counts()
+        if self.expand_contacts():
+            page_size = CreatedAtCursorPagination.page_size
+            contacts = Contact.objects.order_by(*CreatedAtCursorPagination.ordering)[:page_size]
+            queryset = queryset.prefetch_related(Prefetch('contacts', queryset=contacts, to_attr='contact_page'))
+        return queryset
+
+
 # List or create groups
-class GroupListCreateView(generics.ListCreateAPIView):
+class GroupListCreateView(GroupQuerysetMixin, generics.ListCreateAPIView):
     queryset = Group.objects.all()
     serializer_class = GroupSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = CreatedAtCursorPagination
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
@@ -20,16 +53,15 @@ class GroupListCreateView(generics.ListCreateAPIView):
         return context.filter(user=self.request.user)
 
 # Group details
-class GroupDetailView(generics.RetrieveUpdateDestroyAPIView):
+class GroupDetailView(GroupQuerysetMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Group.objects.all()
     serializer_class = GroupSerializer
     permission_classes = [IsAuthenticated, IsGroupOwner]
 
-# Create contacts within a group, list all contacts in a group
-class ContactListCreateView(generics.ListCreateAPIView):
-    serializer_class = ContactSerializer
-    permission_classes = [IsAuthenticated, IsGroupOwner]
-
+class GroupObjectMixin:
+    """
+    Looks up the group from the `pk` URL kwarg and checks the object permissions on it.
+    """
     def get_group(self):
         if getattr(self, 'swagger_fake_view', False):
             return None
@@ -38,6 +70,13 @@ class ContactListCreateView(generics.ListCreateAPIView):
         group = get_object_or_404(Group, id=group_id)
         self.check_object_permissions(self.request, group)
         return group
+
+
+# Create contacts within a group, list all contacts in a group
+class ContactListCreateView(GroupObjectMixin, generics.ListCreateAPIView):
+    serializer_class = ContactSerializer
+    permission_classes = [IsAuthenticated, IsGroupOwner]
+    pagination_class = CreatedAtCursorPagination
     
     def get_queryset(self):
         group = self.get_group()
@@ -45,12 +84,13 @@ class ContactListCreateView(generics.ListCreateAPIView):
 
     def perform_create(self, serializer):
         group = self.get_group()
-        email = serializer.validated_data['email']
-    
-        existing_contact = Contact.objects.filter(email=email, group=group).first()
-        if existing_contact:
-            raise serializers.ValidationError({'email': ['Contact with this email already exists in the group.']})
-        serializer.save(group=group)
+
+        # The (group, email) unique constraint rejects duplicates, no read before the insert
+        try:
+            with transaction.atomic():
+                serializer.save(group=group)
+        except IntegrityError:
+            raise serializers.ValidationError(DUPLICATE_CONTACT_ERROR)
 
 
 # view a contact detail
@@ -76,6 +116,59 @@ class ContactDetailView(generics.RetrieveUpdateDestroyAPIView):
         contact = get_object_or_404(Contact, id=contact_id, group=group)
         return contact
 
-# todo
-# - Process email lists from csv, json
-# -	add emails to the email group through a list of objects, or processed files.
\ No newline at end of file
+    def perform_update(self, serializer):
+        try:
+            with transaction.atomic():
+                serializer.save()
+        except IntegrityError:
+            raise serializers.ValidationError(DUPLICATE_CONTACT_ERROR)
+
+
+# Import contacts into a group from a CSV or JSON lines file
+class ContactImportView(GroupObjectMixin, generics.GenericAPIView):
+    serializer_class = ContactImportSerializer
+    permission_classes = [IsAuthenticated, IsGroupOwner]
+    parser_classes = [MultiPartParser]
+
+    def post(self, request, *args, **kwargs):
+        group = self.get_group()
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        upload = serializer.validated_data['file']
+        file_format = serializer.validated_data['format']
+
+        # Large files are parsed by a worker, the client polls the import status endpoint
+        if upload.size > settings.CONTACT_IMPORT_ASYNC_THRESHOLD:
+            path = default_storage.save(f'contact_imports/{uuid.uuid4().hex}', upload)
+            task = import_contacts_task.delay(group.id, path, file_format)
+            ContactImport.objects.create(task_id=task.id, group=group)
+            return Response({"task_id": task.id, "status": "PENDING"}, status=status.HTTP_202_ACCEPTED)
+
+        last_id = last_contact_id(group.id)
+        try:
+            # A file that turns out unreadable halfway imports nothing
+            with transaction.atomic():
+                summary = import_contacts(group, parse_contacts(upload.file, file_format))
+        except ContactFileError as e:
+            raise serializers.ValidationError({"file": [str(e)]})
+        if summary["inserted"]:
+            schedule_validation(group.id, last_id)
+        return Response(summary, status=status.HTTP_201_CREATED)
+
+
+# Progress and summary of a contact import handed off to a worker
+class ContactImportStatusView(GroupObjectMixin, generics.GenericAPIView):
+    permission_classes = [IsAuthenticated, IsOwner]
+
+    def get(self, request, *args, **kwargs):
+        group = self.get_group()
+        # Only imports queued into the group are reported, whatever state their task is in
+        contact_import = get_object_or_404(ContactImport, task_id=self.kwargs['task_id'], group=group)
+        result = AsyncResult(contact_import.task_id)
+        info = result.info if isinstance(result.info, dict) else {}
+        data = {"task_id": result.id, "status": result.status}
+        if result.failed():
+            data["error"] = str(result.info)
+        else:
+            data.update({key: value for key, value in info.items() if key != 'group_id'})
+        return Response(data)
\ No newline at end of file
@@ -1,7 +1,10 @@
 from django.contrib import admin
-from .models import EmailSession, EmailTemplate
+from .models import EmailAttachment, EmailDelivery, EmailSession, EmailTemplate, Suppression
 
 # Register your models here.
 
 admin.site.register(EmailTemplate)
-admin.site.register(EmailSession)
\ No newline at end of file
+admin.site.register(EmailAttachment)
+admin.site.register(EmailSession)
+admin.site.register(EmailDelivery)
+admin.site.register(Suppression)
\ No newline at end of file
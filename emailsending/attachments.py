@@ -0,0 +1,101 @@
+import base64
+import mimetypes
+import mmap
+from contextlib import contextmanager
+from email import encoders
+from email.mime.base import MIMEBase
+from django.core.mail.message import MIMEMixin
+from django.db.models import Q
+from emailsending.models import EmailAttachment
+
+DEFAULT_MIMETYPE = 'application/octet-stream'
+
+
+class AttachmentPart(MIMEMixin, MIMEBase):
+    # MIMEMixin adds the as_bytes(linesep=...) Django's messages use
+    pass
+
+
+def guess_mimetype(filename, content_type=None):
+    """
+    Returns the MIME type of an uploaded file, from its name first as clients often send a generic type.
+    """
+    guessed, _ = mimetypes.guess_type(filename)
+    return guessed or content_type or DEFAULT_MIMETYPE
+
+
+@contextmanager
+def open_content(attachment):
+    """
+    Yields the content of a stored attachment without copying it into memory when possible.
+
+    Files on local storage are memory-mapped, other storages are read.
+    """
+    try:
+        path = attachment.file.path
+    except NotImplementedError:
+        path = None
+    if path is None:
+        with attachment.file.open('rb') as stored:
+            yield stored.read()
+        return
+    with open(path, 'rb') as stored:
+        if not attachment.size:
+            yield b''
+            return
+        with mmap.mmap(stored.fileno(), 0, access=mmap.ACCESS_READ) as content:
+            yield content
+
+
+class SharedAttachment:
+    """
+    An attachment encoded once and shared by every message of a chunk.
+
+    `data` is the serialized MIME part with CRLF line breaks, the same bytes Django
+    writes for it inside a message. Prepared messages reference it rather than copying
+    it, messages built the regular way attach the part returned by mime().
+    """
+    def __init__(self, filename, mimetype, content):
+        self.filename = filename
+        self.mimetype = mimetype
+        self.part = self.empty_part()
+        head = self.part.as_bytes(linesep='\r\n')
+        self.data = head + base64.encodebytes(content).replace(b'\n', b'\r\n')
+        self.header_length = len(head)
+        self._mime = None
+
+    @classmethod
+    def from_model(cls, attachment):
+        with open_content(attachment) as content:
+            return cls(attachment.filename, attachment.mimetype, content)
+
+    def empty_part(self):
+        # The headers Django gives a non-text attachment, see EmailMessage._create_attachment()
+        basetype, subtype = self.mimetype.split('/', 1)
+        part = AttachmentPart(basetype, subtype)
+        part.set_payload(b'')
+        encoders.encode_base64(part)
+        filename = self.filename
+        if not filename.isascii():
+            filename = ('utf-8', '', filename)
+        part.add_header('Content-Disposition', 'attachment', filename=filename)
+        return part
+
+    def mime(self):
+        """
+        Returns the attachment as a MIME part, created on first use.
+        """
+        if self._mime is None:
+            self._mime = self.empty_part()
+            self._mime.set_payload(self.data[self.header_length:].replace(b'\r\n', b'\n').decode('ascii'))
+        return self._mime
+
+
+def session_attachments(session_id):
+    """
+    Encodes the attachments of an email session: those chosen when it was sent and those of its template.
+    """
+    attachments = EmailAttachment.objects.filter(
+        Q(sessions=session_id) | Q(template__emailsession=session_id)
+    ).distinct().order_by('id')
+    return [SharedAttachment.from_model(attachment) for attachment in attachments]
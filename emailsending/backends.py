@@ -0,0 +1,191 @@
+import asyncio
+import threading
+import aiosmtplib
+from django.conf import settings
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.mail.message import sanitize_address
+from emailsending.delivery import failure_status
+from emailsending.models import EmailDelivery
+
+
+class AsyncSMTPEmailBackend(BaseEmailBackend):
+    """
+    Email backend that delivers over several concurrent SMTP sessions with asyncio.
+
+    open() starts an event loop on a background thread and connects `connections`
+    sessions, which stay open until close(). send_messages() spreads the messages
+    across those sessions, so a slow server round trip on one session does not hold
+    up the others. Used outside open()/close(), each send_messages() call connects
+    and disconnects on its own, like Django's SMTP backend.
+
+    The outcome of each message is stored on it as `delivery_outcome`, a
+    (status, error) pair, so BatchSender can send a whole chunk in one call.
+    """
+    reports_outcomes = True
+
+    def __init__(self, host=None, port=None, username=None, password=None, use_tls=None,
+                 use_ssl=None, timeout=None, connections=None, fail_silently=False, **kwargs):
+        super().__init__(fail_silently=fail_silently)
+        self.host = host or settings.EMAIL_HOST
+        self.port = port or settings.EMAIL_PORT
+        self.username = settings.EMAIL_HOST_USER if username is None else username
+        self.password = settings.EMAIL_HOST_PASSWORD if password is None else password
+        self.use_tls = settings.EMAIL_USE_TLS if use_tls is None else use_tls
+        self.use_ssl = settings.EMAIL_USE_SSL if use_ssl is None else use_ssl
+        self.timeout = settings.EMAIL_TIMEOUT if timeout is None else timeout
+        self.connections = connections or settings.EMAIL_ASYNC_SMTP_CONNECTIONS
+        self.loop = None
+        self.thread = None
+        self.sessions = []
+        self._lock = threading.RLock()
+
+    def open(self):
+        """
+        Starts the event loop and connects the SMTP sessions.
+
+        Returns:
+            bool: True if new sessions were opened, False if they already were.
+        """
+        with self._lock:
+            if self.loop is not None:
+                return False
+            self.loop = asyncio.new_event_loop()
+            self.thread = threading.Thread(target=self.loop.run_forever, name='async-smtp', daemon=True)
+            self.thread.start()
+            try:
+                self.sessions = self._run(self._connect_all())
+            except Exception:
+                self._stop_loop()
+                if not self.fail_silently:
+                    raise
+                return False
+            return True
+
+    def close(self):
+        with self._lock:
+            if self.loop is None:
+                return
+            try:
+                self._run(self._quit_all([client for client in self.sessions if client is not None]))
+            finally:
+                self.sessions = []
+                self._stop_loop()
+
+    def ping(self):
+        """
+        Sends NOOP on every open session.
+
+        Returns:
+            bool: True if all sessions answered.
+        """
+        with self._lock:
+            if self.loop is None or not self.sessions:
+                return False
+            return self._run(self._noop_all(self.sessions))
+
+    def send_messages(self, email_messages):
+        """
+        Sends the messages over the open sessions and returns the number sent.
+        """
+        if not email_messages:
+            return 0
+        with self._lock:
+            new_conn_created = self.open()
+            if self.loop is None or not self.sessions:
+                # open() failed silently
+                return 0
+            try:
+                sent, errors = self._run(self._send_all(email_messages))
+            finally:
+                if new_conn_created:
+                    self.close()
+        if errors and not self.fail_silently:
+            raise errors[0]
+        return sent
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def _stop_loop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.loop = None
+        self.thread = None
+
+    def _client(self):
+        return aiosmtplib.SMTP(
+            hostname=self.host,
+            port=self.port,
+            username=self.username or None,
+            password=self.password or None,
+            use_tls=self.use_ssl,
+            start_tls=self.use_tls,
+            timeout=self.timeout,
+        )
+
+    async def _connect(self):
+        client = self._client()
+        await client.connect()
+        return client
+
+    async def _connect_all(self):
+        return list(await asyncio.gather(*[self._connect() for _ in range(self.connections)]))
+
+    async def _quit_all(self, sessions):
+        async def quit(client):
+            try:
+                await client.quit()
+            except aiosmtplib.SMTPException:
+                client.close()
+        await asyncio.gather(*[quit(client) for client in sessions], return_exceptions=True)
+
+    async def _noop_all(self, sessions):
+        results = await asyncio.gather(*[client.noop() for client in sessions], return_exceptions=True)
+        return not any(isinstance(result, Exception) for result in results)
+
+    async def _send_all(self, email_messages):
+        queue = asyncio.Queue()
+        for message in email_messages:
+            queue.put_nowait(message)
+        errors = []
+        counts = await asyncio.gather(*[
+            self._drain(index, queue, errors) for index in range(min(len(self.sessions), len(email_messages)))
+        ])
+        return sum(counts), errors
+
+    async def _drain(self, index, queue, errors):
+        """
+        Sends messages from the queue over one session until the queue is empty.
+        """
+        sent = 0
+        # A session that could not be reconnected leaves the queue to the others
+        while not queue.empty() and self.sessions[index] is not None:
+            message = queue.get_nowait()
+            try:
+                if await self._send(index, message):
+                    sent += 1
+                    message.delivery_outcome = (EmailDelivery.SENT, '')
+            except (aiosmtplib.SMTPException, OSError) as e:
+                errors.append(e)
+                message.delivery_outcome = (failure_status(e), str(e))
+        return sent
+
+    async def _send(self, index, email_message):
+        if not email_message.recipients():
+            return False
+        encoding = email_message.encoding or settings.DEFAULT_CHARSET
+        from_email = sanitize_address(email_message.from_email, encoding)
+        recipients = [sanitize_address(addr, encoding) for addr in email_message.recipients()]
+        message = email_message.message().as_bytes(linesep='\r\n')
+        try:
+            await self.sessions[index].sendmail(from_email, recipients, message)
+        except aiosmtplib.SMTPServerDisconnected:
+            # The server may have accepted the message before dropping the session, so it
+            # is not sent again. The next messages go over a new session
+            try:
+                self.sessions[index] = await self._connect()
+            except (aiosmtplib.SMTPException, OSError):
+                self.sessions[index] = None
+            raise
+        return True
@@ -0,0 +1,226 @@
+import asyncio
+import math
+import platform
+import socket
+import time
+import uuid
+from contextlib import contextmanager
+from unittest.mock import patch
+import django
+from aiosmtpd.controller import Controller
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from emailcontacts.models import Contact, Group
+from emailsending.delivery import CampaignMessage, build_html_message
+from emailsending.tasks import send_bulk_emails
+from emailsending.utils import format_email, get_text_renderer
+
+User = get_user_model()
+
+TEMPLATE = (
+    "<p>Hello {{ first_name }} {{ last_name }},</p>"
+    "<p>Your subscription for {{ email }} renews next week. Reply to this email if you have any questions.</p>"
+    "<p>Thanks,<br>The team</p>"
+)
+
+# Settings every case runs with: no rate limiting or quotas, so only the pipeline itself is timed
+BENCHMARK_SETTINGS = {
+    'EMAIL_RATE_LIMITS': {},
+    'EMAIL_QUOTAS': {},
+    'ALLOWED_HOSTS': ['testserver'],
+}
+
+
+class SinkHandler:
+    """
+    Accepts every message after `latency` seconds, like a remote server's round trip.
+    """
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.received = 0
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.received += 1
+        return '250 Message accepted for delivery'
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@contextmanager
+def smtp_sink(latency=0):
+    """
+    Runs a local SMTP server that accepts and discards mail, yielding its port.
+    """
+    port = free_port()
+    controller = Controller(SinkHandler(latency), hostname='127.0.0.1', port=port)
+    controller.start()
+    try:
+        yield port
+    finally:
+        controller.stop()
+
+
+def timed(func, repeat):
+    """
+    Runs func `repeat` times and returns the fastest wall time in seconds.
+    """
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def seed(size):
+    """
+    Creates a user with a group of `size` synthetic contacts.
+    """
+    user = User.objects.create_user(email=f'benchmark-{uuid.uuid4().hex}@liftsmail.local')
+    group = Group.objects.create(name=f'benchmark-{uuid.uuid4().hex}', user=user)
+    Contact.objects.bulk_create(
+        (
+            Contact(first_name=f'First{i}', last_name=f'Last{i}', email=f'contact{i}@example.com', group=group)
+            for i in range(size)
+        ),
+        batch_size=5000,
+    )
+    return user, group
+
+
+class BenchmarkSuite:
+    """
+    Times the render, enqueue, send and contact listing paths at several group sizes.
+
+    Everything seeded is rolled back once a size has been measured. Each case is run
+    `repeat` times and the fastest run is kept.
+    """
+    def __init__(self, sizes, repeat=3, requests=20):
+        self.sizes = sizes
+        self.repeat = repeat
+        self.requests = requests
+        self.results = {}
+
+    def record(self, name, size, seconds, items):
+        self.results[f'{name}@{size}'] = {
+            "seconds": seconds,
+            "items": items,
+            "per_second": items / seconds if seconds else None,
+        }
+
+    def run(self):
+        with override_settings(**BENCHMARK_SETTINGS):
+            for size in self.sizes:
+                with transaction.atomic():
+                    user, group = seed(size)
+                    self.run_size(size, user, group)
+                    transaction.set_rollback(True)
+        return {
+            "meta": {
+                "created_at": timezone.now().isoformat(),
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "sizes": self.sizes,
+                "repeat": self.repeat,
+            },
+            "results": self.results,
+        }
+
+    def run_size(self, size, user, group):
+        contact_list = list(group.contacts.order_by('id').values('id', 'email', 'first_name', 'last_name'))
+        client = APIClient()
+        client.force_authenticate(user)
+
+        self.record('format_email', size, timed(lambda: [format_email(TEMPLATE, contact) for contact in contact_list], self.repeat), size)
+
+        # Message construction and serialization, as a backend does it, on pre-rendered bodies
+        bodies = [(format_email(TEMPLATE, contact), contact['email']) for contact in contact_list]
+
+        def per_message():
+            for body, email in bodies:
+                build_html_message("Benchmark", body, user.email, email).message().as_bytes(linesep='\r\n')
+
+        def campaign():
+            factory = CampaignMessage("Benchmark", user.email)
+            for body, email in bodies:
+                factory.build(body, email).message().as_bytes(linesep='\r\n')
+
+        def campaign_with_text():
+            # Rendering the text part is included, it is the extra work a multipart/alternative message costs
+            factory = CampaignMessage("Benchmark", user.email, text=True)
+            text = get_text_renderer(TEMPLATE)
+            for (body, email), contact in zip(bodies, contact_list):
+                factory.build(body, email, text.render(contact)).message().as_bytes(linesep='\r\n')
+
+        self.record('build_messages[per message]', size, timed(per_message, self.repeat), size)
+        self.record('build_messages[campaign]', size, timed(campaign, self.repeat), size)
+        self.record('build_messages[campaign, text]', size, timed(campaign_with_text, self.repeat), size)
+
+        with patch('emailsending.views.dispatch_email_session.delay'):
+            data = {"session": "Benchmark", "template": {"subject": "Benchmark", "body": TEMPLATE}, "group_id": group.id}
+            send_view = lambda: [client.post(reverse('send-mail'), data, format='json') for _ in range(self.requests)]
+            self.record('send_mail_view', size, timed(send_view, self.repeat), self.requests)
+
+        def send():
+            summary = send_bulk_emails("Benchmark", TEMPLATE, user.email, contact_list)
+            assert summary["sent"] == size, summary
+
+        with override_settings(EMAIL_BULK_BACKEND='django.core.mail.backends.locmem.EmailBackend'):
+            self.record('send_bulk_emails[locmem]', size, timed(send, self.repeat), size)
+
+        with smtp_sink() as port:
+            smtp = dict(EMAIL_HOST='127.0.0.1', EMAIL_PORT=port, EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD='', EMAIL_USE_TLS=False, EMAIL_USE_SSL=False)
+            with override_settings(EMAIL_BULK_BACKEND='django.core.mail.backends.smtp.EmailBackend', **smtp):
+                self.record('send_bulk_emails[smtp]', size, timed(send, self.repeat), size)
+            with override_settings(EMAIL_BULK_BACKEND='emailsending.backends.AsyncSMTPEmailBackend', **smtp):
+                self.record('send_bulk_emails[async smtp]', size, timed(send, self.repeat), size)
+
+        def list_contacts():
+            # The first page, then the next four by following the cursor
+            url = reverse('contact-list-create', kwargs={"pk": group.id})
+            for _ in range(5):
+                url = client.get(url).data['next']
+                if url is None:
+                    break
+
+        self.record('contact_list', size, timed(list_contacts, self.repeat), 5)
+        groups = lambda: [client.get(reverse('group-list-create'), {"expand": "contacts"}) for _ in range(self.requests)]
+        self.record('group_list', size, timed(groups, self.repeat), self.requests)
+
+
+def compare(results, baseline, threshold):
+    """
+    Compares a run with a stored baseline.
+
+    Args:
+        results (dict): The `results` of the current run.
+        baseline (dict): The `results` of the baseline run.
+        threshold (float): Allowed slowdown before a case is flagged, 0.2 for 20%.
+
+    Returns:
+        list: (case, baseline seconds, current seconds, change, regressed) for the cases in both runs.
+            A case that took no measurable time in the baseline changes by 0 if it still
+            does, otherwise by infinity.
+    """
+    rows = []
+    for case, current in results.items():
+        previous = baseline.get(case)
+        if previous is None:
+            continue
+        if previous["seconds"]:
+            change = current["seconds"] / previous["seconds"] - 1
+        else:
+            change = math.inf if current["seconds"] else 0.0
+        rows.append((case, previous["seconds"], current["seconds"], change, change > threshold))
+    return rows
@@ -0,0 +1,515 @@
+import logging
+import re
+import smtplib
+import uuid
+from datetime import timedelta
+from email.utils import formatdate, make_msgid
+from itertools import islice
+import aiosmtplib
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.mail.message import RFC5322_EMAIL_LINE_LENGTH_LIMIT
+from django.core.mail.utils import DNS_NAME
+from django.db import DatabaseError
+from django.db.models import F
+from django.utils import timezone
+from emailsending.models import EmailDelivery, EmailSession
+from emailsending.pool import get_pool
+
+logger = logging.getLogger(__name__)
+
+# Line breaks the email generator turns into the output line separator
+NEWLINES = re.compile(r'\r\n|\r|\n')
+
+# Plain addresses that sanitize_address() leaves as they are and that fit on one header line
+PLAIN_ADDRESS = re.compile(
+    r"[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+(\.[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+)*@[A-Za-z0-9-]+(\.[A-Za-z0-9-]+)*"
+)
+MAX_PLAIN_ADDRESS_LENGTH = 74
+
+# Errors the server answered with, the message was refused and nothing was delivered
+REFUSED_ERRORS = (
+    smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused,
+    aiosmtplib.SMTPResponseException, aiosmtplib.SMTPRecipientsRefused,
+)
+
+# Error of a delivery whose task stopped while sending it
+INTERRUPTED_ERROR = "The send was interrupted, the message may have been delivered"
+
+
+def chunked(iterable, size):
+    """
+    Splits an iterable into lists of at most `size` items without materializing it.
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def failure_status(error):
+    """
+    Returns the delivery status of a message whose sending raised `error`.
+
+    A refusal from the server is FAILED and may be retried. A lost connection or a
+    timeout is UNKNOWN, since the server may have accepted the message before the
+    session broke. Any other error is raised before the message reaches the server.
+    """
+    if isinstance(error, REFUSED_ERRORS):
+        return EmailDelivery.FAILED
+    if isinstance(error, OSError):
+        return EmailDelivery.UNKNOWN
+    return EmailDelivery.FAILED
+
+
+def build_html_message(subject, html_message, sender_email, recipient, text_message=''):
+    """
+    Builds an HTML email for a single recipient, the same shape send_mail(html_message=...) produces.
+
+    Args:
+        subject (str): The subject of the email.
+        html_message (str): The personalized HTML content.
+        sender_email (str): The sender's email address.
+        recipient (str): The recipient's email address.
+        text_message (str): The plain text alternative, sent before the HTML part when given.
+
+    Returns:
+        EmailMultiAlternatives: The message, not yet bound to a connection.
+    """
+    message = EmailMultiAlternatives(
+        subject=subject,
+        body=text_message,
+        from_email=sender_email,
+        to=[recipient],
+    )
+    message.attach_alternative(html_message, 'text/html')
+    return message
+
+
+class PreparedMIME:
+    """
+    A serialized MIME message, standing in for the email.message.Message that
+    EmailMessage.message() returns. It covers what Django's backends use.
+
+    The message is kept as a sequence of byte strings, so parts shared by the
+    messages of a campaign are referenced rather than copied until it is sent.
+    """
+    def __init__(self, segments):
+        # Lines are separated with CRLF, as SMTP sends them
+        self.segments = segments
+
+    def as_bytes(self, unixfrom=False, linesep='\n'):
+        data = b''.join(self.segments)
+        return data if linesep == '\r\n' else data.replace(b'\r\n', linesep.encode())
+
+    def as_string(self, unixfrom=False, linesep='\n'):
+        return self.as_bytes(linesep=linesep).decode('utf-8', 'surrogateescape')
+
+    def get_charset(self):
+        return None
+
+
+class PreparedEmailMessage(EmailMultiAlternatives):
+    """
+    An HTML email whose MIME bytes were assembled by a CampaignMessage.
+
+    Shared attachments are part of the bytes only, they are not listed in `attachments`.
+    """
+    def __init__(self, segments, shared_attachments=(), **kwargs):
+        super().__init__(**kwargs)
+        self.segments = segments
+        self.shared_attachments = shared_attachments
+
+    def message(self):
+        return PreparedMIME(self.segments)
+
+
+class CampaignMessage:
+    """
+    Builds the messages of one campaign around headers and attachments encoded once.
+
+    The MIME structure, encoded subject and sender are serialized once, from a
+    message built by build_html_message(). Each message then only adds its To,
+    Date and Message-ID headers and its HTML part, and its plain text part when the
+    campaign is built with `text`, producing the same bytes build_html_message()
+    would. Attachments (SharedAttachment) are encoded by the caller once per chunk
+    and every message references the same bytes. Recipients that need encoding and
+    bodies with lines too long for 8bit transfer are built with build_html_message().
+    """
+    def __init__(self, subject, sender_email, attachments=(), text=False):
+        self.subject = subject
+        self.sender_email = sender_email
+        self.attachments = tuple(attachments)
+        self.text = text
+        self.prepared = settings.DEFAULT_CHARSET.lower() in ('utf-8', 'utf8')
+
+        skeleton = EmailMultiAlternatives(subject=subject, body='x' if text else '', from_email=sender_email)
+        skeleton.attach_alternative('x', 'text/html')
+        if self.attachments:
+            skeleton.attach(self.attachments[0].empty_part())
+        mime = skeleton.message()
+        data = mime.as_bytes(linesep='\r\n')
+
+        # Everything up to Date is shared, To goes in front of it
+        self.head = data[:data.index(b'\r\nDate: ') + 2]
+        # From the blank line after the headers to the first part, which holds one boundary or two
+        message_id = data.index(b'\r\nMessage-ID: ') + 2
+        html = data.index(b'Content-Type: text/html')
+        first = data.index(b'Content-Type: text/plain') if text else html
+        self.opening = data[data.index(b'\r\n', message_id) + 2:first]
+        # The boundary line between the text part and the HTML part
+        self.separator = data[data.index(b'\r\n\r\nx', first) + 5:html] if text else b''
+        body = data.index(b'\r\n\r\nx', html) + 4
+        self.boundaries = [mime.get_boundary().encode()]
+        if self.attachments:
+            outer = b'\r\n--' + self.boundaries[0]
+            self.boundaries.append(mime.get_payload()[0].get_boundary().encode())
+            self.closing = data[body + 1:data.index(outer + b'\r\n', body)]
+            self.tail = [segment for attachment in self.attachments for segment in (outer + b'\r\n', attachment.data)]
+            self.tail.append(outer + b'--\r\n')
+        else:
+            self.closing = data[body + 1:]
+            self.tail = []
+
+    def fallback(self, html_message, recipient, text_message=''):
+        message = build_html_message(self.subject, html_message, self.sender_email, recipient, text_message)
+        for attachment in self.attachments:
+            message.attach(attachment.mime())
+        return message
+
+    def encode(self, content):
+        """
+        Returns the part body as sent, or None if it has to be built by the email package.
+        """
+        body = NEWLINES.sub('\r\n', content).encode('utf-8', 'surrogateescape')
+        if len(body) > RFC5322_EMAIL_LINE_LENGTH_LIMIT and any(
+            len(line.encode(errors='surrogateescape')) > RFC5322_EMAIL_LINE_LENGTH_LIMIT
+            for line in content.splitlines()
+        ):
+            return None
+        if any(boundary in body for boundary in self.boundaries):
+            return None
+        return body
+
+    @staticmethod
+    def part_headers(subtype, content):
+        return b''.join((
+            b'Content-Type: text/', subtype, b'; charset="utf-8"\r\nMIME-Version: 1.0\r\n',
+            b'Content-Transfer-Encoding: ', b'7bit' if content.isascii() else b'8bit', b'\r\n\r\n',
+        ))
+
+    def build(self, html_message, recipient, text_message=''):
+        """
+        Builds the message for one recipient.
+
+        Args:
+            html_message (str): The personalized HTML content.
+            recipient (str): The recipient's email address.
+            text_message (str): The personalized plain text alternative, for campaigns built with `text`.
+
+        Returns:
+            EmailMultiAlternatives: The message, not yet bound to a connection.
+        """
+        if not self.prepared or len(recipient) > MAX_PLAIN_ADDRESS_LENGTH or not PLAIN_ADDRESS.fullmatch(recipient):
+            return self.fallback(html_message, recipient, text_message)
+        # An empty text part is left out of the message, which changes its structure
+        if self.text != bool(text_message):
+            return self.fallback(html_message, recipient, text_message)
+        body = self.encode(html_message)
+        if body is None:
+            return self.fallback(html_message, recipient, text_message)
+        parts = (body,)
+        if self.text:
+            text = self.encode(text_message)
+            if text is None:
+                return self.fallback(html_message, recipient, text_message)
+            parts = (self.part_headers(b'plain', text_message), text, self.separator, self.part_headers(b'html', html_message), body)
+
+        headers = b''.join((
+            self.head,
+            b'To: ', recipient.encode(), b'\r\n',
+            b'Date: ', formatdate(localtime=settings.EMAIL_USE_LOCALTIME).encode(), b'\r\n',
+            b'Message-ID: ', make_msgid(domain=DNS_NAME).encode(), b'\r\n',
+            self.opening,
+        ))
+        if not self.text:
+            headers += self.part_headers(b'html', html_message)
+        return PreparedEmailMessage(
+            (headers, *parts, self.closing, *self.tail),
+            shared_attachments=self.attachments,
+            subject=self.subject,
+            body=text_message,
+            from_email=self.sender_email,
+            to=[recipient],
+            alternatives=[(html_message, 'text/html')],
+        )
+
+
+class DeliveryCheckpoint:
+    """
+    Per-recipient progress of a session, used to make chunk sends resumable and idempotent.
+
+    Creating the checkpoint inserts the missing delivery rows (one per session and
+    contact, enforced by a unique constraint) and claims the ones still to be sent
+    with a single conditional UPDATE. Only claimed rows are sent, so a rerun or a
+    concurrent duplicate of the same chunk skips recipients already sent or being
+    sent by another run. After each batch, record() stores the outcome of every
+    message, so a task that stops halfway resumes after the last recorded batch.
+    Rows whose outcome is unknown are never claimed again. Failed rows are, until
+    EMAIL_DELIVERY_MAX_ATTEMPTS, but only when their chunk runs again: a Celery
+    retry or redelivery of the chunk task, or a rerun by hand. Nothing schedules a
+    retry of failed deliveries on its own.
+
+    Used as a context manager, an error hands the rows that were never taken for
+    sending back to the queue. The batch in flight when the task stopped may have
+    been delivered, it stays claimed and is marked unknown by the first run after
+    EMAIL_DELIVERY_CLAIM_TIMEOUT.
+    """
+    def __init__(self, session_id, recipients):
+        self.session_id = session_id
+        self.claim = uuid.uuid4().hex
+        recipients = list(recipients)
+        self.create(recipients)
+        self.deliveries = {delivery.email: delivery for delivery in self.acquire([recipient.id for recipient in recipients])}
+        self.pending = [recipient for recipient in recipients if recipient.email in self.deliveries]
+        self.taken = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.release()
+
+    def take(self):
+        """
+        Yields the claimed recipients, remembering which ones were handed out for sending.
+        """
+        for recipient in self.pending:
+            self.taken.add(recipient.email)
+            yield recipient
+
+    def release(self):
+        untouched = [delivery.pk for email, delivery in self.deliveries.items() if email not in self.taken]
+        try:
+            EmailDelivery.objects.filter(pk__in=untouched, claim=self.claim, status=EmailDelivery.SENDING).update(
+                status=EmailDelivery.QUEUED, claim='',
+            )
+        except DatabaseError:
+            logger.exception("Failed to release the deliveries claimed by %s", self.claim)
+
+    def create(self, recipients):
+        existing = set(
+            EmailDelivery.objects.filter(session_id=self.session_id, contact_id__in=[recipient.id for recipient in recipients])
+            .values_list('contact_id', flat=True)
+        )
+        missing = [
+            EmailDelivery(session_id=self.session_id, contact_id=recipient.id, email=recipient.email, claim=self.claim)
+            for recipient in recipients if recipient.id not in existing
+        ]
+        if missing:
+            # A concurrent run may insert the same rows, the constraint keeps one of each. The rows
+            # carry this run's claim, so only the ones it inserted are counted.
+            EmailDelivery.objects.bulk_create(missing, batch_size=settings.EMAIL_SEND_BATCH_SIZE, ignore_conflicts=True)
+            inserted = EmailDelivery.objects.filter(
+                session_id=self.session_id, contact_id__in=[delivery.contact_id for delivery in missing], claim=self.claim,
+            ).count()
+            EmailSession.objects.filter(pk=self.session_id).update(recipient_count=F('recipient_count') + inserted)
+
+    def acquire(self, contact_ids):
+        now = timezone.now()
+        rows = EmailDelivery.objects.filter(session_id=self.session_id, contact_id__in=contact_ids)
+        self.expire(rows, now)
+        rows.filter(
+            status__in=[EmailDelivery.QUEUED, EmailDelivery.FAILED],
+            attempts__lt=settings.EMAIL_DELIVERY_MAX_ATTEMPTS,
+        ).update(status=EmailDelivery.SENDING, claim=self.claim, updated_at=now)
+        return EmailDelivery.objects.filter(session_id=self.session_id, claim=self.claim, status=EmailDelivery.SENDING)
+
+    def expire(self, rows, now):
+        """
+        Marks the rows a stopped run left in 'sending' past EMAIL_DELIVERY_CLAIM_TIMEOUT as unknown.
+
+        Their messages may have been delivered before the run stopped, so they are not sent again.
+        """
+        stale = rows.filter(
+            status=EmailDelivery.SENDING,
+            updated_at__lt=now - timedelta(seconds=settings.EMAIL_DELIVERY_CLAIM_TIMEOUT),
+        )
+        update = {"status": EmailDelivery.UNKNOWN, "claim": '', "last_error": INTERRUPTED_ERROR, "updated_at": now}
+        # Rows retried after a failure are already counted as failed
+        failed = stale.filter(last_error='').update(**update)
+        stale.update(**update)
+        if failed:
+            EmailSession.objects.filter(pk=self.session_id).update(failed_count=F('failed_count') + failed)
+
+    def record(self, messages, failure=None):
+        """
+        Stores the outcome of one batch on its delivery rows and the session counters.
+
+        Rows are written with bulk_update and the counters with a single UPDATE, so the
+        number of queries does not depend on the number of recipients.
+
+        Args:
+            messages (list): The messages of the batch.
+            failure (dict): The BatchSender failure entry if some of its messages were not sent.
+        """
+        now = timezone.now()
+        errors = failure["errors"] if failure else {}
+        unknown = set(failure["unknown"]) if failure else set()
+        deliveries = [(recipient, self.deliveries[recipient]) for message in messages for recipient in message.recipients()]
+        sent = failed = 0
+        for recipient, delivery in deliveries:
+            retried = bool(delivery.last_error)
+            delivery.attempts += 1
+            delivery.updated_at = now
+            if recipient not in errors:
+                delivery.status = EmailDelivery.SENT
+                delivery.sent_at = now
+                delivery.last_error = ''
+                sent += 1
+                if retried:
+                    failed -= 1
+            else:
+                delivery.status = EmailDelivery.UNKNOWN if recipient in unknown else EmailDelivery.FAILED
+                delivery.last_error = errors[recipient]
+                if not retried:
+                    failed += 1
+        deliveries = [delivery for _, delivery in deliveries]
+
+        EmailDelivery.objects.bulk_update(
+            deliveries,
+            ['status', 'attempts', 'last_error', 'sent_at', 'updated_at'],
+            batch_size=settings.EMAIL_SEND_BATCH_SIZE,
+        )
+        EmailSession.objects.filter(pk=self.session_id).update(
+            sent_count=F('sent_count') + sent,
+            failed_count=F('failed_count') + failed,
+        )
+
+
+class BatchSender:
+    """
+    Delivers messages over a single backend connection, in chunks of `chunk_size` messages.
+
+    The outcome of every message is tracked. Backends that report it themselves
+    (`reports_outcomes`) get the whole chunk in one send_messages() call, others get
+    one message per call, since Django's SMTP backend raises on a failed message
+    after delivering the ones before it. A failed message does not stop the rest.
+    If the server drops the session, the connection is reopened for the messages
+    after the one being sent, which is not sent again. When a rate limiter is given,
+    it is consulted before each chunk, and `on_chunk` is called with each chunk's
+    messages and failure (or None) once it is done.
+
+    Without an explicit connection, one is borrowed from the worker's connection
+    pool if the process has one, so the session outlives the task.
+    """
+    def __init__(self, connection=None, chunk_size=None, rate_limiter=None, on_chunk=None):
+        self.pool = get_pool() if connection is None else None
+        if self.pool is None and connection is None:
+            connection = get_connection(settings.EMAIL_BULK_BACKEND, fail_silently=False)
+        self.connection = connection
+        self.chunk_size = chunk_size or settings.EMAIL_SEND_BATCH_SIZE
+        self.rate_limiter = rate_limiter
+        self.on_chunk = on_chunk
+        self.sent = 0
+        self.failed = []
+
+    def __enter__(self):
+        if self.pool is not None:
+            self.connection = self.pool.acquire()
+        else:
+            self.connection.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.pool is not None:
+            messages = self.sent + sum(len(chunk["recipients"]) for chunk in self.failed)
+            self.pool.release(self.connection, messages=messages, discard=exc_type is not None or bool(self.failed))
+        else:
+            self.connection.close()
+
+    def reconnect(self):
+        self.connection.close()
+        self.connection.open()
+
+    def send_together(self, index, messages):
+        for message in messages:
+            message.delivery_outcome = None
+        try:
+            self.connection.send_messages(messages)
+        except Exception:
+            logger.exception("Failed to send chunk %s", index)
+        # Messages the backend never got to were not sent
+        return [message.delivery_outcome or (EmailDelivery.FAILED, "The message was not sent") for message in messages]
+
+    def send_each(self, index, messages):
+        outcomes = []
+        for position, message in enumerate(messages):
+            try:
+                sent = self.connection.send_messages([message])
+            except Exception as e:
+                logger.exception("Failed to send message %s of chunk %s", position, index)
+                outcomes.append((failure_status(e), str(e)))
+                if isinstance(e, smtplib.SMTPServerDisconnected):
+                    logger.warning("SMTP session dropped on chunk %s, reconnecting", index)
+                    try:
+                        self.reconnect()
+                    except Exception as e:
+                        logger.exception("Failed to reconnect on chunk %s", index)
+                        outcomes.extend((EmailDelivery.FAILED, str(e)) for _ in messages[position + 1:])
+                        break
+                continue
+            outcomes.append((EmailDelivery.SENT, '') if sent else (EmailDelivery.FAILED, "The message was not sent"))
+        return outcomes
+
+    def send_chunk(self, index, messages):
+        if self.rate_limiter:
+            self.rate_limiter.acquire(len(messages))
+        if getattr(self.connection, 'reports_outcomes', False):
+            outcomes = self.send_together(index, messages)
+        else:
+            outcomes = self.send_each(index, messages)
+
+        errors, unknown = {}, []
+        for message, (status, error) in zip(messages, outcomes):
+            if status == EmailDelivery.SENT:
+                continue
+            for recipient in message.recipients():
+                errors[recipient] = error
+                if status == EmailDelivery.UNKNOWN:
+                    unknown.append(recipient)
+        failure = None
+        if errors:
+            failure = {
+                "chunk": index,
+                "recipients": list(errors),
+                "unknown": unknown,
+                "errors": errors,
+                "error": next(iter(errors.values())),
+            }
+            self.failed.append(failure)
+        sent = sum(status == EmailDelivery.SENT for status, _ in outcomes)
+        self.sent += sent
+        if self.on_chunk:
+            self.on_chunk(messages, failure)
+        return sent
+
+    def send(self, messages):
+        """
+        Sends the messages in chunks and returns a summary of the run.
+
+        Args:
+            messages (iterable): EmailMessage instances, consumed lazily.
+
+        Returns:
+            dict: The number of messages sent and the failed chunks.
+        """
+        for index, chunk in enumerate(chunked(messages, self.chunk_size)):
+            self.send_chunk(index, chunk)
+        return self.summary()
+
+    def summary(self):
+        return {"sent": self.sent, "failed": self.failed}
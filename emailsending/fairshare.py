@@ -0,0 +1,179 @@
+import json
+import time
+import uuid
+from django.conf import settings
+from emailsending.ratelimit import get_redis
+
+TRANSACTIONAL = 'transactional'
+BULK = 'bulk'
+
+# Lanes in the order their chunks are started, transactional chunks always go first
+LANES = (TRANSACTIONAL, BULK)
+
+# How long a campaign's chunks and results are kept, far longer than any send takes
+CAMPAIGN_TIMEOUT = 60 * 60 * 24 * 7
+
+# Appends chunks to a session's list. The session joins its user's ring when its list was
+# empty, and the user joins the lane's ring when none of their sessions had chunks left.
+SUBMIT_SCRIPT = """
+local before = redis.call('LLEN', KEYS[3])
+redis.call('RPUSH', KEYS[3], unpack(ARGV, 4))
+redis.call('EXPIRE', KEYS[3], tonumber(ARGV[3]))
+if before == 0 then
+    if redis.call('LLEN', KEYS[2]) == 0 then
+        redis.call('RPUSH', KEYS[1], ARGV[1])
+    end
+    redis.call('RPUSH', KEYS[2], ARGV[2])
+end
+return before
+"""
+
+# Takes a free slot and the next chunk, round-robin over the lane's users and then over
+# each user's sessions. Users and sessions that still have chunks go back to the end of
+# their ring. Slots not released before their deadline are freed.
+# Returns {session, chunk}, or nothing when every slot is taken or no chunk is waiting.
+POP_SCRIPT = """
+local prefix = ARGV[1]
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', ARGV[2])
+if redis.call('ZCARD', KEYS[2]) >= tonumber(ARGV[4]) then
+    return false
+end
+local user = redis.call('LPOP', KEYS[1])
+while user do
+    local sessions = prefix .. ':user:' .. user
+    local session = redis.call('LPOP', sessions)
+    while session do
+        local chunks = prefix .. ':chunks:' .. session
+        local chunk = redis.call('LPOP', chunks)
+        if chunk then
+            if redis.call('LLEN', chunks) > 0 then
+                redis.call('RPUSH', sessions, session)
+            end
+            if redis.call('LLEN', sessions) > 0 then
+                redis.call('RPUSH', KEYS[1], user)
+            end
+            redis.call('ZADD', KEYS[2], ARGV[3], ARGV[5])
+            return {session, chunk}
+        end
+        session = redis.call('LPOP', sessions)
+    end
+    user = redis.call('LPOP', KEYS[1])
+end
+return false
+"""
+
+# Frees a chunk's slot and stores its result once. Returns the session's results when this
+# was the last of the campaign's chunks, only to the first caller that completes it. Without
+# its campaign the session's chunk count is unknown, so only the slot is freed.
+COMPLETE_SCRIPT = """
+redis.call('ZREM', KEYS[1], ARGV[1])
+local campaign = redis.call('GET', KEYS[4])
+if not campaign then
+    return false
+end
+redis.call('HSETNX', KEYS[2], ARGV[2], ARGV[3])
+redis.call('EXPIRE', KEYS[2], tonumber(ARGV[4]))
+if redis.call('HLEN', KEYS[2]) >= cjson.decode(campaign)['total'] and redis.call('SET', KEYS[3], '1', 'NX', 'EX', tonumber(ARGV[4])) then
+    return redis.call('HVALS', KEYS[2])
+end
+return false
+"""
+
+
+class FairScheduler:
+    """
+    Shares the chunk workers between users, through queues kept in Redis.
+
+    Chunks of a session are not sent to Celery when the session is dispatched.
+    They wait in the session's lane, and pop() hands them out round-robin by user,
+    then by session, whenever one of the lane's EMAIL_LANE_CONCURRENCY slots is free.
+    A user with a large campaign therefore gets the same share of the workers as a
+    user with a small one, and only a lane's slots' worth of chunks sit in Celery's
+    queue at a time.
+    """
+    key_prefix = 'liftsmail:fairshare'
+
+    def __init__(self, client=None):
+        self.client = client or get_redis()
+        self.submit_script = self.client.register_script(SUBMIT_SCRIPT)
+        self.pop_script = self.client.register_script(POP_SCRIPT)
+        self.complete_script = self.client.register_script(COMPLETE_SCRIPT)
+
+    def lane_key(self, lane, name=''):
+        return f'{self.key_prefix}:{lane}{name}'
+
+    def session_key(self, name, session_id):
+        return f'{self.key_prefix}:{name}:{session_id}'
+
+    def submit(self, lane, user_id, session_id, chunks, campaign):
+        """
+        Queues the chunks of a session.
+
+        Args:
+            lane (str): TRANSACTIONAL or BULK.
+            user_id (int): The sending user, the unit work is shared between.
+            session_id (int): The email session.
+            chunks (list): The (after_id, upto_id) bounds of each chunk.
+            campaign (dict): The arguments every chunk task of the session is sent with.
+        """
+        self.client.set(
+            self.session_key('campaign', session_id),
+            json.dumps({**campaign, "lane": lane, "user_id": user_id, "total": len(chunks)}),
+            ex=CAMPAIGN_TIMEOUT,
+        )
+        # Lua functions take a limited number of arguments
+        for start in range(0, len(chunks), 1000):
+            self.push(lane, user_id, session_id, chunks[start:start + 1000])
+
+    def push(self, lane, user_id, session_id, chunks):
+        keys = [self.lane_key(lane, ':users'), self.lane_key(lane, f':user:{user_id}'), self.lane_key(lane, f':chunks:{session_id}')]
+        payload = [json.dumps(list(chunk)) for chunk in chunks]
+        self.submit_script(keys=keys, args=[user_id, session_id, CAMPAIGN_TIMEOUT, *payload])
+
+    def pop(self, lane):
+        """
+        Takes the lane's next chunk and a slot for it.
+
+        Returns:
+            tuple: (slot token, session id, (after_id, upto_id), campaign), or None when
+                the lane has no free slot or no chunk waiting.
+        """
+        token = uuid.uuid4().hex
+        deadline = time.time() + settings.EMAIL_DELIVERY_CLAIM_TIMEOUT
+        result = self.pop_script(
+            keys=[self.lane_key(lane, ':users'), self.lane_key(lane, ':slots')],
+            args=[self.lane_key(lane), time.time(), deadline, settings.EMAIL_LANE_CONCURRENCY[lane], token],
+        )
+        if not result:
+            return None
+        session_id, chunk = int(result[0]), tuple(json.loads(result[1]))
+        campaign = json.loads(self.client.get(self.session_key('campaign', session_id)))
+        return token, session_id, chunk, campaign
+
+    def requeue(self, lane, token, session_id, chunk, campaign):
+        """
+        Puts back a popped chunk whose task could not be sent, and frees its slot.
+        """
+        self.push(lane, campaign["user_id"], session_id, [chunk])
+        self.client.zrem(self.lane_key(lane, ':slots'), token)
+
+    def complete(self, lane, token, session_id, chunk, result):
+        """
+        Releases a chunk's slot and records its result.
+
+        Returns:
+            list: The results of every chunk of the session when this was the last one
+                to finish, otherwise None. Also None when the session's campaign is
+                gone, as it cannot tell whether every chunk has reported.
+        """
+        results = self.complete_script(
+            keys=[
+                self.lane_key(lane, ':slots'), self.session_key('results', session_id),
+                self.session_key('finished', session_id), self.session_key('campaign', session_id),
+            ],
+            args=[token, json.dumps(chunk), json.dumps(result), CAMPAIGN_TIMEOUT],
+        )
+        if not results:
+            return None
+        self.client.delete(self.session_key('campaign', session_id), self.session_key('results', session_id))
+        return [json.loads(value) for value in results]
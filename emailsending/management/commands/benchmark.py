@@ -0,0 +1,35 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from emailsending.benchmarks import BenchmarkSuite, compare
+
+
+class Command(BaseCommand):
+    help = "Runs the render, enqueue, send and contact listing benchmarks and writes the results as JSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 10_000], help="Contacts in the seeded group")
+        parser.add_argument('--repeat', type=int, default=3, help="Runs per case, the fastest is kept")
+        parser.add_argument('--output', help="File the JSON results are written to")
+        parser.add_argument('--baseline', help="Results file of an earlier run to compare against")
+        parser.add_argument('--threshold', type=float, default=0.2, help="Slowdown against the baseline flagged as a regression")
+
+    def handle(self, *args, **options):
+        report = BenchmarkSuite(options['sizes'], repeat=options['repeat']).run()
+
+        for case, result in report["results"].items():
+            self.stdout.write(f"{case:<40} {result['seconds']:9.4f}s {result['per_second']:12.1f}/s")
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+        if options['baseline']:
+            with open(options['baseline']) as baseline:
+                rows = compare(report["results"], json.load(baseline)["results"], options['threshold'])
+            regressions = [row for row in rows if row[4]]
+            for case, previous, current, change, regressed in rows:
+                flag = "REGRESSION" if regressed else "ok"
+                self.stdout.write(f"{case:<40} {previous:9.4f}s -> {current:9.4f}s {change:+8.1%}  {flag}")
+            if regressions:
+                raise CommandError(f"{len(regressions)} case(s) slower than the baseline by more than {options['threshold']:.0%}")
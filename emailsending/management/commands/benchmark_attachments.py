@@ -0,0 +1,76 @@
+import os
+import time
+import tracemalloc
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from emailsending.attachments import SharedAttachment
+from emailsending.delivery import CampaignMessage, build_html_message, chunked
+
+MIMETYPE = 'application/pdf'
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures CPU time and peak memory of building and serializing messages that carry one attachment, "
+        "attached per message against encoded once and shared"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size-mb', type=float, default=5, help="Attachment size in megabytes")
+        parser.add_argument('--recipients', type=int, default=10_000, help="Messages built with the shared attachment")
+        parser.add_argument(
+            '--per-message-recipients', type=int, default=20,
+            help="Messages built per message, the totals are extrapolated to --recipients",
+        )
+
+    def run(self, build, count):
+        # Messages are built a send batch at a time and serialized one by one, as BatchSender and the backends do
+        for batch in chunked(range(count), settings.EMAIL_SEND_BATCH_SIZE):
+            messages = [build(i) for i in batch]
+            for message in messages:
+                message.message().as_bytes(linesep='\r\n')
+
+    def measure(self, build, count):
+        # CPU is timed without tracing, tracemalloc slows the email generator's many small allocations
+        started = time.process_time()
+        self.run(build(), count)
+        elapsed = time.process_time() - started
+        tracemalloc.start()
+        self.run(build(), count)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return elapsed, peak
+
+    def report(self, label, count, elapsed, peak, total):
+        self.stdout.write(
+            f"{label:<14} {count:>7} messages  cpu {elapsed:8.2f}s  ({elapsed / count * 1000:7.2f} ms/message, "
+            f"{elapsed / count * total:8.1f}s for {total})  peak memory {peak / 2 ** 20:8.1f} MB"
+        )
+
+    def handle(self, *args, **options):
+        content = os.urandom(int(options['size_mb'] * 2 ** 20))
+        recipients = options['recipients']
+        body = "<p>Hello,</p><p>Your invoice is attached.</p>"
+
+        def per_message():
+            def build(i):
+                message = build_html_message("Invoice", body, "billing@liftsmail.local", f"contact{i}@example.com")
+                message.attach("invoice.pdf", content, MIMETYPE)
+                return message
+            return build
+
+        def shared():
+            campaign = None
+
+            def build(i):
+                nonlocal campaign
+                if campaign is None:
+                    # Encoded once per chunk task, measured with the messages
+                    attachment = SharedAttachment("invoice.pdf", MIMETYPE, content)
+                    campaign = CampaignMessage("Invoice", "billing@liftsmail.local", [attachment])
+                return campaign.build(body, f"contact{i}@example.com")
+            return build
+
+        count = min(options['per_message_recipients'], recipients)
+        self.report('per message', count, *self.measure(per_message, count), recipients)
+        self.report('shared', recipients, *self.measure(shared, recipients), recipients)
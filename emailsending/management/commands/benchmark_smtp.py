@@ -0,0 +1,45 @@
+import time
+from aiosmtpd.controller import Controller
+from django.core.mail.backends.smtp import EmailBackend
+from django.core.management.base import BaseCommand
+from emailsending.backends import AsyncSMTPEmailBackend
+from emailsending.benchmarks import SinkHandler, free_port
+from emailsending.delivery import build_html_message
+
+
+class Command(BaseCommand):
+    help = "Compares the throughput of Django's SMTP backend against AsyncSMTPEmailBackend on a local SMTP sink"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=1000, help="Messages sent by each run")
+        parser.add_argument('--latency', type=float, default=20, help="Milliseconds the sink waits before accepting a message")
+        parser.add_argument('--connections', type=int, nargs='+', default=[1, 4, 16, 64], help="Session counts tried with the async backend")
+
+    def handle(self, *args, **options):
+        count = options['messages']
+        latency = options['latency']
+        handler = SinkHandler(latency / 1000)
+        port = free_port()
+        controller = Controller(handler, hostname='127.0.0.1', port=port)
+        controller.start()
+        messages = [
+            build_html_message("Benchmark", f"<p>Message {i}</p>", "sender@liftsmail.local", f"contact{i}@example.com")
+            for i in range(count)
+        ]
+        server = dict(host='127.0.0.1', port=port, username='', password='', use_tls=False, use_ssl=False)
+        runs = [('django smtp', EmailBackend(**server))]
+        runs += [(f'async x{n}', AsyncSMTPEmailBackend(connections=n, **server)) for n in options['connections']]
+
+        results = []
+        try:
+            for name, backend in runs:
+                started = time.perf_counter()
+                with backend:
+                    sent = backend.send_messages(messages)
+                results.append((name, sent, time.perf_counter() - started))
+        finally:
+            controller.stop()
+
+        self.stdout.write(f"{count} messages, {latency:g} ms server latency")
+        for name, sent, elapsed in results:
+            self.stdout.write(f"{name:<12} {sent:6d} sent {elapsed:8.3f}s {sent / elapsed:10.1f} msg/s")
@@ -0,0 +1,54 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.template import Context
+from emailsending.utils import SegmentTemplate, compile_template, get_renderer
+
+TEMPLATE = (
+    "<p>Hello {{ first_name }} {{ last_name }},</p>"
+    "<p>Your subscription for {{ email }} renews next week. Reply to this email if you have any questions.</p>"
+    "<p>Thanks,<br>The team</p>"
+)
+
+
+def contexts(count):
+    return [
+        {
+            "first_name": f"First{i}",
+            "last_name": "O'Brien" if i % 10 == 0 else f"Last{i}",
+            "email": f"contact{i}@example.com",
+            "contact_id": i,
+        }
+        for i in range(count)
+    ]
+
+
+class Command(BaseCommand):
+    help = "Compares rendering a personalization template with the full Django engine against the segment renderer"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipients', type=int, nargs='+', default=[10_000, 100_000], help="Recipient counts to render")
+
+    def handle(self, *args, **options):
+        # What format_email did for every recipient before the segment renderer
+        template = compile_template(TEMPLATE)
+        renderer = get_renderer(TEMPLATE)
+        if not isinstance(renderer, SegmentTemplate):
+            raise CommandError("The benchmark template did not take the segment path")
+
+        for count in options['recipients']:
+            values = contexts(count)
+
+            started = time.perf_counter()
+            engine = [template.render(Context(context)) for context in values]
+            engine_elapsed = time.perf_counter() - started
+
+            started = time.perf_counter()
+            segments = [renderer.render(context) for context in values]
+            segments_elapsed = time.perf_counter() - started
+
+            if engine != segments:
+                raise CommandError("The segment renderer output differs from the Django engine")
+            self.stdout.write(
+                f"{count:>8} recipients  engine {engine_elapsed:7.3f}s  segments {segments_elapsed:7.3f}s  "
+                f"speedup {engine_elapsed / segments_elapsed:5.1f}x"
+            )
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.16 on 2026-10-18 14:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emailsending', '0003_rename_is_scheduled_emailsession_one_off'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='emailsession',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='session_user_created_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.16 on 2026-10-18 14:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emailsending', '0006_emaildelivery_claim'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailtemplate',
+            name='is_static',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='emailtemplate',
+            name='variables',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
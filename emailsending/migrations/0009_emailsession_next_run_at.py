@@ -0,0 +1,38 @@
+# Generated by Django 4.2.16 on 2026-10-18 14:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emailsending', '0008_suppression'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailsession',
+            name='next_run_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='emailsession',
+            name='recurrence',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='emailsession',
+            name='recurring_session',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='runs', to='emailsending.emailsession'),
+        ),
+        migrations.AddField(
+            model_name='emailsession',
+            name='timezone',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name='emailsession',
+            index=models.Index(condition=models.Q(('next_run_at__isnull', False)), fields=['next_run_at'], name='session_next_run_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.16 on 2026-10-18 14:53
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('emailsending', '0009_emailsession_next_run_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmailAttachment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('file', models.FileField(upload_to='email_attachments/')),
+                ('filename', models.CharField(max_length=255)),
+                ('mimetype', models.CharField(max_length=255)),
+                ('size', models.PositiveBigIntegerField()),
+                ('template', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='attachments', to='emailsending.emailtemplate')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='email_attachments', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.AddField(
+            model_name='emailsession',
+            name='attachments',
+            field=models.ManyToManyField(blank=True, related_name='sessions', to='emailsending.emailattachment'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-18 15:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emailsending', '0011_emaildelivery_unknown_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailsession',
+            name='quota_emails',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -1,7 +1,8 @@
 from django.db import models
+from django.db.models import Q
 from django.contrib.auth import get_user_model
 from liftsmail.models import TimeStampBaseModel
-from emailcontacts.models import Group
+from emailcontacts.models import Contact, Group
 
 User = get_user_model()
 
@@ -11,6 +12,9 @@ class EmailTemplate(TimeStampBaseModel):
     subject = models.CharField(max_length=50)
     body = models.TextField()
     user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # Filled in from the compiled body when the template is saved through the API, null until then
+    variables = models.JSONField(null=True, blank=True)
+    is_static = models.BooleanField(default=False)
     
     def __str__(self):
         return f"{self.name}-{self.user.id}"
@@ -19,10 +23,116 @@ class EmailTemplate(TimeStampBaseModel):
         unique_together = ['user',"name"]
 
 
+class EmailAttachment(TimeStampBaseModel):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='email_attachments')
+    # Sent with every email of the template's sessions
+    template = models.ForeignKey(EmailTemplate, on_delete=models.CASCADE, null=True, blank=True, related_name='attachments')
+    file = models.FileField(upload_to='email_attachments/')
+    filename = models.CharField(max_length=255)
+    mimetype = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+
+    def __str__(self):
+        return f"{self.filename}-{self.user_id}"
+
+
 class EmailSession(TimeStampBaseModel):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     session = models.CharField(max_length=255, blank=True, null=True)
     group_id = models.ForeignKey(Group, on_delete=models.CASCADE)
     template_id = models.ForeignKey(EmailTemplate, on_delete=models.CASCADE, null=True, blank=True)
     one_off = models.BooleanField(default=False)  #this should ba one off task
-    schedule_time = models.DateTimeField(null=True, blank=True)
\ No newline at end of file
+    schedule_time = models.DateTimeField(null=True, blank=True)
+    # Delivery counters, kept in step with the EmailDelivery rows by the send tasks
+    recipient_count = models.PositiveIntegerField(default=0)
+    sent_count = models.PositiveIntegerField(default=0)
+    failed_count = models.PositiveIntegerField(default=0)
+    # Emails charged to the user's quota when the session was created
+    quota_emails = models.PositiveIntegerField(default=0)
+    # When the scheduler next sends this session, null once it has nothing left to send
+    next_run_at = models.DateTimeField(null=True, blank=True)
+    # RRULE of a recurring session, in wall-clock time of `timezone`
+    recurrence = models.TextField(blank=True, default='')
+    timezone = models.CharField(max_length=64, blank=True, default='')
+    # Each occurrence of a recurring session is sent as its own session
+    recurring_session = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='runs')
+    # Sent with every email of the session, on top of its template's attachments
+    attachments = models.ManyToManyField(EmailAttachment, blank=True, related_name='sessions')
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of a user's sessions
+            models.Index(fields=['user', 'created_at', 'id'], name='session_user_created_idx'),
+            # The scheduler only reads sessions waiting for a run
+            models.Index(fields=['next_run_at'], condition=Q(next_run_at__isnull=False), name='session_next_run_idx'),
+        ]
+
+
+class EmailDelivery(TimeStampBaseModel):
+    QUEUED = 'queued'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    # The connection was lost while the message was being sent, it may have been delivered
+    UNKNOWN = 'unknown'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (SENDING, 'Sending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+        (UNKNOWN, 'Unknown'),
+    ]
+
+    session = models.ForeignKey(EmailSession, on_delete=models.CASCADE, related_name='deliveries')
+    contact = models.ForeignKey(Contact, on_delete=models.SET_NULL, null=True, related_name='deliveries')
+    email = models.EmailField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    sent_at = models.DateTimeField(null=True, blank=True)
+    # Token of the task run currently sending this row
+    claim = models.CharField(max_length=32, blank=True, default='')
+
+    def __str__(self):
+        return f"{self.email} ({self.status})"
+
+    class Meta:
+        constraints = [
+            # A recipient gets at most one delivery per session, however often its chunk runs
+            models.UniqueConstraint(fields=['session', 'contact'], name='unique_delivery_per_session_contact'),
+        ]
+        indexes = [
+            # Keyset pagination of a session's deliveries
+            models.Index(fields=['session', 'created_at', 'id'], name='delivery_session_created_idx'),
+        ]
+
+
+class Suppression(TimeStampBaseModel):
+    """
+    An address a user never sends to, whichever group it is in.
+    """
+    UNSUBSCRIBED = 'unsubscribed'
+    BOUNCED = 'bounced'
+    COMPLAINED = 'complained'
+    MANUAL = 'manual'
+    REASON_CHOICES = [
+        (UNSUBSCRIBED, 'Unsubscribed'),
+        (BOUNCED, 'Bounced'),
+        (COMPLAINED, 'Complained'),
+        (MANUAL, 'Manual'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='suppressions')
+    email = models.EmailField()
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES, default=MANUAL)
+
+    def __str__(self):
+        return f"{self.email} ({self.reason})"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'email'], name='unique_suppression_per_user'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'created_at', 'id'], name='suppression_user_created_idx'),
+        ]
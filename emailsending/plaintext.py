@@ -0,0 +1,132 @@
+import re
+import textwrap
+from html.parser import HTMLParser
+from django.template.base import tag_re
+
+# Column plain text lines are wrapped at
+TEXT_WIDTH = 78
+
+WHITESPACE = re.compile(r'\s+')
+BLANK_LINES = re.compile(r'\n{3,}')
+PLACEHOLDER = re.compile('\x00\x01*\x00')
+
+# Elements whose content is not shown as text
+SKIPPED = {'head', 'script', 'style', 'template', 'title'}
+# Elements separated from their surroundings by a blank line
+PARAGRAPHS = {'blockquote', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'ol', 'p', 'pre', 'table', 'ul'}
+# Elements that start on a new line
+BLOCKS = {
+    'address', 'article', 'aside', 'dd', 'div', 'dl', 'dt', 'fieldset', 'figcaption', 'figure',
+    'footer', 'form', 'header', 'li', 'main', 'nav', 'section', 'tr',
+}
+
+
+class TextConverter(HTMLParser):
+    """
+    Collects the readable text of an HTML document.
+
+    Text is collected as strings, with ints between them asking for at least that
+    many line breaks, so nested blocks do not stack blank lines.
+    """
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.skipping = 0
+        self.preformatted = 0
+        self.links = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED:
+            self.skipping += 1
+            return
+        if self.skipping:
+            return
+        if tag == 'br':
+            self.parts.append(1)
+        elif tag == 'li':
+            self.parts.extend((1, '- '))
+        elif tag in PARAGRAPHS:
+            self.parts.append(2)
+        elif tag in BLOCKS:
+            self.parts.append(1)
+        elif tag in ('td', 'th'):
+            self.parts.append(' ')
+        elif tag == 'img':
+            alt = dict(attrs).get('alt')
+            if alt:
+                self.parts.append(alt)
+        elif tag == 'a':
+            self.links.append((dict(attrs).get('href'), len(self.parts)))
+        if tag == 'pre':
+            self.preformatted += 1
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED:
+            self.skipping = max(0, self.skipping - 1)
+            return
+        if self.skipping:
+            return
+        if tag == 'a' and self.links:
+            href, start = self.links.pop()
+            text = ''.join(part for part in self.parts[start:] if isinstance(part, str)).strip()
+            # Only links that show something other than their address need it spelled out
+            if href and not href.startswith('#') and href.removeprefix('mailto:') != text:
+                self.parts.append(f' ({href.removeprefix("mailto:")})' if text else href)
+        elif tag in PARAGRAPHS:
+            self.parts.append(2)
+        elif tag in BLOCKS:
+            self.parts.append(1)
+        if tag == 'pre':
+            self.preformatted = max(0, self.preformatted - 1)
+
+    def handle_data(self, data):
+        if self.skipping:
+            return
+        self.parts.append(data if self.preformatted else WHITESPACE.sub(' ', data))
+
+    def text(self):
+        output = []
+        breaks = 0
+        for part in self.parts:
+            if isinstance(part, int):
+                breaks = max(breaks, part)
+                continue
+            if breaks and output:
+                output.append('\n' * breaks)
+            breaks = 0
+            output.append(part)
+        lines = [line.strip() for line in ''.join(output).split('\n')]
+        return BLANK_LINES.sub('\n\n', '\n'.join(wrap(line) for line in lines)).strip()
+
+
+def wrap(line, width=TEXT_WIDTH):
+    """
+    Wraps a line of text, keeping template tags such as {{ first_name }} whole.
+    """
+    if len(line) <= width:
+        return line
+    tags = iter(tag_re.findall(line))
+    # Tags are swapped for placeholders without spaces of the same length, then restored in order
+    protected = tag_re.sub(lambda match: '\x00' + '\x01' * (len(match.group(0)) - 2) + '\x00', line)
+    wrapped = textwrap.fill(protected, width=width, break_long_words=False, break_on_hyphens=False)
+    return PLACEHOLDER.sub(lambda match: next(tags), wrapped)
+
+
+def html_to_text(html):
+    """
+    Converts HTML into readable plain text for the text/plain part of an email.
+
+    Paragraphs and headings are separated by blank lines, list items become
+    "- " lines, links show their address after the link text, scripts and styles
+    are dropped and lines are wrapped at TEXT_WIDTH columns.
+
+    Args:
+        html (str): The HTML content, or an HTML template source.
+
+    Returns:
+        str: The plain text.
+    """
+    converter = TextConverter()
+    converter.feed(html)
+    converter.close()
+    return converter.text()
@@ -0,0 +1,164 @@
+import logging
+import smtplib
+import threading
+import time
+from django.conf import settings
+from django.core.mail import get_connection
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+
+
+def is_alive(connection):
+    """
+    Health-checks an open backend connection with NOOP.
+
+    Backends can provide their own ping(). Backends without a server session
+    (console, locmem) are always considered alive.
+    """
+    ping = getattr(connection, 'ping', None)
+    if ping is not None:
+        return ping()
+    if not hasattr(connection, 'connection'):
+        return True
+    if connection.connection is None:
+        return False
+    try:
+        return connection.connection.noop()[0] == 250
+    except (smtplib.SMTPException, OSError):
+        return False
+
+
+class PooledConnection:
+    def __init__(self, backend):
+        self.backend = backend
+        self.opened_at = time.monotonic()
+        self.last_used = self.opened_at
+        self.messages = 0
+
+
+class SMTPConnectionPool:
+    """
+    Open backend connections kept by a worker process and reused across tasks.
+
+    Connections idle for longer than `noop_after` seconds are checked with NOOP
+    before being handed out. A connection is closed instead of being returned once
+    it has sent `max_messages` messages or is `max_age` seconds old, and at most
+    `size` idle connections are kept.
+    """
+    def __init__(self, backend=None, size=None, max_messages=None, max_age=None, noop_after=None):
+        self.backend = backend or settings.EMAIL_BULK_BACKEND
+        self.size = settings.EMAIL_POOL_SIZE if size is None else size
+        self.max_messages = settings.EMAIL_POOL_MAX_MESSAGES if max_messages is None else max_messages
+        self.max_age = settings.EMAIL_POOL_MAX_AGE if max_age is None else max_age
+        self.noop_after = settings.EMAIL_POOL_NOOP_AFTER if noop_after is None else noop_after
+        self.idle = []
+        self.in_use = {}
+        self.opened = 0
+        self._lock = threading.Lock()
+
+    def _open(self):
+        backend = get_connection(self.backend, fail_silently=False)
+        backend.open()
+        self.opened += 1
+        return PooledConnection(backend)
+
+    def _discard(self, pooled):
+        try:
+            pooled.backend.close()
+        except Exception:
+            logger.warning("Failed to close pooled connection", exc_info=True)
+
+    def expired(self, pooled):
+        return (
+            pooled.messages >= self.max_messages
+            or time.monotonic() - pooled.opened_at >= self.max_age
+        )
+
+    def warm(self):
+        """
+        Opens connections until `size` are idle, so the first task does not pay for them.
+        """
+        with self._lock:
+            missing = self.size - len(self.idle)
+        for _ in range(missing):
+            try:
+                pooled = self._open()
+            except Exception:
+                logger.warning("Failed to open pooled connection", exc_info=True)
+                return
+            with self._lock:
+                self.idle.append(pooled)
+
+    def acquire(self):
+        """
+        Returns an open backend connection, reusing an idle one when it is still healthy.
+        """
+        while True:
+            with self._lock:
+                pooled = self.idle.pop() if self.idle else None
+            if pooled is None:
+                pooled = self._open()
+                break
+            if self.expired(pooled):
+                self._discard(pooled)
+                continue
+            if time.monotonic() - pooled.last_used >= self.noop_after and not is_alive(pooled.backend):
+                logger.info("Pooled connection failed NOOP, reconnecting")
+                self._discard(pooled)
+                continue
+            break
+        with self._lock:
+            self.in_use[id(pooled.backend)] = pooled
+        return pooled.backend
+
+    def release(self, backend, messages=0, discard=False):
+        """
+        Returns a connection to the pool.
+
+        Args:
+            backend (BaseEmailBackend): The connection returned by acquire().
+            messages (int): Messages sent on it since it was acquired.
+            discard (bool): Close the connection instead of keeping it, e.g. after an error.
+        """
+        with self._lock:
+            pooled = self.in_use.pop(id(backend))
+            pooled.messages += messages
+            pooled.last_used = time.monotonic()
+            keep = not discard and not self.expired(pooled) and len(self.idle) < self.size
+            if keep:
+                self.idle.append(pooled)
+        if not keep:
+            self._discard(pooled)
+
+    def close(self):
+        with self._lock:
+            idle, self.idle = self.idle, []
+        for pooled in idle:
+            self._discard(pooled)
+
+
+def get_pool():
+    """
+    Returns this process's connection pool, or None outside a worker that set one up.
+    """
+    return _pool
+
+
+def init_pool(**kwargs):
+    """
+    Creates and warms the connection pool of the current process.
+    """
+    global _pool
+    close_pool()
+    _pool = SMTPConnectionPool(**kwargs)
+    _pool.warm()
+    return _pool
+
+
+def close_pool():
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        _pool = None
@@ -0,0 +1,184 @@
+import math
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from django.conf import settings
+from django.db.models import Sum
+from rest_framework.exceptions import Throttled
+from emailcontacts.recipients import recipient_queryset
+from emailsending.models import EmailSession
+from emailsending.ratelimit import get_redis
+
+QUOTA_NAMES = {
+    'sessions': 'email sessions',
+    'emails': 'emails',
+}
+
+# Counters outlive their window by this much, so a charge at the very end still finds its key
+WINDOW_MARGIN = 60
+
+# Adds ARGV[i] to every counter at once if none goes over its limit ARGV[n + i], where n is the
+# number of counters. Returns 0 when charged, otherwise the 1-based index of the exceeded counter.
+CHARGE_SCRIPT = """
+local n = #KEYS
+for i, key in ipairs(KEYS) do
+    local used = tonumber(redis.call('GET', key)) or 0
+    if used + tonumber(ARGV[i]) > tonumber(ARGV[n + i]) then
+        return i
+    end
+end
+for i, key in ipairs(KEYS) do
+    redis.call('INCRBY', key, ARGV[i])
+    redis.call('EXPIRE', key, tonumber(ARGV[2 * n + 1]))
+end
+return 0
+"""
+
+# Takes a refunded charge off the counters that still exist, an expired window needs no refund
+REFUND_SCRIPT = """
+for i, key in ipairs(KEYS) do
+    if redis.call('EXISTS', key) == 1 then
+        redis.call('DECRBY', key, ARGV[i])
+    end
+end
+"""
+
+
+class SendQuota:
+    """
+    A user's email sessions and emails in the current EMAIL_QUOTA_WINDOW, checked
+    against settings.EMAIL_QUOTAS.
+
+    Usage is kept in Redis counters, one per quota and window, so every web and
+    worker process sees the same counts and a check is a single script call
+    whatever the user's history. The window is part of the key, and a new window
+    starts from a fresh counter. A counter that is missing, at the start of a
+    window or after an eviction, is seeded from the sessions charged in the window,
+    so the database stays the source of truth.
+    """
+    key_prefix = 'liftsmail:quota'
+
+    def __init__(self, user_id, now=None, client=None):
+        self.user_id = user_id
+        self.window = settings.EMAIL_QUOTA_WINDOW
+        now = time.time() if now is None else now
+        self.start = int(now // self.window * self.window)
+        self.retry_after = self.start + self.window - now
+        self.client = client or get_redis()
+
+    def key(self, name):
+        return f'{self.key_prefix}:{name}:{self.user_id}:{self.start}'
+
+    def used(self, name):
+        """
+        Counts a quota's usage in the window from the database.
+
+        Every session that sends email is charged once, with the emails recorded in its
+        quota_emails. Recurring sessions only schedule their runs and are left out.
+        """
+        sessions = EmailSession.objects.filter(
+            user_id=self.user_id,
+            created_at__gte=datetime.fromtimestamp(self.start, tz=timezone.utc),
+            recurrence='',
+        )
+        if name == 'sessions':
+            return sessions.count()
+        return sessions.aggregate(total=Sum('quota_emails'))['total'] or 0
+
+    def charge(self, sessions=0, emails=0):
+        """
+        Counts a request against the quotas, all of them or none.
+
+        Returns:
+            str: The name of the quota the request would exceed, or None when it was charged.
+        """
+        charges = self.charges(sessions, emails)
+        if not charges:
+            return None
+        timeout = math.ceil(self.retry_after) + WINDOW_MARGIN
+        keys = [self.key(name) for name, amount, limit in charges]
+        for (name, amount, limit), key in zip(charges, keys):
+            if not self.client.exists(key):
+                # nx keeps the seed of a concurrent request
+                self.client.set(key, self.used(name), nx=True, ex=timeout)
+        exceeded = self.client.register_script(CHARGE_SCRIPT)(
+            keys=keys,
+            args=[amount for name, amount, limit in charges] + [limit for name, amount, limit in charges] + [timeout],
+        )
+        return charges[exceeded - 1][0] if exceeded else None
+
+    def refund(self, sessions=0, emails=0):
+        charges = self.charges(sessions, emails)
+        if charges:
+            self.client.register_script(REFUND_SCRIPT)(
+                keys=[self.key(name) for name, amount, limit in charges],
+                args=[amount for name, amount, limit in charges],
+            )
+
+    def charges(self, sessions, emails):
+        """
+        Returns the (name, amount, limit) of each quota a request counts against.
+        """
+        charges = []
+        for name, amount in (('sessions', sessions), ('emails', emails)):
+            limit = settings.EMAIL_QUOTAS.get(name)
+            if limit and amount:
+                charges.append((name, amount, limit))
+        return charges
+
+
+def session_emails(group_id):
+    """
+    Returns the emails a new session to the group is charged.
+
+    Only up to one more than the emails quota recipients are counted, so the check
+    does not grow with the size of the group.
+    """
+    limit = settings.EMAIL_QUOTAS.get('emails')
+    return recipient_queryset(group_id)[:limit + 1].count() if limit else 0
+
+
+@contextmanager
+def charge_session(user_id, group_id):
+    """
+    Charges a new email session to the group's recipients against the user's quotas.
+
+    The block creates the session with the yielded email count as its quota_emails.
+    The charge is refunded if the block raises, so a session that was not created
+    does not count.
+
+    Raises:
+        Throttled: If the session or its emails are over quota, with the seconds
+            until the window resets.
+    """
+    emails = session_emails(group_id)
+    quota = SendQuota(user_id)
+    exceeded = quota.charge(sessions=1, emails=emails)
+    if exceeded is not None:
+        raise Throttled(
+            wait=quota.retry_after,
+            detail=f"You have used your {settings.EMAIL_QUOTAS[exceeded]} {QUOTA_NAMES[exceeded]} for this period.",
+        )
+    try:
+        yield emails
+    except BaseException:
+        quota.refund(sessions=1, emails=emails)
+        raise
+
+
+def charge_run(run):
+    """
+    Charges a run of a recurring session, sent by the scheduler rather than requested.
+
+    Sets the run's quota_emails when charged.
+
+    Returns:
+        SendQuota: The quota charged, to refund if the run is not created, or None
+            when the run is over quota and must be skipped.
+    """
+    emails = session_emails(run.group_id_id)
+    quota = SendQuota(run.user_id)
+    if quota.charge(sessions=1, emails=emails) is not None:
+        return None
+    run.quota_emails = emails
+    return quota
@@ -0,0 +1,121 @@
+import time
+from functools import lru_cache
+import redis
+from django.conf import settings
+
+
+# Takes `requested` tokens from every bucket at once, or from none of them.
+# Returns "0" when granted, otherwise the seconds until all buckets can cover the request.
+# The clock is Redis's own, so workers whose clocks disagree still refill buckets at the same rate.
+TOKEN_BUCKET_SCRIPT = """
+-- Before Redis 5 a script may only write after reading the clock when its effects are replicated
+if redis.replicate_commands then
+    redis.replicate_commands()
+end
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local requested = tonumber(ARGV[1])
+local wait = 0
+local tokens = {}
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2])
+    local burst = tonumber(ARGV[1 + i * 2])
+    local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+    local available = tonumber(bucket[1]) or burst
+    local updated = tonumber(bucket[2]) or now
+    available = math.min(burst, available + math.max(0, now - updated) * rate)
+    tokens[i] = available
+    if available < requested then
+        wait = math.max(wait, (requested - available) / rate)
+    end
+end
+if wait > 0 then
+    return tostring(wait)
+end
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2])
+    local burst = tonumber(ARGV[1 + i * 2])
+    redis.call('HSET', key, 'tokens', tostring(tokens[i] - requested), 'ts', tostring(now))
+    redis.call('EXPIRE', key, math.ceil(burst / rate) + 60)
+end
+return "0"
+"""
+
+
+@lru_cache(maxsize=None)
+def get_redis():
+    """
+    Returns the Redis client shared by the rate limiters of this process.
+    """
+    return redis.Redis.from_url(settings.REDIS_URL)
+
+
+class SendRateLimiter:
+    """
+    Token buckets on outgoing mail, shared by every Celery worker through Redis.
+
+    A request is only granted when every bucket (global, backend and sending user)
+    can cover it, so the strictest limit applies.
+    """
+    key_prefix = 'liftsmail:ratelimit'
+
+    def __init__(self, buckets, client=None):
+        self.buckets = buckets
+        self.client = client or get_redis()
+        self.script = self.client.register_script(TOKEN_BUCKET_SCRIPT)
+        # A request larger than the smallest burst could never be granted in one go
+        self.max_tokens = min(int(burst) for _, _, burst in buckets)
+
+    @classmethod
+    def for_sender(cls, user_id, backend=None, client=None):
+        """
+        Builds the limiter for a sending user from settings.EMAIL_RATE_LIMITS.
+
+        Returns:
+            SendRateLimiter: The limiter, or None if no limit applies.
+        """
+        limits = settings.EMAIL_RATE_LIMITS
+        backend = backend or settings.EMAIL_BULK_BACKEND or settings.EMAIL_BACKEND
+        user_limit = limits.get('users', {}).get(user_id, limits.get('user'))
+        candidates = [
+            ('global', limits.get('global')),
+            (f'backend:{backend}', limits.get('backends', {}).get(backend)),
+            (f'user:{user_id}', user_limit if user_id is not None else None),
+        ]
+        buckets = [
+            (f'{cls.key_prefix}:{name}', limit['rate'], limit['burst'])
+            for name, limit in candidates if limit
+        ]
+        if not buckets:
+            return None
+        return cls(buckets, client=client)
+
+    def try_acquire(self, tokens):
+        """
+        Takes `tokens` from every bucket if they all have enough.
+
+        Returns:
+            float: 0 when granted, otherwise the seconds to wait before retrying.
+        """
+        args = [tokens]
+        for _, rate, burst in self.buckets:
+            args.extend([rate, burst])
+        return float(self.script(keys=[key for key, _, _ in self.buckets], args=args))
+
+    def acquire(self, tokens):
+        """
+        Blocks until `tokens` messages may be sent.
+
+        Returns:
+            float: The total time spent waiting, in seconds.
+        """
+        waited = 0
+        while tokens > 0:
+            requested = min(tokens, self.max_tokens)
+            wait = self.try_acquire(requested)
+            if wait:
+                time.sleep(wait)
+                waited += wait
+            else:
+                tokens -= requested
+        return waited
@@ -0,0 +1,44 @@
+import zoneinfo
+from datetime import datetime, time
+from dateutil.rrule import DAILY, MONTHLY, WEEKLY, YEARLY, rrule, rrulestr
+
+REPEAT_FREQUENCIES = {
+    'day': DAILY,
+    'week': WEEKLY,
+    'month': MONTHLY,
+    'year': YEARLY,
+}
+
+
+def build_recurrence(repeats_every, at, starts, interval=None, ends=None):
+    """
+    Builds the RRULE of a recurring email session.
+
+    Occurrences are in wall-clock time of the session's timezone, so a daily send at
+    10:00 stays at 10:00 across DST changes. Intervals count from the start date
+    rather than resetting every month, and a monthly send on the 31st skips the
+    months without one.
+
+    Args:
+        repeats_every (str): One of 'day', 'week', 'month' or 'year'.
+        at (time): Local time of day of each send.
+        starts (date): Date of the first send.
+        interval (int): Repeat every `interval` days, weeks, months or years.
+        ends (date): Last date a send may happen on.
+
+    Returns:
+        str: The rule with its DTSTART, in iCalendar format.
+    """
+    until = datetime.combine(ends, time(23, 59, 59)) if ends else None
+    rule = rrule(REPEAT_FREQUENCIES[repeats_every], interval=interval or 1, dtstart=datetime.combine(starts, at), until=until)
+    return str(rule)
+
+
+def next_occurrence(recurrence, timezone_name, after, inclusive=False):
+    """
+    Returns the first occurrence of a rule after `after` as an aware datetime, or None once the rule has ended.
+    """
+    zone = zoneinfo.ZoneInfo(timezone_name)
+    local = after.astimezone(zone).replace(tzinfo=None)
+    occurrence = rrulestr(recurrence).after(local, inc=inclusive)
+    return occurrence.replace(tzinfo=zone) if occurrence else None
@@ -1,23 +1,87 @@
+from django.conf import settings
+from django.template import TemplateSyntaxError
+from django.utils.timezone import now
+from emailcontacts.importers import normalize_email
 from emailcontacts.models import Group
-from .models import EmailTemplate, EmailSession
+from emailcontacts.recipients import has_recipients
+from .attachments import guess_mimetype
+from .models import EmailAttachment, EmailDelivery, EmailTemplate, EmailSession, Suppression
+from .recurrence import build_recurrence, next_occurrence
+from .utils import analyze_template
 from rest_framework import serializers
 
 
+def validate_template_body(value):
+    """
+    Compiles a template body, so syntax errors are reported when it is saved rather than mid-send.
+    """
+    try:
+        analyze_template(value)
+    except TemplateSyntaxError as e:
+        raise serializers.ValidationError(f"Invalid template: {e}")
+    return value
+
+
 class EmailTemplatesSerializers(serializers.ModelSerializer):
     class Meta:
         model = EmailTemplate
         exclude = ['user']
+        read_only_fields = ('variables', 'is_static')
+
+    def validate_body(self, value):
+        return validate_template_body(value)
+
+    def validate(self, attrs):
+        if 'body' in attrs:
+            # Stored with the template so send paths know which contact columns to read
+            info = analyze_template(attrs['body'])
+            attrs['variables'] = info.variables
+            attrs['is_static'] = info.static
+        return super().validate(attrs)
 
 class SimpleEmailTemplatesSerializers(serializers.ModelSerializer):
     class Meta:
         model = EmailTemplate
-        exclude = ['user', 'name']
+        exclude = ['user', 'name', 'variables', 'is_static']
+
+    def validate_body(self, value):
+        return validate_template_body(value)
+
+class EmailAttachmentSerializer(serializers.ModelSerializer):
+    file = serializers.FileField(write_only=True)
+
+    class Meta:
+        model = EmailAttachment
+        fields = ['id', 'template', 'file', 'filename', 'mimetype', 'size', 'created_at']
+        read_only_fields = ('filename', 'mimetype', 'size')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request', None)
+        if request and hasattr(request, 'user') and request.user.is_authenticated:
+            self.fields['template'].queryset = EmailTemplate.objects.filter(user=request.user)
+
+    def validate_file(self, value):
+        if value.size > settings.EMAIL_ATTACHMENT_MAX_SIZE:
+            raise serializers.ValidationError(f"Attachments can be at most {settings.EMAIL_ATTACHMENT_MAX_SIZE} bytes")
+        return value
+
+    def create(self, validated_data):
+        upload = validated_data['file']
+        validated_data.update(
+            filename=upload.name,
+            mimetype=guess_mimetype(upload.name, upload.content_type),
+            size=upload.size,
+        )
+        return super().create(validated_data)
+
 
 class SendNowSerializer(serializers.ModelSerializer):
     template = SimpleEmailTemplatesSerializers() 
+    attachments = serializers.PrimaryKeyRelatedField(many=True, required=False, queryset=EmailAttachment.objects.none())
     class Meta:
         model = EmailSession
-        fields = ['id', 'user', 'session', 'group_id', 'template']
+        fields = ['id', 'user', 'session', 'group_id', 'template', 'attachments']
         read_only_fields = ('user',)
 
     # To list only users group in the group_id drop down
@@ -28,18 +92,24 @@ class SendNowSerializer(serializers.ModelSerializer):
         if request and hasattr(request, 'user') and request.user.is_authenticated:
             user = request.user
             self.fields['group_id'].queryset = Group.objects.filter(user=user)
+            self.fields['attachments'].child_relation.queryset = EmailAttachment.objects.filter(user=user)
 
     def create(self, validated_data):
         session = validated_data.get('session', None)
         group_id = validated_data['group_id']
         user = self.context.get('request').user
-        EmailSession.objects.create(session=session, group_id=group_id, user=user)
-        return EmailSession
+        email_session = EmailSession.objects.create(
+            session=session, group_id=group_id, user=user, quota_emails=validated_data.get('quota_emails', 0),
+        )
+        if validated_data.get('attachments'):
+            email_session.attachments.set(validated_data['attachments'])
+        return email_session
 
 class ScheduleSerializer(serializers.ModelSerializer):
     class Meta:
         model = EmailSession
-        exclude = ['user', 'one_off']
+        exclude = ['user', 'one_off', 'recurrence', 'timezone', 'recurring_session', 'attachments']
+        read_only_fields = ('next_run_at', 'recipient_count', 'sent_count', 'failed_count', 'quota_emails')
 
     def __init__(self, **kwargs):
         super(ScheduleSerializer, self).__init__(**kwargs)
@@ -62,8 +132,7 @@ class ScheduleSerializer(serializers.ModelSerializer):
         return super().validate(attrs)
 
     def validate_group_id(self, value):
-        contacts = value.contacts.all()
-        if len(contacts) == 0:
+        if not has_recipients(value.id):
             raise serializers.ValidationError("Group has no contacts")
         return value
 
@@ -106,11 +175,16 @@ class RecurringEmailSerilaizer(serializers.ModelSerializer):
             raise serializers.ValidationError('Template is required')
         if starts and ends and ends <= starts:
             raise serializers.ValidationError("End date must be after the start date.")
+
+        data['timezone'] = settings.EMAIL_SCHEDULE_TIMEZONE
+        data['recurrence'] = build_recurrence(data['repeats_every'], data['time'], starts, data.get('interval'), ends)
+        data['next_run_at'] = next_occurrence(data['recurrence'], data['timezone'], now(), inclusive=True)
+        if data['next_run_at'] is None:
+            raise serializers.ValidationError("The schedule has no sends left.")
         return data
 
     def validate_group_id(self, value):
-        contacts = value.contacts.all()
-        if len(contacts) == 0:
+        if not has_recipients(value.id):
             raise serializers.ValidationError("Group has no contacts")
         return value
     
@@ -120,7 +194,10 @@ class RecurringEmailSerilaizer(serializers.ModelSerializer):
             user = self.context.get('user'),
             session = validated_data['session'],
             group_id = validated_data['group_id'],
-            template_id = validated_data['template_id']
+            template_id = validated_data['template_id'],
+            recurrence = validated_data['recurrence'],
+            timezone = validated_data['timezone'],
+            next_run_at = validated_data['next_run_at'],
         )
         return Emailsession
 
@@ -128,5 +205,20 @@ class EmailSessionSerializer(serializers.ModelSerializer):
     class Meta:
         model = EmailSession
         fields = '__all__'
+        read_only_fields = ('recipient_count', 'sent_count', 'failed_count', 'quota_emails', 'next_run_at', 'recurrence', 'timezone', 'recurring_session')
+
+
+class EmailDeliverySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = EmailDelivery
+        exclude = ['session']
+
+
+class SuppressionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Suppression
+        fields = ['id', 'email', 'reason', 'created_at']
 
+    def validate_email(self, value):
+        return normalize_email(value)
 
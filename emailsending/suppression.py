@@ -0,0 +1,95 @@
+import hashlib
+import math
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max
+from emailsending.models import Suppression
+
+# Filters are rebuilt whenever the list changes, so this only bounds how long an unused one is kept
+BLOOM_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+class BloomFilter:
+    """
+    Compact set membership with no false negatives and a bounded false positive rate.
+
+    Sized for `capacity` items at `error_rate` false positives. The bit array is a
+    bytearray, so filters can be stored in the Django cache.
+    """
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(capacity, 1)
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        # Double hashing: k positions from the two halves of one digest
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class SuppressionList:
+    """
+    The addresses a user has suppressed, loaded once per chunk task.
+
+    Small lists are checked with one exact query per batch of recipients. Lists of
+    at least EMAIL_SUPPRESSION_BLOOM_THRESHOLD addresses are first checked against a
+    Bloom filter, kept in the Django cache until the list changes, and only the
+    addresses it matches are confirmed with the exact query.
+    """
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.queryset = Suppression.objects.filter(user_id=user_id)
+        stats = self.queryset.aggregate(count=Count('id'), last=Max('id'), updated=Max('updated_at'))
+        self.count = stats['count']
+        self.bloom = None
+        if self.count >= settings.EMAIL_SUPPRESSION_BLOOM_THRESHOLD:
+            # Adding or removing an address changes the count or the last id, and editing one
+            # in place moves the latest update, so any change to the list changes the key
+            key = f'emailsending:suppression:{user_id}:{stats["count"]}:{stats["last"]}:{stats["updated"].timestamp()}'
+            self.bloom = cache.get(key)
+            if self.bloom is None:
+                self.bloom = self.build_bloom()
+                cache.set(key, self.bloom, BLOOM_CACHE_TIMEOUT)
+
+    def build_bloom(self):
+        bloom = BloomFilter(self.count, settings.EMAIL_SUPPRESSION_BLOOM_ERROR_RATE)
+        for email in self.queryset.values_list('email', flat=True).iterator(chunk_size=5000):
+            bloom.add(email)
+        return bloom
+
+    def suppressed(self, emails):
+        """
+        Returns the subset of `emails` on the list.
+        """
+        if not self.count:
+            return set()
+        candidates = [email for email in emails if self.bloom is None or email in self.bloom]
+        if not candidates:
+            return set()
+        return set(self.queryset.filter(email__in=candidates).values_list('email', flat=True))
+
+    def filter(self, recipients):
+        """
+        Drops the suppressed recipients from a batch.
+
+        Args:
+            recipients (iterable): Recipient records with an `email` attribute.
+
+        Returns:
+            list: The recipients that may be sent to.
+        """
+        recipients = list(recipients)
+        suppressed = self.suppressed([recipient.email for recipient in recipients])
+        if not suppressed:
+            return recipients
+        return [recipient for recipient in recipients if recipient.email not in suppressed]
@@ -1,12 +1,31 @@
+from contextlib import nullcontext
 from time import sleep
 from celery import shared_task
 from celery.utils.log import get_task_logger
+from django.conf import settings
+from django.contrib.auth import get_user_model
 from django.core.mail import send_mass_mail
-from emailsending.utils import format_email, send_email
-from django.core.mail import send_mail
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+from emailcontacts.models import Group
+from emailcontacts.recipients import RECIPIENT_FIELDS, chunk_bounds, recipient_type, stream_recipients
+from emailsending.attachments import session_attachments
+from emailsending.delivery import BatchSender, CampaignMessage, DeliveryCheckpoint
+from emailsending.fairshare import BULK, LANES, TRANSACTIONAL, FairScheduler
+from emailsending.models import EmailSession
+from emailsending.quotas import charge_run
+from emailsending.ratelimit import SendRateLimiter
+from emailsending.recurrence import next_occurrence
+from emailsending.suppression import SuppressionList
+from emailsending.utils import (
+    contact_renderer, contact_text_renderer, get_renderer, get_text_renderer, recipient_fields, remember_template_info,
+    send_email, template_info,
+)
 
 logger = get_task_logger(__name__)
 
+User = get_user_model()
+
 
 @shared_task
 def send_email_task(subject, message, recipient):
@@ -14,29 +33,298 @@ def send_email_task(subject, message, recipient):
     send_email(subject, message, recipient)
 
 
-@shared_task
-def send_bulk_emails(subject, html_message, sender_email, contact_list):
+@shared_task(bind=True, max_retries=3)
+def send_bulk_emails(self, subject, html_message, sender_email, contact_list, session_id=None):
     """
-    Sends emails to each contact in the contact list.
+    Sends emails to each contact in the contact list over a single connection, in batches.
+
+    Only a task with a session is retried on database errors, as nothing records
+    which contacts a task without one has already sent to.
     """
-    for contact in contact_list:
-        # Personalize the message for each contact
-        personalized_message = format_email(html_message, {
+    try:
+        return send_contact_list(subject, html_message, sender_email, contact_list, session_id)
+    except DatabaseError as e:
+        if session_id is None:
+            raise
+        raise self.retry(exc=e, countdown=2 ** self.request.retries)
+
+
+def send_contact_list(subject, html_message, sender_email, contact_list, session_id=None):
+    """
+    Sends emails to each contact in the contact list over a single connection, in batches.
+
+    Contacts on the sender's suppression list are skipped. With a session id,
+    deliveries are checkpointed per batch, so a retried task skips the contacts that
+    were already sent, and the session's attachments are encoded once and shared by
+    every message.
+    """
+    user_id = User.objects.filter(email=sender_email).values_list('id', flat=True).first()
+    if user_id is not None:
+        suppressed = SuppressionList(user_id).suppressed([contact['email'] for contact in contact_list])
+        contact_list = [contact for contact in contact_list if contact['email'] not in suppressed]
+
+    info = template_info(html_message)
+    renderer = get_renderer(html_message)
+    text_renderer = get_text_renderer(html_message) if settings.EMAIL_TEXT_ALTERNATIVE else None
+    # Rendered once for static templates, which may still hold {# comments #}
+    static_html = renderer.render({}) if info.static else None
+    static_text = text_renderer.render({}) if text_renderer and info.static else None
+    campaign = CampaignMessage(
+        subject, sender_email, session_attachments(session_id) if session_id is not None else (), text=text_renderer is not None,
+    )
+
+    # Deliveries are claimed last, so an error while preparing the send leaves them queued for a retry
+    checkpoint = None
+    if session_id is not None:
+        Recipient = recipient_type(RECIPIENT_FIELDS)
+        checkpoint = DeliveryCheckpoint(
+            session_id, (Recipient(*(contact.get(field) for field in RECIPIENT_FIELDS)) for contact in contact_list)
+        )
+        contacts = {contact['email']: contact for contact in contact_list}
+        contact_list = (contacts[recipient.email] for recipient in checkpoint.take())
+
+    def build(contact):
+        # Personalize the message for each contact, unless it has nothing to fill in
+        if info.static:
+            return campaign.build(static_html, contact['email'], static_text or '')
+        context = {
             "first_name": contact['first_name'],
             "last_name": contact['last_name'],
             "email": contact['email'],
             "contact_id": contact['id'],
-        })
-
-        # Send the email
-        send_mail(
-            subject=subject,
-            message=None,  # Optional plain-text message
-            from_email=sender_email,
-            recipient_list=[contact['email']],  # Send to the specific contact
-            fail_silently=False,
-            html_message=personalized_message  # Send HTML message
+        }
+        return campaign.build(renderer.render(context), contact['email'], text_renderer.render(context) if text_renderer else '')
+
+    messages = (build(contact) for contact in contact_list)
+
+    on_chunk = checkpoint.record if checkpoint else None
+    with checkpoint or nullcontext(), BatchSender(rate_limiter=SendRateLimiter.for_sender(user_id), on_chunk=on_chunk) as sender:
+        return sender.send(messages)
+
+
+def recurring_run(session, schedule_time):
+    """
+    Returns a new, unsaved session for one occurrence of a recurring session.
+    """
+    return EmailSession(
+        user_id=session.user_id, session=session.session, group_id_id=session.group_id_id,
+        template_id_id=session.template_id_id, one_off=True, schedule_time=schedule_time,
+        recurring_session=session,
+    )
+
+
+@shared_task
+def send_email_session(session_id):
+    """
+    Sends a scheduled email session to its group's current contacts.
+
+    The scheduler only passes the session id, the template and recipients are read when the task fires.
+    A session that is not one-off is a recurring schedule, fired by a periodic task created before
+    dispatch_due_sessions. Each firing is sent as a new run of it, as the scheduler's occurrences are,
+    since its own deliveries were checkpointed by the first one.
+    """
+    try:
+        session = EmailSession.objects.select_related('template_id', 'user').get(pk=session_id)
+    except EmailSession.DoesNotExist:
+        logger.warning("Email session %s no longer exists", session_id)
+        return {"chunks": 0}
+
+    if not session.one_off:
+        run = recurring_run(session, timezone.now())
+        quota = charge_run(run)
+        if quota is None:
+            logger.warning("Run of email session %s skipped, its user is over quota", session_id)
+            return {"chunks": 0}
+        try:
+            run.save()
+        except BaseException:
+            quota.refund(sessions=1, emails=run.quota_emails)
+            raise
+        session_id = run.id
+
+    template = session.template_id
+    cleaned_body = template.body.replace('\n', '').replace('<br>', '<br>').replace('\r', '<br>')
+    if template.variables is not None:
+        # Analyzed when the template was saved, the chunk tasks find it in the cache
+        remember_template_info(cleaned_body, template.variables, template.is_static)
+    return dispatch_email_session(session_id, template.subject, cleaned_body, session.user.email)
+
+
+@shared_task
+def dispatch_due_sessions():
+    """
+    Sends the email sessions whose next run is due, run every minute by beat.
+
+    Due sessions are claimed in batches with SELECT ... FOR UPDATE SKIP LOCKED, so
+    overlapping runs never send a session twice, and their next run is moved on in
+    the same transaction. A recurring session gets a new session for each occurrence,
+    keeping every run's deliveries apart. Occurrences missed while the scheduler was
+    down are sent once. Each run is charged to its user's quotas, and skipped when
+    they are used up.
+    """
+    dispatched = 0
+    while True:
+        current = timezone.now()
+        charged = []
+        try:
+            with transaction.atomic():
+                due = list(
+                    EmailSession.objects.select_for_update(skip_locked=True)
+                    .filter(next_run_at__lte=current)
+                    .order_by('next_run_at')[:settings.EMAIL_SCHEDULER_BATCH_SIZE]
+                )
+                runs = []
+                for session in due:
+                    if session.recurrence:
+                        run = recurring_run(session, session.next_run_at)
+                        quota = charge_run(run)
+                        if quota is not None:
+                            runs.append(run)
+                            charged.append((quota, run))
+                        else:
+                            logger.warning("Run of email session %s skipped, its user is over quota", session.id)
+                        session.next_run_at = next_occurrence(session.recurrence, session.timezone, current)
+                    else:
+                        runs.append(session)
+                        session.next_run_at = None
+                EmailSession.objects.bulk_create([run for run in runs if run.pk is None])
+                EmailSession.objects.bulk_update(due, ['next_run_at'])
+                for run in runs:
+                    transaction.on_commit(lambda run_id=run.id: send_email_session.delay(run_id))
+        except BaseException:
+            # The runs were not created, so they do not count
+            for quota, run in charged:
+                quota.refund(sessions=1, emails=run.quota_emails)
+            raise
+        dispatched += len(due)
+        if len(due) < settings.EMAIL_SCHEDULER_BATCH_SIZE:
+            return {"dispatched": dispatched}
+
+
+@shared_task
+def dispatch_email_session(session_id, subject, html_message, sender_email=None, transactional=False):
+    """
+    Splits an email session into chunks and queues them with the fair-share scheduler.
+
+    Sessions sent now (`transactional`) with at most EMAIL_TRANSACTIONAL_MAX_CHUNKS
+    chunks go in the transactional lane, whose chunks are started before any bulk
+    chunk and run on their own queue. Every other session goes in the bulk lane,
+    where chunks are started round-robin by user as slots free up.
+    """
+    session = EmailSession.objects.values('group_id', 'user_id').get(pk=session_id)
+    bounds = chunk_bounds(session['group_id'], settings.EMAIL_CHUNK_SIZE)
+    if not bounds:
+        logger.info("Email session %s has no contacts", session_id)
+        return {"chunks": 0}
+
+    lane = TRANSACTIONAL if transactional and len(bounds) <= settings.EMAIL_TRANSACTIONAL_MAX_CHUNKS else BULK
+    scheduler = FairScheduler()
+    scheduler.submit(lane, session['user_id'], session_id, bounds, {
+        "group_id": session['group_id'],
+        "subject": subject,
+        "html_message": html_message,
+        "sender_email": sender_email,
+    })
+    start_chunks(scheduler)
+    return {"chunks": len(bounds), "lane": lane}
+
+
+def start_chunks(scheduler=None):
+    """
+    Sends waiting chunks to their lane's queue while the lane has free slots,
+    transactional chunks first.
+
+    A chunk whose task cannot be published is put back with its slot freed, and
+    start_waiting_chunks tries again on its next run.
+
+    Returns:
+        int: The number of chunk tasks started.
+    """
+    scheduler = scheduler or FairScheduler()
+    started = 0
+    for lane in LANES:
+        while (work := scheduler.pop(lane)) is not None:
+            token, session_id, (after_id, upto_id), campaign = work
+            chunk = [after_id, upto_id]
+            try:
+                send_email_chunk.apply_async(
+                    (session_id, campaign["group_id"], campaign["subject"], campaign["html_message"], campaign["sender_email"], after_id, upto_id),
+                    queue=lane,
+                    link=chunk_finished.s(lane, token, session_id, chunk),
+                    link_error=chunk_finished.si(None, lane, token, session_id, chunk),
+                )
+            except Exception:
+                logger.exception("Could not start chunk %s of email session %s", chunk, session_id)
+                scheduler.requeue(lane, token, session_id, chunk, campaign)
+                return started
+            started += 1
+    return started
+
+
+@shared_task
+def start_waiting_chunks():
+    """
+    Starts the chunks waiting for a slot, run by beat so that slots held by chunk
+    tasks that died are reused once they expire.
+    """
+    return {"started": start_chunks()}
+
+
+@shared_task
+def chunk_finished(result, lane, token, session_id, chunk):
+    """
+    Frees the slot of a finished chunk task and starts the next waiting chunks.
+
+    `result` is the chunk's summary, or None when the task failed. The session is
+    finished with finish_email_session once all of its chunks have reported.
+    """
+    if result is None:
+        result = {"sent": 0, "failed": [{"chunk": chunk, "recipients": [], "error": "The chunk task failed"}]}
+    scheduler = FairScheduler()
+    results = scheduler.complete(lane, token, session_id, chunk, result)
+    if results is not None:
+        finish_email_session(results, session_id)
+    start_chunks(scheduler)
+
+
+@shared_task(acks_late=True, autoretry_for=(DatabaseError,), retry_backoff=True, max_retries=3)
+def send_email_chunk(session_id, group_id, subject, html_message, sender_email, after_id, upto_id):
+    """
+    Renders and sends the email to the contacts in the (after_id, upto_id] range of a group.
+
+    Contacts on the group owner's suppression list are dropped before any delivery
+    row is created. The session's attachments are encoded once for the chunk and
+    shared by all of its messages. Progress is checkpointed on the session's delivery rows after
+    every batch, so a retried or redelivered chunk only sends to the contacts not
+    sent yet.
+    """
+    info = template_info(html_message)
+    render = contact_renderer(html_message, info)
+    render_text = contact_text_renderer(html_message, info) if settings.EMAIL_TEXT_ALTERNATIVE else None
+    user_id = Group.objects.values_list('user_id', flat=True).get(pk=group_id)
+    recipients = SuppressionList(user_id).filter(
+        stream_recipients(group_id, fields=recipient_fields(info), after_id=after_id, upto_id=upto_id)
+    )
+    campaign = CampaignMessage(subject, sender_email, session_attachments(session_id), text=render_text is not None)
+    with DeliveryCheckpoint(session_id, recipients) as checkpoint:
+        messages = (
+            campaign.build(render(contact), contact.email, render_text(contact) if render_text else '')
+            for contact in checkpoint.take()
         )
+        with BatchSender(rate_limiter=SendRateLimiter.for_sender(user_id), on_chunk=checkpoint.record) as sender:
+            result = sender.send(messages)
+    return result
+
+
+@shared_task
+def finish_email_session(results, session_id):
+    """
+    Collects the chunk summaries of an email session once every chunk has finished.
+    """
+    sent = sum(result["sent"] for result in results)
+    failed = [failure for result in results for failure in result["failed"]]
+    logger.info("Email session %s finished: %s sent, %s failed chunks", session_id, sent, len(failed))
+    return {"sent": sent, "failed": failed}
 
 
 @shared_task
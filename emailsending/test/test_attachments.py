@@ -0,0 +1,83 @@
+import os
+import re
+import tempfile
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.test import TestCase, override_settings
+from emailcontacts.models import Group
+from emailsending.attachments import SharedAttachment, guess_mimetype, open_content, session_attachments
+from emailsending.delivery import CampaignMessage, PreparedEmailMessage, build_html_message
+from emailsending.models import EmailAttachment, EmailSession, EmailTemplate
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'liftsmail.settings')
+
+User = get_user_model()
+
+
+def without_unique_headers(data):
+    data = re.sub(rb'(Date|Message-ID): [^\r\n]+', rb'\1: -', data)
+    return re.sub(rb'=+\d+==', b'BOUNDARY', data)
+
+
+class SharedAttachmentTests(TestCase):
+    def setUp(self):
+        self.attachments = [
+            SharedAttachment("invoice.pdf", "application/pdf", os.urandom(5000)),
+            SharedAttachment("brochüre.txt", "text/plain", b"Hello\n"),
+            SharedAttachment("empty.bin", "application/octet-stream", b""),
+        ]
+
+    def test_same_bytes_as_attaching_per_message(self):
+        for attachments in (self.attachments[:1], self.attachments):
+            campaign = CampaignMessage("Héllo", "sender@app.com", attachments)
+            for body, recipient in [("<p>Hi</p>", "user@example.com"), ("<p>Hi é</p>\n", "user@example.com"), ("<p>Hi</p>", "usér@example.com")]:
+                with self.subTest(count=len(attachments), body=body, recipient=recipient):
+                    expected = build_html_message("Héllo", body, "sender@app.com", recipient)
+                    for attachment in attachments:
+                        expected.attach(attachment.mime())
+                    self.assertEqual(
+                        without_unique_headers(campaign.build(body, recipient).message().as_bytes(linesep='\r\n')),
+                        without_unique_headers(expected.message().as_bytes(linesep='\r\n')),
+                    )
+
+    def test_encoded_part_shared_by_reference(self):
+        campaign = CampaignMessage("Subject", "sender@app.com", self.attachments[:1])
+        messages = [campaign.build("<p>Hi</p>", f"user{i}@example.com") for i in range(3)]
+        for message in messages:
+            self.assertIsInstance(message, PreparedEmailMessage)
+            self.assertTrue(any(segment is self.attachments[0].data for segment in message.segments))
+
+    def test_guess_mimetype(self):
+        self.assertEqual(guess_mimetype("invoice.pdf", "application/octet-stream"), "application/pdf")
+        self.assertEqual(guess_mimetype("data", "text/csv"), "text/csv")
+        self.assertEqual(guess_mimetype("data"), "application/octet-stream")
+
+
+class SessionAttachmentsTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings = override_settings(MEDIA_ROOT=media_root.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.user = User.objects.create_user(email='testuser@app.com', password='password123')
+        self.group = Group.objects.create(name="Test Group", user=self.user)
+        self.template = EmailTemplate.objects.create(user=self.user, name="T", subject="Hello", body="Hi")
+
+    def attachment(self, name, content, **kwargs):
+        return EmailAttachment.objects.create(
+            user=self.user, file=ContentFile(content, name=name), filename=name, mimetype=guess_mimetype(name), size=len(content), **kwargs
+        )
+
+    def test_template_and_session_attachments(self):
+        brochure = self.attachment("brochure.pdf", b"%PDF brochure", template=self.template)
+        invoice = self.attachment("invoice.pdf", b"%PDF invoice")
+        self.attachment("unused.pdf", b"%PDF unused")
+        session = EmailSession.objects.create(user=self.user, group_id=self.group, template_id=self.template)
+        session.attachments.add(invoice, brochure)
+
+        with open_content(invoice) as content:
+            self.assertEqual(content[:], b"%PDF invoice")
+        attachments = session_attachments(session.id)
+        self.assertEqual([attachment.filename for attachment in attachments], ["brochure.pdf", "invoice.pdf"])
+        self.assertEqual(attachments[1].mime().get_payload(decode=True), b"%PDF invoice")
@@ -0,0 +1,82 @@
+import os
+import socket
+from aiosmtpd.controller import Controller
+from django.core.mail import EmailMessage
+from django.test import SimpleTestCase, override_settings
+from emailsending.backends import AsyncSMTPEmailBackend
+from emailsending.delivery import BatchSender, build_html_message
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'liftsmail.settings')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class SinkHandler:
+    def __init__(self, reject=()):
+        self.messages = []
+        self.peers = set()
+        self.reject = set(reject)
+
+    async def handle_DATA(self, server, session, envelope):
+        if envelope.rcpt_tos[0] in self.reject:
+            return '550 Mailbox unavailable'
+        self.messages.append(envelope)
+        self.peers.add(session.peer)
+        return '250 Message accepted for delivery'
+
+
+@override_settings(EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD='', EMAIL_USE_TLS=False, EMAIL_USE_SSL=False)
+class AsyncSMTPEmailBackendTests(SimpleTestCase):
+    def setUp(self):
+        self.handler = SinkHandler()
+        self.port = free_port()
+        self.controller = Controller(self.handler, hostname='127.0.0.1', port=self.port)
+        self.controller.start()
+        self.addCleanup(self.controller.stop)
+
+    def backend(self, **kwargs):
+        return AsyncSMTPEmailBackend(host='127.0.0.1', port=self.port, **kwargs)
+
+    def test_send_messages_across_sessions(self):
+        messages = [build_html_message("Subject", f"<p>{i}</p>", "sender@app.com", f"user{i}@example.com") for i in range(20)]
+        with BatchSender(connection=self.backend(connections=4), chunk_size=10) as sender:
+            summary = sender.send(messages)
+        self.assertEqual(summary, {"sent": 20, "failed": []})
+        self.assertEqual(sorted(envelope.rcpt_tos[0] for envelope in self.handler.messages), sorted(f"user{i}@example.com" for i in range(20)))
+        self.assertEqual(len(self.handler.peers), 4)
+
+    def test_rejected_message_fails_alone(self):
+        self.handler.reject = {"user3@example.com"}
+        messages = [build_html_message("Subject", f"<p>{i}</p>", "sender@app.com", f"user{i}@example.com") for i in range(6)]
+        with BatchSender(connection=self.backend(connections=2), chunk_size=6) as sender:
+            summary = sender.send(messages)
+        self.assertEqual(summary["sent"], 5)
+        self.assertEqual(summary["failed"][0]["recipients"], ["user3@example.com"])
+        self.assertEqual(summary["failed"][0]["unknown"], [])
+        self.assertEqual(len(self.handler.messages), 5)
+
+    def test_send_without_open_connects_per_call(self):
+        backend = self.backend(connections=2)
+        sent = backend.send_messages([EmailMessage("Subject", "Body", "sender@app.com", ["john@example.com"])])
+        self.assertEqual(sent, 1)
+        self.assertIsNone(backend.loop)
+        self.assertIn(b"Subject: Subject", self.handler.messages[0].original_content)
+
+    def test_connection_refused(self):
+        backend = AsyncSMTPEmailBackend(host='127.0.0.1', port=1, connections=1, timeout=2)
+        with self.assertRaises(OSError):
+            backend.open()
+        self.assertIsNone(backend.loop)
+        self.assertEqual(AsyncSMTPEmailBackend(host='127.0.0.1', port=1, connections=1, timeout=2, fail_silently=True).send_messages(
+            [EmailMessage("Subject", "Body", "sender@app.com", ["john@example.com"])]
+        ), 0)
+
+    def test_ping(self):
+        backend = self.backend(connections=2)
+        self.assertFalse(backend.ping())
+        with backend:
+            self.assertTrue(backend.ping())
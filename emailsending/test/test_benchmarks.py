@@ -0,0 +1,47 @@
+import io
+import json
+import math
+import os
+import tempfile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase, TestCase
+from emailsending.benchmarks import compare
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'liftsmail.settings')
+
+
+class CompareTests(SimpleTestCase):
+    def test_flags_slowdowns_over_threshold(self):
+        baseline = {"format_email@10": {"seconds": 1.0}, "contact_list@10": {"seconds": 1.0}, "removed@10": {"seconds": 1.0}}
+        results = {"format_email@10": {"seconds": 1.1}, "contact_list@10": {"seconds": 1.5}, "new@10": {"seconds": 1.0}}
+        rows = compare(results, baseline, threshold=0.2)
+        self.assertEqual([(case, regressed) for case, _, _, _, regressed in rows], [("format_email@10", False), ("contact_list@10", True)])
+
+    def test_zero_second_baseline(self):
+        baseline = {"unchanged@10": {"seconds": 0.0}, "slower@10": {"seconds": 0.0}}
+        results = {"unchanged@10": {"seconds": 0.0}, "slower@10": {"seconds": 0.5}}
+        rows = compare(results, baseline, threshold=0.2)
+        self.assertEqual([(case, change, regressed) for case, _, _, change, regressed in rows], [
+            ("unchanged@10", 0.0, False), ("slower@10", math.inf, True),
+        ])
+
+
+class BenchmarkCommandTests(TestCase):
+    def test_writes_results_and_compares(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'results.json')
+            call_command('benchmark', sizes=[5], repeat=1, output=output, stdout=io.StringIO())
+            with open(output) as results:
+                report = json.load(results)
+            self.assertEqual(report["meta"]["sizes"], [5])
+            self.assertEqual(report["results"]["send_bulk_emails[smtp]@5"]["items"], 5)
+
+            # Every case made a thousand times faster in the baseline is a regression
+            for result in report["results"].values():
+                result["seconds"] /= 1000
+            baseline = os.path.join(directory, 'baseline.json')
+            with open(baseline, 'w') as stored:
+                json.dump(report, stored)
+            with self.assertRaises(CommandError):
+                call_command('benchmark', sizes=[5], repeat=1, baseline=baseline, stdout=io.StringIO())
@@ -0,0 +1,206 @@
+import os
+import re
+import smtplib
+from unittest.mock import patch
+import fakeredis
+from django.core import mail
+from django.contrib.auth import get_user_model
+from django.core.mail.backends.locmem import EmailBackend
+from django.db import DatabaseError
+from django.test import TestCase, override_settings
+from emailcontacts.models import Contact, Group
+from emailsending.delivery import BatchSender, CampaignMessage, PreparedEmailMessage, build_html_message
+from emailsending.models import EmailDelivery, EmailSession
+from emailsending.tasks import send_bulk_emails
+from emailsending.utils import TemplateInfo
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'liftsmail.settings')
+
+User = get_user_model()
+
+
+class FlakyBackend(EmailBackend):
+    """
+    Locmem backend that drops the session or errors on chosen messages, counted from 1.
+
+    Like Django's SMTP backend, the messages before the failing one in the same
+    send_messages() call are delivered, and the ones after it are not.
+    """
+    def __init__(self, disconnect_on=(), fail_on=(), **kwargs):
+        super().__init__(**kwargs)
+        self.disconnect_on = set(disconnect_on)
+        self.fail_on = set(fail_on)
+        self.calls = 0
+        self.messages = 0
+        self.opened = 0
+
+    def open(self):
+        self.opened += 1
+        return True
+
+    def send_messages(self, messages):
+        self.calls += 1
+        sent = 0
+        for message in messages:
+            self.messages += 1
+            if self.messages in self.disconnect_on:
+                raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+            if self.messages in self.fail_on:
+                raise smtplib.SMTPDataError(451, "Try again later")
+            sent += super().send_messages([message])
+        return sent
+
+
+def make_messages(count):
+    return [
+        build_html_message("Subject", f"<p>Hello {i}</p>", "sender@app.com", f"user{i}@example.com")
+        for i in range(count)
+    ]
+
+
+def without_unique_headers(data):
+    data = re.sub(rb'(Date|Message-ID): [^\r\n]+', rb'\1: -', data)
+    return re.sub(rb'=+\d+==', b'BOUNDARY', data)
+
+
+class CampaignMessageTests(TestCase):
+    def test_same_bytes_as_per_message_construction(self):
+        bodies = ["<p>Hi</p>", "<p>Hi \u00e9</p>\nline\r\n", "a\rb\n\n", "", "<p>" + "a" * 1200 + "</p>"]
+        recipients = ["user@example.com", "first.last+tag@mail.example.co.uk", "us\u00e9r@example.com", "a" * 80 + "@example.com"]
+        for subject, sender in [("Hello", "sender@app.com"), ("H\u00e9llo " * 20, "S\u00e9nder <sender@app.com>")]:
+            campaign = CampaignMessage(subject, sender)
+            for body in bodies:
+                for recipient in recipients:
+                    with self.subTest(subject=subject, body=body, recipient=recipient):
+                        message = campaign.build(body, recipient)
+                        expected = build_html_message(subject, body, sender, recipient).message()
+                        for linesep in ('\r\n', '\n'):
+                            self.assertEqual(
+                                without_unique_headers(message.message().as_bytes(linesep=linesep)),
+                                without_unique_headers(expected.as_bytes(linesep=linesep)),
+                            )
+
+    def test_same_bytes_with_text_alternative(self):
+        texts = ["Hi", "Hi \u00e9\nline", "a" * 1200, ""]
+        campaign = CampaignMessage("Hello", "sender@app.com", text=True)
+        for body in ["<p>Hi</p>", "<p>Hi \u00e9</p>\n", "<p>" + "a" * 1200 + "</p>"]:
+            for text in texts:
+                with self.subTest(body=body, text=text):
+                    message = campaign.build(body, "user@example.com", text)
+                    expected = build_html_message("Hello", body, "sender@app.com", "user@example.com", text).message()
+                    self.assertEqual(
+                        without_unique_headers(message.message().as_bytes(linesep='\r\n')),
+                        without_unique_headers(expected.as_bytes(linesep='\r\n')),
+                    )
+        self.assertIsInstance(campaign.build("<p>Hi</p>", "user@example.com", "Hi"), PreparedEmailMessage)
+        self.assertIn(b'multipart/alternative', campaign.build("<p>Hi</p>", "user@example.com", "Hi").message().as_bytes())
+
+    def test_unusual_messages_built_per_message(self):
+        campaign = CampaignMessage("Subject", "sender@app.com")
+        self.assertIsInstance(campaign.build("<p>Hi</p>", "user@example.com"), PreparedEmailMessage)
+        self.assertNotIsInstance(campaign.build("<p>Hi</p>", "us\u00e9r@example.com"), PreparedEmailMessage)
+        self.assertNotIsInstance(campaign.build("a" * 1000, "user@example.com"), PreparedEmailMessage)
+
+    def test_messages_are_unique_and_sent_through_backends(self):
+        campaign = CampaignMessage("Subject", "sender@app.com")
+        messages = [campaign.build(f"<p>Hello {i}</p>", f"user{i}@example.com") for i in range(2)]
+        with BatchSender(connection=FlakyBackend()) as sender:
+            sender.send(messages)
+        self.assertEqual([message.to for message in mail.outbox], [["user0@example.com"], ["user1@example.com"]])
+        self.assertEqual(mail.outbox[1].alternatives[0][0], "<p>Hello 1</p>")
+        ids = {re.search(rb'Message-ID: (\S+)', message.message().as_bytes()).group(1) for message in messages}
+        self.assertEqual(len(ids), 2)
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class BatchSenderTests(TestCase):
+
+    def test_sends_all_messages_in_chunks(self):
+        connection = FlakyBackend()
+        with BatchSender(connection=connection, chunk_size=2) as sender:
+            summary = sender.send(make_messages(5))
+        self.assertEqual(summary, {"sent": 5, "failed": []})
+        # One message per call, so a failure is pinned to its message
+        self.assertEqual(connection.calls, 5)
+        self.assertEqual(connection.opened, 1)
+        self.assertEqual(len(mail.outbox), 5)
+
+    def test_reconnects_when_session_dropped(self):
+        connection = FlakyBackend(disconnect_on=[2])
+        with BatchSender(connection=connection, chunk_size=2) as sender:
+            summary = sender.send(make_messages(4))
+        # The dropped message may have been delivered, it is not sent again
+        self.assertEqual(summary["sent"], 3)
+        self.assertEqual(summary["failed"][0]["unknown"], ["user1@example.com"])
+        self.assertEqual(connection.opened, 2)
+        self.assertEqual([message.to[0] for message in mail.outbox], ["user0@example.com", "user2@example.com", "user3@example.com"])
+
+    def test_failed_message_does_not_abort_remaining(self):
+        connection = FlakyBackend(fail_on=[1])
+        with BatchSender(connection=connection, chunk_size=2) as sender:
+            summary = sender.send(make_messages(4))
+        self.assertEqual(summary["sent"], 3)
+        self.assertEqual(len(summary["failed"]), 1)
+        self.assertEqual(summary["failed"][0]["chunk"], 0)
+        self.assertEqual(summary["failed"][0]["recipients"], ["user0@example.com"])
+        self.assertEqual(summary["failed"][0]["unknown"], [])
+
+    def test_on_chunk_reports_each_chunk(self):
+        chunks = []
+        with BatchSender(connection=FlakyBackend(fail_on=[3]), chunk_size=2, on_chunk=lambda messages, failure: chunks.append((len(messages), failure))) as sender:
+            sender.send(make_messages(5))
+        self.assertEqual([(size, failure is None) for size, failure in chunks], [(2, True), (2, False), (1, True)])
+        self.assertEqual(chunks[1][1]["recipients"], ["user2@example.com"])
+
+    @patch('emailsending.ratelimit.get_redis', return_value=fakeredis.FakeRedis())
+    def test_send_bulk_emails_personalizes_html(self, get_redis):
+        contacts = [
+            {"id": 1, "first_name": "John", "last_name": "Doe", "email": "john@example.com"},
+            {"id": 2, "first_name": "Jane", "last_name": "Doe", "email": "jane@example.com"},
+        ]
+        summary = send_bulk_emails("Subject", "Hi {{ first_name }}", "sender@app.com", contacts)
+        self.assertEqual(summary["sent"], 2)
+        self.assertEqual(mail.outbox[0].to, ["john@example.com"])
+        self.assertEqual(mail.outbox[0].alternatives, [("Hi John", "text/html")])
+        self.assertEqual(mail.outbox[0].body, "Hi John")
+
+    @patch('emailsending.ratelimit.get_redis', return_value=fakeredis.FakeRedis())
+    def test_send_bulk_emails_renders_static_template(self, get_redis):
+        contacts = [{"id": 1, "first_name": "John", "last_name": "Doe", "email": "john@example.com"}]
+        send_bulk_emails("Subject", "<p>Hello {# internal note #}world</p>", "sender@app.com", contacts)
+        self.assertEqual(mail.outbox[0].alternatives, [("<p>Hello world</p>", "text/html")])
+
+    @patch('emailsending.ratelimit.get_redis', return_value=fakeredis.FakeRedis())
+    def test_send_bulk_emails_only_retried_with_session(self, get_redis):
+        user = User.objects.create_user(email='sender@app.com', password='password123')
+        group = Group.objects.create(name="Test Group", user=user)
+        session = EmailSession.objects.create(user=user, session="Now", group_id=group)
+        contact = Contact.objects.create(first_name="John", last_name="Doe", email="john@example.com", group=group)
+        contacts = [{"id": contact.id, "first_name": "John", "last_name": "Doe", "email": "john@example.com"}]
+        with patch('emailsending.tasks.template_info', side_effect=DatabaseError):
+            result = send_bulk_emails.apply(args=("Subject", "Hi", "sender@app.com", contacts))
+        # Without a session a retry could mail every contact again
+        self.assertIsInstance(result.result, DatabaseError)
+
+        with patch('emailsending.tasks.template_info', side_effect=[DatabaseError, TemplateInfo(variables=[], static=True)]):
+            result = send_bulk_emails.apply(args=("Subject", "Hi", "sender@app.com", contacts, session.id))
+        self.assertEqual(result.get()["sent"], 1)
+        self.assertEqual(len(mail.outbox), 1)
+
+    @patch('emailsending.ratelimit.get_redis', return_value=fakeredis.FakeRedis())
+    def test_send_bulk_emails_with_session_is_idempotent(self, get_redis):
+        user = User.objects.create_user(email='sender@app.com', password='password123')
+        group = Group.objects.create(name="Test Group", user=user)
+        contacts = [
+            Contact.objects.create(first_name=f"User{i}", email=f"user{i}@example.com", group=group)
+            for i in range(3)
+        ]
+        session = EmailSession.objects.create(user=user, session="Now", group_id=group)
+        contact_list = [
+            {"id": contact.id, "first_name": contact.first_name, "last_name": None, "email": contact.email}
+            for contact in contacts
+        ]
+        send_bulk_emails("Subject", "Hi {{ first_name }}", "sender@app.com", contact_list, session_id=session.id)
+        send_bulk_emails("Subject", "Hi {{ first_name }}", "sender@app.com", contact_list, session_id=session.id)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(EmailDelivery.objects.filter(session=session, status=EmailDelivery.SENT).count(), 3)
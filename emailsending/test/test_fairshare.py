@@ -0,0 +1,84 @@
+import os
+import time
+from unittest.mock import patch
+import fakeredis
+from django.test import SimpleTestCase, override_settings
+from emailsending.fairshare import BULK, TRANSACTIONAL, FairScheduler
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'liftsmail.settings')
+
+
+@override_settings(EMAIL_LANE_CONCURRENCY={TRANSACTIONAL: 2, BULK: 3}, EMAIL_DELIVERY_CLAIM_TIMEOUT=60)
+class FairSchedulerTests(SimpleTestCase):
+    def setUp(self):
+        self.scheduler = FairScheduler(client=fakeredis.FakeRedis())
+
+    def submit(self, user_id, session_id, count, lane=BULK):
+        chunks = [(session_id * 100 + i, session_id * 100 + i + 1) for i in range(count)]
+        self.scheduler.submit(lane, user_id, session_id, chunks, {"subject": f"Session {session_id}"})
+
+    def drain(self, lane=BULK):
+        popped = []
+        while (work := self.scheduler.pop(lane)) is not None:
+            token, session_id, chunk, campaign = work
+            popped.append(session_id)
+            self.scheduler.complete(lane, token, session_id, chunk, {"sent": 1, "failed": []})
+        return popped
+
+    def test_round_robin_by_user_then_session(self):
+        # User 1 has a large campaign and a small one, user 2 a single small one
+        self.submit(1, 10, 4)
+        self.submit(1, 11, 1)
+        self.submit(2, 20, 2)
+        self.assertEqual(self.drain(), [10, 20, 11, 20, 10, 10, 10])
+
+    def test_slots_limit_chunks_in_flight(self):
+        self.submit(1, 10, 5)
+        taken = [self.scheduler.pop(BULK) for _ in range(4)]
+        self.assertIsNone(taken[3])
+        self.assertEqual(taken[0][3], {"subject": "Session 10", "lane": BULK, "user_id": 1, "total": 5})
+        token, session_id, chunk, _ = taken[0]
+        self.scheduler.complete(BULK, token, session_id, chunk, {"sent": 1, "failed": []})
+        self.assertIsNotNone(self.scheduler.pop(BULK))
+
+    def test_expired_slots_are_freed(self):
+        self.submit(1, 10, 4)
+        for _ in range(3):
+            self.scheduler.pop(BULK)
+        self.assertIsNone(self.scheduler.pop(BULK))
+        with patch('emailsending.fairshare.time.time', return_value=time.time() + 120):
+            self.assertIsNotNone(self.scheduler.pop(BULK))
+
+    def test_lanes_have_their_own_slots(self):
+        self.submit(1, 10, 5)
+        self.submit(2, 20, 1, lane=TRANSACTIONAL)
+        for _ in range(3):
+            self.scheduler.pop(BULK)
+        self.assertEqual(self.scheduler.pop(TRANSACTIONAL)[1], 20)
+
+    def test_session_results_returned_once(self):
+        self.submit(1, 10, 2)
+        first = self.scheduler.pop(BULK)
+        second = self.scheduler.pop(BULK)
+        self.assertIsNone(self.scheduler.complete(BULK, first[0], 10, first[2], {"sent": 1, "failed": []}))
+        # A redelivered chunk reports twice, only its first result counts
+        self.assertIsNone(self.scheduler.complete(BULK, first[0], 10, first[2], {"sent": 1, "failed": []}))
+        results = self.scheduler.complete(BULK, second[0], 10, second[2], {"sent": 2, "failed": []})
+        self.assertCountEqual(results, [{"sent": 1, "failed": []}, {"sent": 2, "failed": []}])
+        self.assertIsNone(self.scheduler.complete(BULK, second[0], 10, second[2], {"sent": 2, "failed": []}))
+
+    def test_requeued_chunk_is_popped_again(self):
+        self.submit(1, 10, 1)
+        token, session_id, chunk, campaign = self.scheduler.pop(BULK)
+        self.assertIsNone(self.scheduler.pop(BULK))
+        self.scheduler.requeue(BULK, token, session_id, chunk, campaign)
+        self.assertEqual(self.scheduler.client.zcard(self.scheduler.lane_key(BULK, ':slots')), 0)
+        self.assertEqual(self.scheduler.pop(BULK)[1:3], (10, chunk))
+
+    def test_missing_campaign_does_not_finish_session(self):
+        self.submit(1, 10, 3)
+        token, session_id, chunk, _ = self.scheduler.pop(BULK)
+        self.scheduler.client.delete(self.scheduler.session_key('campaign', session_id))
+        self.assertIsNone(self.scheduler.complete(BULK, token, session_id, chunk, {"sent": 1, "failed": []}))
+        # The slot is still freed
+        self.assertEqual(self.scheduler.client.zcard(self.scheduler.lane_key(BULK, ':slots')), 0)
@@ -0,0 +1,117 @@
+import os
+from unittest.mock import patch
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.test import SimpleTestCase
+from emailsending import pool
+from emailsending.delivery import BatchSender, build_html_message
+from emailsending.pool import SMTPConnectionPool
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'liftsmail.settings')
+
+BACKEND = 'emailsending.test.test_pool.PingBackend'
+
+
+class PingBackend(EmailBackend):
+    """
+    Locmem backend with a NOOP health check that can be made to fail.
+    """
+    alive = True
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.closed = False
+
+    def ping(self):
+        return self.alive
+
+    def close(self):
+        self.closed = True
+
+
+def make_messages(count):
+    return [
+        build_html_message("Subject", f"<p>Hello {i}</p>", "sender@app.com", f"user{i}@example.com")
+        for i in range(count)
+    ]
+
+
+class SMTPConnectionPoolTests(SimpleTestCase):
+    def make_pool(self, **kwargs):
+        options = dict(backend=BACKEND, size=1, max_messages=100, max_age=600, noop_after=30)
+        options.update(kwargs)
+        return SMTPConnectionPool(**options)
+
+    def test_reuses_connection_across_acquires(self):
+        connections = self.make_pool()
+        first = connections.acquire()
+        connections.release(first, messages=10)
+        second = connections.acquire()
+        self.assertIs(first, second)
+        self.assertEqual(connections.opened, 1)
+
+    def test_recycles_after_max_messages(self):
+        connections = self.make_pool(max_messages=10)
+        first = connections.acquire()
+        connections.release(first, messages=10)
+        self.assertTrue(first.closed)
+        self.assertIsNot(connections.acquire(), first)
+        self.assertEqual(connections.opened, 2)
+
+    def test_recycles_after_max_age(self):
+        connections = self.make_pool(max_age=60)
+        with patch('emailsending.pool.time.monotonic', return_value=1000):
+            first = connections.acquire()
+            connections.release(first)
+        with patch('emailsending.pool.time.monotonic', return_value=1100):
+            second = connections.acquire()
+        self.assertTrue(first.closed)
+        self.assertIsNot(first, second)
+
+    def test_noop_checks_idle_connections(self):
+        connections = self.make_pool(noop_after=30)
+        with patch('emailsending.pool.time.monotonic', return_value=1000):
+            first = connections.acquire()
+            connections.release(first)
+        first.alive = False
+        # Reused without a check while it has not been idle for long
+        with patch('emailsending.pool.time.monotonic', return_value=1010):
+            self.assertIs(connections.acquire(), first)
+            connections.release(first)
+        with patch('emailsending.pool.time.monotonic', return_value=1100):
+            second = connections.acquire()
+        self.assertTrue(first.closed)
+        self.assertIsNot(first, second)
+
+    def test_discards_on_error_and_beyond_size(self):
+        connections = self.make_pool(size=1)
+        first, second = connections.acquire(), connections.acquire()
+        connections.release(first)
+        connections.release(second)
+        self.assertEqual(connections.idle[0].backend, first)
+        self.assertTrue(second.closed)
+        third = connections.acquire()
+        connections.release(third, discard=True)
+        self.assertTrue(third.closed)
+        self.assertEqual(connections.idle, [])
+
+
+class BatchSenderPoolTests(SimpleTestCase):
+    def setUp(self):
+        self.addCleanup(pool.close_pool)
+        pool.init_pool(backend=BACKEND, size=1, max_messages=100, max_age=600, noop_after=30)
+
+    def test_tasks_share_the_worker_connection(self):
+        for _ in range(3):
+            with BatchSender(chunk_size=5) as sender:
+                self.assertEqual(sender.send(make_messages(10))["sent"], 10)
+        self.assertEqual(pool.get_pool().opened, 1)
+        self.assertEqual(pool.get_pool().idle[0].messages, 30)
+        self.assertEqual(len(mail.outbox), 30)
+
+    def test_explicit_connection_bypasses_pool(self):
+        connection = EmailBackend()
+        with BatchSender(connection=connection) as sender:
+            sender.send(make_messages(2))
+        self.assertIs(sender.connection, connection)
+        self.assertEqual(pool.get_pool().idle[0].messages, 0)
@@ -0,0 +1,79 @@
+import os
+from unittest.mock import patch
+import fakeredis
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from rest_framework.exceptions import Throttled
+from emailcontacts.models import Contact, Group
+from emailsending.models import EmailSession
+from emailsending.quotas import SendQuota, charge_session
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'liftsmail.settings')
+
+User = get_user_model()
+
+
+@override_settings(EMAIL_QUOTAS={'sessions': 2, 'emails': 10}, EMAIL_QUOTA_WINDOW=3600)
+class SendQuotaTests(TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        patcher = patch('emailsending.quotas.get_redis', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user(email='testuser@app.com', password='password123')
+        self.group = Group.objects.create(name="Test Group", user=self.user)
+
+    def quota(self, now=7200):
+        return SendQuota(self.user.id, now=now)
+
+    def test_charges_until_limit(self):
+        quota = self.quota()
+        self.assertIsNone(quota.charge(sessions=1, emails=4))
+        self.assertIsNone(quota.charge(sessions=1, emails=4))
+        self.assertEqual(quota.charge(sessions=1, emails=1), 'sessions')
+
+    def test_rejected_request_charges_nothing(self):
+        quota = self.quota()
+        self.assertEqual(quota.charge(sessions=1, emails=11), 'emails')
+        self.assertEqual(int(self.redis.get(quota.key('sessions'))), 0)
+        self.assertIsNone(quota.charge(sessions=1, emails=10))
+
+    def test_counters_shared_between_processes(self):
+        self.assertIsNone(self.quota().charge(sessions=2))
+        # Another process, with its own SendQuota, sees the same counter
+        self.assertEqual(SendQuota(self.user.id, now=7300).charge(sessions=1), 'sessions')
+
+    def test_new_window_starts_from_zero(self):
+        self.quota().charge(sessions=2)
+        quota = self.quota(now=7200 + 3599)
+        self.assertEqual(quota.charge(sessions=1), 'sessions')
+        self.assertAlmostEqual(quota.retry_after, 1)
+        self.assertLessEqual(self.redis.ttl(quota.key('sessions')), 3600 + 60)
+        self.assertIsNone(self.quota(now=10800).charge(sessions=1))
+
+    def test_refund(self):
+        quota = self.quota()
+        quota.charge(sessions=2, emails=10)
+        quota.refund(sessions=1, emails=5)
+        self.assertIsNone(quota.charge(sessions=1, emails=5))
+
+    def test_missing_counter_seeded_from_charged_sessions(self):
+        EmailSession.objects.create(user=self.user, session="Sent", group_id=self.group, quota_emails=8, recipient_count=1)
+        # Recurring schedules are not charged, their runs are
+        EmailSession.objects.create(user=self.user, session="Daily", group_id=self.group, recurrence='RRULE:FREQ=DAILY')
+        quota = SendQuota(self.user.id)
+        self.assertEqual(quota.charge(sessions=1, emails=3), 'emails')
+        self.assertIsNone(quota.charge(sessions=1, emails=2))
+        self.assertEqual(quota.charge(sessions=1), 'sessions')
+
+    @override_settings(EMAIL_QUOTAS={'sessions': 1, 'emails': 0})
+    def test_charge_session_refunded_when_not_created(self):
+        Contact.objects.create(email="john@example.com", group=self.group)
+        with self.assertRaises(ValueError):
+            with charge_session(self.user.id, self.group.id):
+                raise ValueError
+        with charge_session(self.user.id, self.group.id) as emails:
+            self.assertEqual(emails, 0)
+        with self.assertRaises(Throttled):
+            with charge_session(self.user.id, self.group.id):
+                pass
@@ -0,0 +1,78 @@
+import os
+from unittest.mock import Mock, patch
+import fakeredis
+from django.test import SimpleTestCase, override_settings
+from emailsending.delivery import BatchSender, build_html_message
+from emailsending.ratelimit import SendRateLimiter
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'liftsmail.settings')
+
+LIMITS = {
+    'global': {'rate': 100, 'burst': 100},
+    'backends': {'smtp': {'rate': 50, 'burst': 20}},
+    'user': {'rate': 10, 'burst': 10},
+    'users': {7: {'rate': 1, 'burst': 5}},
+}
+
+
+@override_settings(EMAIL_RATE_LIMITS=LIMITS)
+class SendRateLimiterTests(SimpleTestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        # The buckets read the time from Redis
+        patcher = patch('fakeredis.commands_mixins.server_mixin.time')
+        self.now = patcher.start().time
+        self.now.return_value = 1000.0
+        self.addCleanup(patcher.stop)
+
+    def test_buckets_from_settings(self):
+        limiter = SendRateLimiter.for_sender(3, backend='smtp', client=self.redis)
+        self.assertEqual([key.rsplit(':', 1)[-1] for key, _, _ in limiter.buckets], ['global', 'smtp', '3'])
+        self.assertEqual(limiter.max_tokens, 10)
+
+    def test_user_override(self):
+        limiter = SendRateLimiter.for_sender(7, backend='locmem', client=self.redis)
+        self.assertEqual(limiter.buckets[-1][1:], (1, 5))
+
+    def test_no_limits_configured(self):
+        with override_settings(EMAIL_RATE_LIMITS={}):
+            self.assertIsNone(SendRateLimiter.for_sender(3, client=self.redis))
+
+    def test_strictest_bucket_applies(self):
+        limiter = SendRateLimiter.for_sender(3, backend='smtp', client=self.redis)
+        self.assertEqual(limiter.try_acquire(10), 0)
+        # The user bucket is empty and refills at 10 per second
+        self.assertAlmostEqual(limiter.try_acquire(5), 0.5)
+        self.now.return_value = 1000.5
+        self.assertEqual(limiter.try_acquire(5), 0)
+
+    def test_denied_request_takes_no_tokens(self):
+        first = SendRateLimiter.for_sender(3, backend='smtp', client=self.redis)
+        other = SendRateLimiter.for_sender(4, backend='smtp', client=self.redis)
+        self.assertEqual(first.try_acquire(10), 0)
+        self.assertGreater(first.try_acquire(10), 0)
+        # Only the global and backend buckets are shared with the other user
+        self.assertEqual(other.try_acquire(10), 0)
+        self.assertGreater(other.try_acquire(1), 0)
+
+    @patch('emailsending.ratelimit.time.sleep')
+    def test_acquire_waits_and_splits_large_requests(self, sleep):
+        limiter = SendRateLimiter.for_sender(7, backend='locmem', client=self.redis)
+
+        def advance(seconds):
+            self.now.return_value += seconds
+        sleep.side_effect = advance
+
+        waited = limiter.acquire(12)
+        self.assertAlmostEqual(waited, 7)
+        self.assertEqual(sleep.call_count, 2)
+
+
+class BatchSenderRateLimitTests(SimpleTestCase):
+    @override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+    def test_limiter_consulted_before_each_chunk(self):
+        limiter = Mock()
+        messages = [build_html_message("Subject", "Hi", "sender@app.com", f"user{i}@example.com") for i in range(5)]
+        with BatchSender(chunk_size=2, rate_limiter=limiter) as sender:
+            sender.send(messages)
+        self.assertEqual([call.args[0] for call in limiter.acquire.call_args_list], [2, 2, 1])
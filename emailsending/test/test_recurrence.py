@@ -0,0 +1,45 @@
+import os
+from datetime import date, datetime, time
+from zoneinfo import ZoneInfo
+from django.test import SimpleTestCase
+from emailsending.recurrence import build_recurrence, next_occurrence
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'liftsmail.settings')
+
+UTC = ZoneInfo('UTC')
+
+
+class RecurrenceTests(SimpleTestCase):
+    def occurrences(self, recurrence, timezone_name, after, count):
+        found = []
+        for _ in range(count):
+            after = next_occurrence(recurrence, timezone_name, after)
+            if after is None:
+                break
+            found.append(after)
+        return found
+
+    def test_day_interval_does_not_reset_each_month(self):
+        recurrence = build_recurrence('day', time(9, 0), date(2030, 1, 28), interval=3)
+        runs = self.occurrences(recurrence, 'UTC', datetime(2030, 1, 1, tzinfo=UTC), 3)
+        self.assertEqual([run.date() for run in runs], [date(2030, 1, 28), date(2030, 1, 31), date(2030, 2, 3)])
+
+    def test_month_on_31st_skips_short_months(self):
+        recurrence = build_recurrence('month', time(9, 0), date(2030, 1, 31))
+        runs = self.occurrences(recurrence, 'UTC', datetime(2030, 1, 1, tzinfo=UTC), 3)
+        self.assertEqual([run.date() for run in runs], [date(2030, 1, 31), date(2030, 3, 31), date(2030, 5, 31)])
+
+    def test_wall_clock_time_across_dst(self):
+        recurrence = build_recurrence('week', time(10, 0), date(2030, 3, 27))
+        runs = self.occurrences(recurrence, 'Europe/London', datetime(2030, 3, 1, tzinfo=UTC), 2)
+        self.assertEqual([run.astimezone(UTC).hour for run in runs], [10, 9])
+
+    def test_ends_after_last_date(self):
+        recurrence = build_recurrence('year', time(9, 0), date(2030, 5, 1), ends=date(2031, 5, 1))
+        self.assertEqual(len(self.occurrences(recurrence, 'UTC', datetime(2030, 1, 1, tzinfo=UTC), 5)), 2)
+
+    def test_inclusive_first_run(self):
+        recurrence = build_recurrence('day', time(9, 0), date(2030, 1, 1))
+        start = datetime(2030, 1, 1, 9, 0, tzinfo=UTC)
+        self.assertEqual(next_occurrence(recurrence, 'UTC', start, inclusive=True), start)
+        self.assertEqual(next_occurrence(recurrence, 'UTC', start), datetime(2030, 1, 2, 9, 0, tzinfo=UTC))
@@ -0,0 +1,64 @@
+import os
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from emailcontacts.recipients import recipient_type
+from emailsending.models import Suppression
+from emailsending.suppression import BloomFilter, SuppressionList
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'liftsmail.settings')
+
+User = get_user_model()
+
+
+class BloomFilterTests(SimpleTestCase):
+    def test_no_false_negatives_and_bounded_false_positives(self):
+        bloom = BloomFilter(5000, error_rate=0.01)
+        for i in range(5000):
+            bloom.add(f"user{i}@example.com")
+        self.assertTrue(all(f"user{i}@example.com" in bloom for i in range(5000)))
+        false_positives = sum(f"other{i}@example.com" in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+
+class SuppressionListTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='testuser@app.com', password='password123')
+        Suppression.objects.bulk_create([Suppression(user=self.user, email=f"user{i}@example.com") for i in range(0, 20, 2)])
+        Recipient = recipient_type(('id', 'email'))
+        self.recipients = [Recipient(i, f"user{i}@example.com") for i in range(20)]
+
+    def test_filters_exactly(self):
+        with self.assertNumQueries(2):
+            allowed = SuppressionList(self.user.id).filter(self.recipients)
+        self.assertEqual([recipient.id for recipient in allowed], list(range(1, 20, 2)))
+
+    def test_empty_list_skips_lookup(self):
+        other = User.objects.create_user(email='otheruser@app.com', password='password123')
+        with self.assertNumQueries(1):
+            self.assertEqual(len(SuppressionList(other.id).filter(self.recipients)), 20)
+
+    @override_settings(EMAIL_SUPPRESSION_BLOOM_THRESHOLD=5)
+    def test_large_lists_use_cached_bloom_filter(self):
+        suppressions = SuppressionList(self.user.id)
+        self.assertIsNotNone(suppressions.bloom)
+        self.assertEqual([recipient.id for recipient in suppressions.filter(self.recipients)], list(range(1, 20, 2)))
+
+        # The next task loads the filter from the cache instead of reading the list
+        with self.assertNumQueries(1):
+            self.assertIsNotNone(SuppressionList(self.user.id).bloom)
+
+        # A change to the list builds a new filter
+        Suppression.objects.create(user=self.user, email="user1@example.com")
+        suppressions = SuppressionList(self.user.id)
+        self.assertIn("user1@example.com", suppressions.bloom)
+        self.assertNotIn(1, [recipient.id for recipient in suppressions.filter(self.recipients)])
+
+        # So does an address edited in place
+        suppression = Suppression.objects.get(user=self.user, email="user2@example.com")
+        suppression.email = "user3@example.com"
+        suppression.save()
+        allowed = [recipient.id for recipient in SuppressionList(self.user.id).filter(self.recipients)]
+        self.assertIn(2, allowed)
+        self.assertNotIn(3, allowed)
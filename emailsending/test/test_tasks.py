@@ -0,0 +1,359 @@
+import os
+import tempfile
+from datetime import timedelta
+from unittest.mock import patch
+import fakeredis
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.files.base import ContentFile
+from django.db import DatabaseError
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from emailcontacts.models import Group, Contact
+from emailcontacts.recipients import stream_recipients
+from emailsending.delivery import DeliveryCheckpoint
+from emailsending.models import EmailAttachment, EmailDelivery, EmailSession, EmailTemplate, Suppression
+from emailsending.test.test_delivery import FlakyBackend
+from emailsending.recurrence import build_recurrence
+from emailsending.fairshare import BULK, TRANSACTIONAL, FairScheduler
+from emailsending.tasks import (
+    chunk_finished, dispatch_due_sessions, dispatch_email_session, finish_email_session, send_email_chunk, send_email_session,
+    start_chunks,
+)
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'liftsmail.settings')
+
+User = get_user_model()
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class ChunkedSendTests(TestCase):
+    def setUp(self):
+        redis = fakeredis.FakeRedis()
+        for target in ('emailsending.ratelimit.get_redis', 'emailsending.fairshare.get_redis', 'emailsending.quotas.get_redis'):
+            patcher = patch(target, return_value=redis)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user(email='testuser@app.com', password='password123')
+        self.group = Group.objects.create(name="Test Group", user=self.user)
+        self.contacts = [
+            Contact.objects.create(first_name=f"User{i}", last_name=None, email=f"user{i}@example.com", group=self.group)
+            for i in range(5)
+        ]
+        self.session = EmailSession.objects.create(user=self.user, session="Now", group_id=self.group)
+
+    def test_send_email_chunk_renders_range(self):
+        ids = [contact.id for contact in self.contacts]
+        summary = send_email_chunk(self.session.id, self.group.id, "Subject", "Hi {{ first_name }} {{ last_name }}", None, ids[0], ids[2])
+        self.assertEqual(summary, {"sent": 2, "failed": []})
+        self.assertEqual([message.to[0] for message in mail.outbox], ["user1@example.com", "user2@example.com"])
+        self.assertEqual(mail.outbox[0].alternatives[0][0], "Hi User1 Guest")
+
+    @override_settings(EMAIL_SEND_BATCH_SIZE=2)
+    def test_send_email_chunk_records_deliveries(self):
+        ids = [contact.id for contact in self.contacts]
+        # The messages of the second batch (user2, user3) are rejected by the server
+        with patch('emailsending.delivery.get_connection', return_value=FlakyBackend(fail_on={3, 4})):
+            send_email_chunk(self.session.id, self.group.id, "Subject", "Hi", None, None, ids[-1])
+
+        deliveries = {delivery.email: delivery for delivery in EmailDelivery.objects.filter(session=self.session)}
+        self.assertEqual(len(deliveries), 5)
+        self.assertEqual(deliveries["user2@example.com"].status, EmailDelivery.FAILED)
+        self.assertEqual(deliveries["user2@example.com"].last_error, "(451, 'Try again later')")
+        self.assertIsNone(deliveries["user2@example.com"].sent_at)
+        self.assertEqual(deliveries["user0@example.com"].status, EmailDelivery.SENT)
+        self.assertEqual(deliveries["user0@example.com"].contact_id, ids[0])
+        self.assertTrue(all(delivery.attempts == 1 for delivery in deliveries.values()))
+
+        self.session.refresh_from_db()
+        self.assertEqual((self.session.recipient_count, self.session.sent_count, self.session.failed_count), (5, 3, 2))
+
+        # A rerun only retries the failed recipients and moves them from failed to sent
+        mail.outbox = []
+        send_email_chunk(self.session.id, self.group.id, "Subject", "Hi", None, None, ids[-1])
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), ["user2@example.com", "user3@example.com"])
+        self.session.refresh_from_db()
+        self.assertEqual((self.session.recipient_count, self.session.sent_count, self.session.failed_count), (5, 5, 0))
+        self.assertEqual(EmailDelivery.objects.get(email="user2@example.com").attempts, 2)
+
+    def test_batch_failing_partway_sends_nobody_twice(self):
+        ids = [contact.id for contact in self.contacts]
+        # The server drops the session during the third message, after the first two were accepted
+        with patch('emailsending.delivery.get_connection', return_value=FlakyBackend(disconnect_on={3}, fail_on={4})):
+            summary = send_email_chunk(self.session.id, self.group.id, "Subject", "Hi", None, None, ids[-1])
+        self.assertEqual(summary["sent"], 3)
+        statuses = dict(EmailDelivery.objects.values_list('email', 'status'))
+        self.assertEqual(statuses, {
+            "user0@example.com": EmailDelivery.SENT,
+            "user1@example.com": EmailDelivery.SENT,
+            "user2@example.com": EmailDelivery.UNKNOWN,
+            "user3@example.com": EmailDelivery.FAILED,
+            "user4@example.com": EmailDelivery.SENT,
+        })
+
+        # A rerun only retries the refused message, the one that may have gone out is left alone
+        mail.outbox = []
+        send_email_chunk(self.session.id, self.group.id, "Subject", "Hi", None, None, ids[-1])
+        self.assertEqual([message.to[0] for message in mail.outbox], ["user3@example.com"])
+        self.assertEqual(EmailDelivery.objects.get(email="user2@example.com").status, EmailDelivery.UNKNOWN)
+        self.session.refresh_from_db()
+        self.assertEqual((self.session.sent_count, self.session.failed_count), (4, 1))
+
+    @override_settings(EMAIL_SEND_BATCH_SIZE=2)
+    def test_send_email_chunk_resumes_after_last_batch(self):
+        ids = [contact.id for contact in self.contacts]
+        record = DeliveryCheckpoint.record
+        calls = []
+
+        def record_then_crash(checkpoint, messages, failure=None):
+            # The task dies after sending the second batch, before recording it
+            calls.append(messages)
+            if len(calls) == 2:
+                raise DatabaseError("connection lost")
+            return record(checkpoint, messages, failure)
+
+        with patch.object(DeliveryCheckpoint, 'record', record_then_crash), self.assertRaises(DatabaseError):
+            send_email_chunk.run(self.session.id, self.group.id, "Subject", "Hi", None, None, ids[-1])
+
+        # The crashed batch stays claimed, a rerun skips it and sends the rest
+        mail.outbox = []
+        send_email_chunk(self.session.id, self.group.id, "Subject", "Hi", None, None, ids[-1])
+        self.assertEqual([message.to[0] for message in mail.outbox], ["user4@example.com"])
+        statuses = dict(EmailDelivery.objects.values_list('email', 'status'))
+        self.assertEqual(statuses["user0@example.com"], EmailDelivery.SENT)
+        self.assertEqual(statuses["user2@example.com"], EmailDelivery.SENDING)
+
+        # Once the claim times out, the in-doubt batch is marked unknown rather than sent again
+        with override_settings(EMAIL_DELIVERY_CLAIM_TIMEOUT=-1):
+            mail.outbox = []
+            send_email_chunk(self.session.id, self.group.id, "Subject", "Hi", None, None, ids[-1])
+            send_email_chunk(self.session.id, self.group.id, "Subject", "Hi", None, None, ids[-1])
+        self.assertEqual(mail.outbox, [])
+        unknown = EmailDelivery.objects.filter(status=EmailDelivery.UNKNOWN)
+        self.assertEqual(sorted(unknown.values_list('email', flat=True)), ["user2@example.com", "user3@example.com"])
+        self.session.refresh_from_db()
+        self.assertEqual((self.session.sent_count, self.session.failed_count), (3, 2))
+
+    def test_duplicate_chunk_runs_send_once(self):
+        recipients = list(stream_recipients(self.group.id))
+        first = DeliveryCheckpoint(self.session.id, recipients)
+        second = DeliveryCheckpoint(self.session.id, recipients)
+        self.assertEqual(len(first.pending), 5)
+        self.assertEqual(second.pending, [])
+        self.assertEqual(EmailDelivery.objects.filter(session=self.session).count(), 5)
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.recipient_count, 5)
+
+    def test_concurrent_inserts_counted_once(self):
+        recipients = list(stream_recipients(self.group.id))
+        DeliveryCheckpoint(self.session.id, recipients)
+        # A redelivered chunk that looked for the rows before the original inserted them
+        with patch('django.db.models.QuerySet.values_list', return_value=[]):
+            DeliveryCheckpoint(self.session.id, recipients)
+        self.assertEqual(EmailDelivery.objects.filter(session=self.session).count(), 5)
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.recipient_count, 5)
+
+    def test_delivery_writes_do_not_scale_with_recipients(self):
+        for i in range(5, 50):
+            Contact.objects.create(email=f"user{i}@example.com", group=self.group)
+        # Group owner, suppression list size, attachments, recipients, existing deliveries, insert, rows inserted,
+        # counter, stale claims, claim, claimed rows, then per batch an update and a counter
+        with self.assertNumQueries(14):
+            send_email_chunk(self.session.id, self.group.id, "Subject", "Hi", None, None, None)
+        self.assertEqual(EmailDelivery.objects.filter(session=self.session, status=EmailDelivery.SENT).count(), 50)
+
+    def test_send_email_chunk_reads_only_needed_columns(self):
+        with patch('emailsending.tasks.stream_recipients', wraps=stream_recipients) as stream:
+            send_email_chunk(self.session.id, self.group.id, "Subject", "<p>Closed today</p>", None, None, None)
+        self.assertEqual(stream.call_args.kwargs['fields'], ('id', 'email'))
+        self.assertEqual({message.alternatives[0][0] for message in mail.outbox}, {"<p>Closed today</p>"})
+
+    def test_send_email_chunk_attaches_session_files(self):
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            attachment = EmailAttachment.objects.create(
+                user=self.user, file=ContentFile(b"%PDF-1.4", name="invoice.pdf"), filename="invoice.pdf", mimetype="application/pdf", size=8
+            )
+            self.session.attachments.add(attachment)
+            send_email_chunk(self.session.id, self.group.id, "Subject", "Hi", None, None, None)
+        self.assertEqual(len(mail.outbox), 5)
+        for message in mail.outbox:
+            data = message.message().as_bytes()
+            self.assertIn(b'filename="invoice.pdf"', data)
+            self.assertIn(b"JVBERi0xLjQ=", data)
+
+    def test_send_email_chunk_skips_suppressed_contacts(self):
+        Contact.objects.filter(pk=self.contacts[0].pk).update(is_subscribed=False)
+        Suppression.objects.create(user=self.user, email="user3@example.com", reason=Suppression.BOUNCED)
+        send_email_chunk(self.session.id, self.group.id, "Subject", "Hi", None, None, None)
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), ["user1@example.com", "user2@example.com", "user4@example.com"])
+        self.assertEqual(EmailDelivery.objects.filter(session=self.session).count(), 3)
+
+    @override_settings(EMAIL_CHUNK_SIZE=2, EMAIL_LANE_CONCURRENCY={TRANSACTIONAL: 1, BULK: 2})
+    @patch('emailsending.tasks.send_email_chunk.apply_async')
+    def test_dispatch_starts_chunks_while_slots_are_free(self, apply_async):
+        result = dispatch_email_session(self.session.id, "Subject", "Hi", None)
+        self.assertEqual(result, {"chunks": 3, "lane": BULK})
+        self.assertEqual(apply_async.call_count, 2)
+        args, kwargs = apply_async.call_args_list[0]
+        ids = [contact.id for contact in self.contacts]
+        self.assertEqual(args[0][:5], (self.session.id, self.group.id, "Subject", "Hi", None))
+        self.assertEqual(args[0][-1], ids[1])
+        self.assertEqual(kwargs["queue"], BULK)
+
+        # Each finished chunk frees its slot for the next one, the last one finishes the session
+        for (args, kwargs) in list(apply_async.call_args_list):
+            kwargs["link"].clone(({"sent": 2, "failed": []},)).apply()
+        self.assertEqual(apply_async.call_count, 3)
+        with patch('emailsending.tasks.finish_email_session') as finish:
+            apply_async.call_args_list[2][1]["link_error"].apply()
+        finish.assert_called_once()
+        self.assertEqual(finish.call_args[0][0][-1]["failed"][0]["error"], "The chunk task failed")
+
+    @override_settings(EMAIL_CHUNK_SIZE=3, EMAIL_LANE_CONCURRENCY={TRANSACTIONAL: 1, BULK: 1})
+    @patch('emailsending.tasks.finish_email_session')
+    @patch('emailsending.tasks.send_email_chunk.apply_async')
+    def test_chunk_finished_starts_next_chunk_and_finishes_session(self, apply_async, finish):
+        dispatch_email_session(self.session.id, "Subject", "Hi", None)
+        self.assertEqual(apply_async.call_count, 1)
+        chunk_finished({"sent": 3, "failed": []}, *apply_async.call_args[1]["link"].args)
+        self.assertEqual(apply_async.call_count, 2)
+        finish.assert_not_called()
+        chunk_finished({"sent": 1, "failed": [{"chunk": 1}]}, *apply_async.call_args[1]["link"].args)
+        self.assertEqual(apply_async.call_count, 2)
+        results, session_id = finish.call_args[0]
+        self.assertEqual(session_id, self.session.id)
+        self.assertCountEqual(results, [{"sent": 3, "failed": []}, {"sent": 1, "failed": [{"chunk": 1}]}])
+
+    @override_settings(EMAIL_CHUNK_SIZE=5, EMAIL_LANE_CONCURRENCY={TRANSACTIONAL: 1, BULK: 1})
+    @patch('emailsending.tasks.finish_email_session')
+    @patch('emailsending.tasks.send_email_chunk.apply_async')
+    def test_failed_chunk_task_frees_slot_and_finishes_session(self, apply_async, finish):
+        dispatch_email_session(self.session.id, "Subject", "Hi", None)
+        # link_error runs chunk_finished with no result
+        lane, token, session_id, chunk = apply_async.call_args[1]["link_error"].args[1:]
+        chunk_finished(None, lane, token, session_id, chunk)
+        finish.assert_called_once_with(
+            [{"sent": 0, "failed": [{"chunk": chunk, "recipients": [], "error": "The chunk task failed"}]}], self.session.id,
+        )
+        scheduler = FairScheduler()
+        self.assertEqual(scheduler.client.zcard(scheduler.lane_key(BULK, ':slots')), 0)
+
+    @override_settings(EMAIL_CHUNK_SIZE=2, EMAIL_LANE_CONCURRENCY={TRANSACTIONAL: 1, BULK: 2})
+    @patch('emailsending.tasks.send_email_chunk.apply_async')
+    def test_chunk_put_back_when_publish_fails(self, apply_async):
+        apply_async.side_effect = [None, ConnectionError]
+        self.assertEqual(dispatch_email_session(self.session.id, "Subject", "Hi", None)["chunks"], 3)
+        # The failed chunk waits again and its slot is free, so both waiting chunks get sent
+        apply_async.side_effect = None
+        self.assertEqual(start_chunks(), 1)
+        apply_async.call_args_list[0][1]["link"].clone(({"sent": 2, "failed": []},)).apply()
+        self.assertEqual(apply_async.call_count, 4)
+        sent = sorted(args[0][-1] for args, kwargs in apply_async.call_args_list[1:])
+        ids = [contact.id for contact in self.contacts]
+        self.assertEqual(sent, [ids[3], ids[3], ids[4]])
+
+    @override_settings(EMAIL_CHUNK_SIZE=2, EMAIL_TRANSACTIONAL_MAX_CHUNKS=3)
+    @patch('emailsending.tasks.send_email_chunk.apply_async')
+    def test_send_now_sessions_use_transactional_lane(self, apply_async):
+        self.assertEqual(dispatch_email_session(self.session.id, "Subject", "Hi", transactional=True)["lane"], TRANSACTIONAL)
+        self.assertEqual(apply_async.call_args[1]["queue"], TRANSACTIONAL)
+        with override_settings(EMAIL_TRANSACTIONAL_MAX_CHUNKS=2):
+            # Too large to be latency sensitive, it shares the bulk lane
+            self.assertEqual(dispatch_email_session(self.session.id, "Subject", "Hi", transactional=True)["lane"], BULK)
+
+    def test_finish_email_session_totals_lanes(self):
+        summary = finish_email_session([{"sent": 4, "failed": []}, {"sent": 1, "failed": [{"chunk": 2}]}], self.session.id)
+        self.assertEqual(summary, {"sent": 5, "failed": [{"chunk": 2}]})
+
+    @patch('emailsending.tasks.dispatch_email_session')
+    def test_send_email_session_reads_template_at_fire_time(self, dispatch):
+        template = EmailTemplate.objects.create(user=self.user, name="T", subject="Hello", body="Hi\n{{ first_name }}")
+        self.session.template_id = template
+        self.session.one_off = True
+        self.session.save()
+        send_email_session(self.session.id)
+        dispatch.assert_called_once_with(self.session.id, "Hello", "Hi{{ first_name }}", self.user.email)
+
+    @patch('emailsending.tasks.dispatch_email_session')
+    def test_legacy_recurring_session_sends_each_firing_as_run(self, dispatch):
+        # Periodic tasks created before dispatch_due_sessions fire the recurring session itself
+        self.session.template_id = EmailTemplate.objects.create(user=self.user, name="T", subject="Hello", body="Hi")
+        self.session.save()
+        send_email_session(self.session.id)
+        send_email_session(self.session.id)
+        runs = list(EmailSession.objects.filter(recurring_session=self.session).order_by('id'))
+        self.assertEqual(len(runs), 2)
+        self.assertTrue(all(run.one_off and run.group_id == self.group for run in runs))
+        self.assertEqual([call[0][0] for call in dispatch.call_args_list], [run.id for run in runs])
+
+    def test_send_email_session_missing_session(self):
+        self.assertEqual(send_email_session(0), {"chunks": 0})
+
+
+class DispatchDueSessionsTests(TestCase):
+    def setUp(self):
+        patcher = patch('emailsending.quotas.get_redis', return_value=fakeredis.FakeRedis())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user(email='testuser@app.com', password='password123')
+        self.group = Group.objects.create(name="Test Group", user=self.user)
+        self.template = EmailTemplate.objects.create(user=self.user, name="T", subject="Hello", body="Hi")
+        self.now = timezone.now()
+
+    def create_session(self, **kwargs):
+        return EmailSession.objects.create(user=self.user, session="Scheduled", group_id=self.group, template_id=self.template, **kwargs)
+
+    @override_settings(EMAIL_SCHEDULER_BATCH_SIZE=2)
+    @patch('emailsending.tasks.send_email_session.delay')
+    def test_sends_due_one_off_sessions_once(self, send):
+        due = [self.create_session(one_off=True, next_run_at=self.now - timedelta(minutes=i)) for i in range(3)]
+        later = self.create_session(one_off=True, next_run_at=self.now + timedelta(hours=1))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(dispatch_due_sessions(), {"dispatched": 3})
+        self.assertCountEqual([args[0][0] for args in send.call_args_list], [session.id for session in due])
+        self.assertFalse(EmailSession.objects.filter(pk__in=[session.id for session in due], next_run_at__isnull=False).exists())
+        later.refresh_from_db()
+        self.assertIsNotNone(later.next_run_at)
+
+        send.reset_mock()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(dispatch_due_sessions(), {"dispatched": 0})
+        send.assert_not_called()
+
+    @patch('emailsending.tasks.send_email_session.delay')
+    def test_recurring_session_runs_as_new_session(self, send):
+        starts = (self.now - timedelta(days=3)).date()
+        recurrence = build_recurrence('day', self.now.time().replace(microsecond=0), starts, interval=2)
+        first_run = self.now - timedelta(days=1)
+        session = self.create_session(recurrence=recurrence, timezone='UTC', next_run_at=first_run)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            dispatch_due_sessions()
+        run = EmailSession.objects.get(recurring_session=session)
+        send.assert_called_once_with(run.id)
+        self.assertEqual((run.group_id, run.template_id, run.schedule_time), (self.group, self.template, first_run))
+
+        # Missed occurrences are skipped, the next one is every other day from the start date
+        session.refresh_from_db()
+        self.assertEqual(session.next_run_at, first_run.replace(microsecond=0) + timedelta(days=2))
+
+    @override_settings(EMAIL_QUOTAS={'sessions': 3, 'emails': 3})
+    @patch('emailsending.tasks.send_email_session.delay')
+    def test_recurring_runs_are_charged_to_quota(self, send):
+        for i in range(2):
+            Contact.objects.create(email=f"user{i}@example.com", group=self.group)
+        recurrence = build_recurrence('day', self.now.time().replace(microsecond=0), (self.now - timedelta(days=3)).date())
+        schedules = [self.create_session(recurrence=recurrence, timezone='UTC', next_run_at=self.now - timedelta(minutes=i)) for i in range(2)]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(dispatch_due_sessions(), {"dispatched": 2})
+        # The second run's two emails are over the one left, it is skipped until the next occurrence
+        run = EmailSession.objects.get(recurring_session__isnull=False)
+        self.assertEqual(run.quota_emails, 2)
+        send.assert_called_once_with(run.id)
+        for schedule in schedules:
+            schedule.refresh_from_db()
+            self.assertGreater(schedule.next_run_at, self.now)
+
@@ -0,0 +1,182 @@
+import os
+from unittest.mock import patch
+from django.core.cache import cache
+from django.template import Context, TemplateSyntaxError
+from django.test import SimpleTestCase
+from emailcontacts.recipients import recipient_type
+from emailsending.plaintext import html_to_text
+from emailsending.utils import (
+    EngineTemplate, HTMLTextTemplate, SegmentTemplate, TemplateCache, TemplateInfo, analyze_template,
+    compile_template, contact_renderer, contact_text_renderer, format_email, get_renderer, get_text_renderer,
+    recipient_fields, renderer_cache, template_cache, template_hash, template_info, text_renderer_cache,
+)
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'liftsmail.settings')
+
+
+class FormatEmailTests(SimpleTestCase):
+    def setUp(self):
+        template_cache.clear()
+
+    def test_format_email_renders_context(self):
+        message = "Hello {{ first_name }} {{ last_name }}, this is a test email."
+        rendered = format_email(message, {"first_name": "John", "last_name": "Doe"})
+        self.assertEqual(rendered, "Hello John Doe, this is a test email.")
+
+    def test_format_email_autoescapes_context(self):
+        rendered = format_email("Hi {{ first_name }}", {"first_name": "<b>John</b>"})
+        self.assertEqual(rendered, "Hi &lt;b&gt;John&lt;/b&gt;")
+
+    def test_template_compiled_once_per_body(self):
+        message = "Hello {{ first_name }}"
+        self.assertIs(compile_template(message), compile_template(message))
+        format_email(message, {"first_name": "John"})
+        format_email(message, {"first_name": "Jane"})
+        self.assertEqual(len(template_cache), 1)
+
+    def test_cache_evicts_least_recently_used(self):
+        cache = TemplateCache(maxsize=2)
+        first = cache.get("one {{ email }}")
+        cache.get("two {{ email }}")
+        cache.get("one {{ email }}")
+        cache.get("three {{ email }}")
+        self.assertEqual(len(cache), 2)
+        self.assertIs(cache.get("one {{ email }}"), first)
+
+
+class AnalyzeTemplateTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_collects_variables_from_tags_and_filters(self):
+        info = analyze_template(
+            "Hi {{ first_name|default:last_name }}"
+            "{% if email %}{{ contact_id }}{% endif %}"
+        )
+        self.assertEqual(info, TemplateInfo(variables=['contact_id', 'email', 'first_name', 'last_name'], static=False))
+
+    def test_plain_text_is_static(self):
+        self.assertEqual(analyze_template("<p>Our office is closed today</p>"), TemplateInfo(variables=[], static=True))
+        # Tags still have to be rendered even without variables
+        self.assertFalse(analyze_template('{% now "Y" %}').static)
+
+    def test_syntax_error(self):
+        with self.assertRaises(TemplateSyntaxError):
+            analyze_template("Hi {% if first_name %}")
+
+    def test_template_info_reads_cache(self):
+        message = "Hi {{ first_name }}"
+        cache.set(f'emailsending:template:{template_hash(message)}', TemplateInfo(variables=['email'], static=False))
+        self.assertEqual(template_info(message).variables, ['email'])
+        cache.clear()
+        self.assertEqual(template_info(message).variables, ['first_name'])
+
+    def test_recipient_fields(self):
+        self.assertEqual(recipient_fields(TemplateInfo(variables=[], static=True)), ('id', 'email'))
+        self.assertEqual(recipient_fields(TemplateInfo(variables=['last_name', 'email'], static=False)), ('id', 'email', 'last_name'))
+
+    def test_contact_renderer(self):
+        Recipient = recipient_type(('id', 'email', 'last_name'))
+        contact = Recipient(1, "john@example.com", "Doe")
+        self.assertEqual(contact_renderer("Dear {{ last_name }} {{ first_name }}")(contact), "Dear Doe Guest")
+        message = "<p>Our office is closed today</p>"
+        render = contact_renderer(message)
+        self.assertEqual(render(contact), message)
+        # Rendered once for every contact
+        self.assertIs(render(contact), render(Recipient(2, "jane@example.com", "Doe")))
+
+    def test_static_template_comments_are_not_sent(self):
+        contact = recipient_type(('id', 'email'))(1, "john@example.com")
+        self.assertTrue(analyze_template('Hello {# internal note #} world').static)
+        self.assertEqual(contact_renderer('Hello {# internal note #} world')(contact), 'Hello  world')
+
+
+class SegmentTemplateTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        template_cache.clear()
+        renderer_cache.clear()
+
+    def test_plain_placeholders_take_segment_path(self):
+        message = "<p>Hi {{ first_name }} {{last_name}}</p> <{{ email }}> #{{ contact_id }}{{ missing }}"
+        renderer = get_renderer(message)
+        self.assertIsInstance(renderer, SegmentTemplate)
+        context = {"first_name": "<b>Jo & \"Al\"</b>", "last_name": "O'Brien", "email": "jo@example.com", "contact_id": 1234567}
+        self.assertEqual(renderer.render(context), compile_template(message).render(Context(context)))
+        self.assertEqual(renderer.render(context), "<p>Hi &lt;b&gt;Jo &amp; &quot;Al&quot;&lt;/b&gt; O&#x27;Brien</p> <jo@example.com> #1234567")
+
+    def test_tags_and_filters_fall_back_to_engine(self):
+        for message in ["Hi {{ first_name|upper }}", "{% if first_name %}Hi{% endif %}", "{{ contact.email }}", "{{ 'literal' }}"]:
+            with self.subTest(message=message):
+                self.assertIsInstance(get_renderer(message), EngineTemplate)
+        self.assertEqual(format_email("Hi {{ first_name|upper }}", {"first_name": "jo"}), "Hi JO")
+
+    def test_segments_shared_through_django_cache(self):
+        message = "Hi {{ first_name }}"
+        get_renderer(message)
+        template_cache.clear()
+        renderer_cache.clear()
+        # Another process finds the segments without compiling the template
+        self.assertEqual(get_renderer(message).render({"first_name": "Jo"}), "Hi Jo")
+        self.assertEqual(len(template_cache), 0)
+
+
+class PlainTextTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        template_cache.clear()
+        renderer_cache.clear()
+        text_renderer_cache.clear()
+
+    def test_html_to_text(self):
+        html = (
+            "<html><head><title>News</title><style>p { color: red; }</style></head><body>"
+            "<h1>Hello</h1><p>Fish &amp;\n   chips<br>today</p><ul><li>One</li><li>Two</li></ul>"
+            "<p><a href=\"https://example.com/a\">Read more</a> <a href=\"mailto:hi@example.com\">hi@example.com</a></p>"
+            "<script>alert(1)</script></body></html>"
+        )
+        self.assertEqual(
+            html_to_text(html),
+            "Hello\n\nFish & chips\ntoday\n\n- One\n- Two\n\nRead more (https://example.com/a) hi@example.com",
+        )
+
+    def test_long_lines_wrapped_without_splitting_tags(self):
+        text = html_to_text("<p>" + "word " * 20 + "{{ first_name }} " + "word " * 20 + "</p>")
+        self.assertTrue(all(len(line) <= 78 for line in text.splitlines()))
+        self.assertIn("{{ first_name }}", text)
+
+    def test_text_rendered_with_segment_substitution(self):
+        message = "<p>Hi {{ first_name }},</p><p>See <a href=\"https://example.com/{{ contact_id }}\">your page</a></p>"
+        renderer = get_text_renderer(message)
+        self.assertIsInstance(renderer, SegmentTemplate)
+        # Values are not escaped in the text part
+        self.assertEqual(
+            renderer.render({"first_name": "Jo & Al", "contact_id": 7}),
+            "Hi Jo & Al,\n\nSee your page (https://example.com/7)",
+        )
+
+    def test_tags_render_without_autoescape(self):
+        renderer = get_text_renderer("<p>{% if first_name %}Hi {{ first_name|upper }}{% endif %}</p>")
+        self.assertIsInstance(renderer, EngineTemplate)
+        self.assertEqual(renderer.render({"first_name": "<jo>"}), "Hi <JO>")
+
+    def test_text_derived_once_per_template(self):
+        message = "<p>Hi {{ first_name }}</p>"
+        get_text_renderer(message)
+        text_renderer_cache.clear()
+        with patch('emailsending.utils.html_to_text') as convert:
+            self.assertEqual(get_text_renderer(message).render({"first_name": "Jo"}), "Hi Jo")
+        convert.assert_not_called()
+
+    def test_split_tags_convert_each_message(self):
+        # The if tag opens in markup that is dropped, so the text cannot be derived from the source
+        message = "<style>{% if first_name %}</style><p>Hi {{ first_name }}</p>{% endif %}"
+        renderer = get_text_renderer(message)
+        self.assertIsInstance(renderer, HTMLTextTemplate)
+        self.assertEqual(renderer.render({"first_name": "Jo"}), "Hi Jo")
+
+    def test_contact_text_renderer(self):
+        Recipient = recipient_type(('id', 'email', 'first_name'))
+        contact = Recipient(1, 'jo@example.com', None)
+        self.assertEqual(contact_text_renderer("<p>Hi {{ first_name }}</p>")(contact), "Hi Guest")
+        self.assertEqual(contact_text_renderer("<p>Hello</p>")(contact), "Hello")
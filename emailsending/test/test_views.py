@@ -1,8 +1,17 @@
 import os
+import tempfile
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from unittest.mock import patch
+import fakeredis
 from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DatabaseError
+from django.test import override_settings
 from rest_framework.test import APITestCase
 from rest_framework import status
-from emailsending.models import EmailTemplate, EmailSession
+from emailsending.models import EmailAttachment, EmailDelivery, EmailTemplate, EmailSession, Suppression
 from emailcontacts.models import Group, Contact
 from django.urls import reverse
 
@@ -10,6 +19,11 @@ User = get_user_model()
 
 class BaseTestCase(APITestCase):
     def setUp(self):
+        # Quota counters are kept in Redis
+        patcher = patch('emailsending.quotas.get_redis', return_value=fakeredis.FakeRedis())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
         # Create a user
         self.user = User.objects.create_user(email='testuser@app.com', password='password123')
 
@@ -31,6 +45,7 @@ class BaseTestCase(APITestCase):
         self.send_email_url = reverse('send-mail')
         self.sessions_url = reverse('email-sessions')
         self.schedule_email_url = reverse('schedule-email')
+        self.recurring_email_url = reverse('recuring-email')
 
         # Authentication
         self.client.force_authenticate(self.user)
@@ -62,6 +77,31 @@ class EmailTemplateTests(BaseTestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data['subject'], "Updated Subject")
 
+    def test_create_email_template_stores_variables(self):
+        data = {
+            "name": "Variables",
+            "subject": "Subject",
+            "body": "Hi {{ first_name }}{% if last_name %} {{ last_name }}{% endif %}",
+        }
+        response = self.client.post(self.templates_url, data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['variables'], ['first_name', 'last_name'])
+        self.assertFalse(response.data['is_static'])
+
+    def test_template_syntax_checked_on_save(self):
+        data = {"name": "Broken", "subject": "Subject", "body": "Hi {% if first_name %}"}
+        response = self.client.post(self.templates_url, data)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("Invalid template", str(response.data['body']))
+
+        response = self.client.patch(self.templates_detail_url, {"body": "{{ first_name|nosuchfilter }}"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.patch(self.templates_detail_url, {"body": "Nothing to fill in"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.template.refresh_from_db()
+        self.assertEqual((self.template.variables, self.template.is_static), ([], True))
+
     def test_delete_email_template(self):
         response = self.client.delete(self.templates_detail_url)
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
@@ -69,7 +109,8 @@ class EmailTemplateTests(BaseTestCase):
 
 class SendEmailTests(BaseTestCase):
 
-    def test_send_email(self):
+    @patch('emailsending.views.dispatch_email_session.delay')
+    def test_send_email(self, dispatch):
         data = {
             "template": {
                 "subject": self.template.subject,
@@ -82,6 +123,8 @@ class SendEmailTests(BaseTestCase):
         self.assertIn("Emails sent successfully", response.data['message'])
         sessions = EmailSession.objects.count()
         self.assertEqual(sessions, 1)
+        session = EmailSession.objects.get()
+        dispatch.assert_called_once_with(session.id, self.template.subject, self.template.body, transactional=True)
 
     def test_send_email_to_empty_group(self):
         # Create an empty group with no contacts
@@ -97,6 +140,64 @@ class SendEmailTests(BaseTestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertIn("This group has no contacts", response.data['detail'])
 
+class EmailAttachmentTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings = override_settings(MEDIA_ROOT=media_root.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.attachments_url = reverse('email-attachments')
+
+    def upload(self, name="invoice.pdf", content=b"%PDF-1.4", **data):
+        return self.client.post(self.attachments_url, {"file": SimpleUploadedFile(name, content), **data}, format='multipart')
+
+    def test_upload_and_list_template_attachments(self):
+        response = self.upload(template=self.template.id)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual((response.data['filename'], response.data['mimetype'], response.data['size']), ("invoice.pdf", "application/pdf", 8))
+        self.upload("other.pdf")
+
+        response = self.client.get(self.attachments_url, {"template": self.template.id})
+        self.assertEqual([attachment['filename'] for attachment in response.data['results']], ["invoice.pdf"])
+        response = self.client.get(self.attachments_url, {"template": "x"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(EMAIL_ATTACHMENT_MAX_SIZE=4)
+    def test_attachment_size_limit(self):
+        response = self.upload()
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("at most 4 bytes", str(response.data['file']))
+
+    def test_delete_attachment_removes_file(self):
+        attachment = EmailAttachment.objects.get(pk=self.upload().data['id'])
+        name = attachment.file.name
+        self.assertTrue(default_storage.exists(name))
+        response = self.client.delete(reverse('email-attachment-detail', kwargs={"pk": attachment.pk}))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(default_storage.exists(name))
+
+        # Deleting a template removes the files of its attachments
+        name = EmailAttachment.objects.get(pk=self.upload(template=self.template.id).data['id']).file.name
+        self.client.delete(self.templates_detail_url)
+        self.assertFalse(default_storage.exists(name))
+
+    @patch('emailsending.views.dispatch_email_session.delay')
+    def test_send_email_with_attachments(self, dispatch):
+        attachment_id = self.upload().data['id']
+        other_user = User.objects.create_user(email='otheruser@app.com', password='password123')
+        other = EmailAttachment.objects.create(user=other_user, file='email_attachments/x.pdf', filename="x.pdf", mimetype="application/pdf", size=1)
+        data = {"template": {"subject": "Subject", "body": "Body"}, "group_id": self.group.pk}
+
+        response = self.client.post(self.send_email_url, {**data, "attachments": [other.id]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(self.send_email_url, {**data, "attachments": [attachment_id]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        session = EmailSession.objects.get()
+        self.assertEqual(list(session.attachments.values_list('id', flat=True)), [attachment_id])
+
+
 class EmailSessionTests(BaseTestCase):
     def test_list_email_sessions(self):
         # Create a dummy email session
@@ -106,6 +207,29 @@ class EmailSessionTests(BaseTestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertIn('Session Test', str(response.data))
 
+    def test_list_session_deliveries(self):
+        session = EmailSession.objects.create(user=self.user, session="Session Test", group_id=self.group, sent_count=1, failed_count=1, recipient_count=2)
+        EmailDelivery.objects.create(session=session, contact=self.contact1, email=self.contact1.email, status=EmailDelivery.SENT, attempts=1)
+        EmailDelivery.objects.create(session=session, contact=self.contact2, email=self.contact2.email, status=EmailDelivery.FAILED, attempts=1, last_error="451")
+
+        response = self.client.get(self.sessions_url)
+        self.assertEqual(response.data['results'][0]['sent_count'], 1)
+        self.assertEqual(response.data['results'][0]['failed_count'], 1)
+
+        response = self.client.get(reverse('email-session-deliveries', kwargs={"pk": session.pk}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(delivery['email'], delivery['status']) for delivery in response.data['results']],
+            [("jane@example.com", "failed"), ("john@example.com", "sent")],
+        )
+
+    def test_other_users_session_deliveries(self):
+        other_user = User.objects.create_user(email='otheruser@app.com', password='password123')
+        other_group = Group.objects.create(name="Other Group", user=other_user)
+        session = EmailSession.objects.create(user=other_user, session="Other", group_id=other_group)
+        response = self.client.get(reverse('email-session-deliveries', kwargs={"pk": session.pk}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
 
 class PermissionTests(BaseTestCase):
     def test_unauthorized_access(self):
@@ -177,4 +301,131 @@ class ScheduleEmailTests(BaseTestCase):
         url = self.schedule_email_url
         response = self.client.post(url, data)
         print(response.data)
-        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
\ No newline at end of file
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_schedule_email_sets_next_run(self):
+        data = {
+                "session": "First Session",
+                "schedule_time": "2030-09-24T11:32:00+01:00",
+                "group_id": self.group.id,
+                "template_id": self.template.id
+            }
+        response = self.client.post(self.schedule_email_url, data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        session = EmailSession.objects.get()
+        self.assertTrue(session.one_off)
+        self.assertEqual(session.next_run_at, datetime(2030, 9, 24, 10, 32, tzinfo=ZoneInfo('UTC')))
+        self.assertEqual(session.recurrence, '')
+
+
+class RecurringEmailTests(BaseTestCase):
+    def test_recurring_email_stores_rule_and_first_run(self):
+        data = {
+                "session": "Fortnightly",
+                "group_id": self.group.id,
+                "template_id": self.template.id,
+                "repeats_every": "week",
+                "interval": 2,
+                "time": "10:00",
+                "starts": "2030-01-01",
+                "ends": "2030-06-30",
+            }
+        response = self.client.post(self.recurring_email_url, data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['repeats_every'], "week")
+        session = EmailSession.objects.get()
+        self.assertFalse(session.one_off)
+        self.assertIn("FREQ=WEEKLY;INTERVAL=2;UNTIL=20300630T235959", session.recurrence)
+        self.assertEqual(session.timezone, 'Africa/Lagos')
+        self.assertEqual(session.next_run_at, datetime(2030, 1, 1, 9, 0, tzinfo=ZoneInfo('UTC')))
+
+    def test_recurring_email_that_already_ended(self):
+        data = {
+                "session": "Daily",
+                "group_id": self.group.id,
+                "template_id": self.template.id,
+                "repeats_every": "day",
+                "time": "10:00",
+                "starts": "2020-01-01",
+                "ends": "2020-02-01",
+            }
+        response = self.client.post(self.recurring_email_url, data)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(EmailSession.objects.exists())
+
+
+@override_settings(EMAIL_QUOTAS={'sessions': 2, 'emails': 3})
+class QuotaTests(BaseTestCase):
+    @patch('emailsending.views.dispatch_email_session.delay')
+    def test_send_email_sessions_quota(self, dispatch):
+        data = {"template": {"subject": "Subject", "body": "Body"}, "group_id": self.group.pk}
+        self.assertEqual(self.client.post(self.send_email_url, data, format='json').status_code, status.HTTP_200_OK)
+        # The group's two contacts are over the three emails left for this period
+        response = self.client.post(self.send_email_url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn("3 emails", str(response.data['detail']))
+        self.assertIn('Retry-After', response)
+        self.assertEqual(dispatch.call_count, 1)
+        self.assertEqual(EmailSession.objects.count(), 1)
+
+    @override_settings(EMAIL_QUOTAS={'sessions': 1, 'emails': 0})
+    def test_scheduled_sessions_quota(self):
+        data = {"session": "Later", "schedule_time": "2030-09-24T11:32:00Z", "group_id": self.group.id, "template_id": self.template.id}
+        self.assertEqual(self.client.post(self.schedule_email_url, data).status_code, status.HTTP_201_CREATED)
+        # A recurring schedule sends nothing itself, its runs are charged when they are due
+        recurring = {
+            "session": "Daily", "group_id": self.group.id, "template_id": self.template.id,
+            "repeats_every": "day", "time": "10:00", "starts": "2030-01-01", "ends": "2030-02-01",
+        }
+        self.assertEqual(self.client.post(self.recurring_email_url, recurring).status_code, status.HTTP_201_CREATED)
+        response = self.client.post(self.schedule_email_url, data)
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn("1 email sessions", str(response.data['detail']))
+        self.assertEqual(EmailSession.objects.count(), 2)
+
+    @patch('emailsending.views.dispatch_email_session.delay')
+    def test_session_not_saved_is_refunded(self, dispatch):
+        data = {"template": {"subject": "Subject", "body": "Body"}, "group_id": self.group.pk}
+        with patch('emailsending.serializers.EmailSession.objects.create', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                self.client.post(self.send_email_url, data, format='json')
+        self.assertEqual(self.client.post(self.send_email_url, data, format='json').status_code, status.HTTP_200_OK)
+        self.assertEqual(EmailSession.objects.get().quota_emails, 2)
+
+    @override_settings(EMAIL_QUOTAS={'sessions': 1, 'emails': 3})
+    @patch('emailsending.views.dispatch_email_session.delay')
+    def test_session_not_dispatched_is_removed_and_refunded(self, dispatch):
+        data = {"template": {"subject": "Subject", "body": "Body"}, "group_id": self.group.pk}
+        dispatch.side_effect = ConnectionError
+        with self.assertRaises(ConnectionError):
+            self.client.post(self.send_email_url, data, format='json')
+        self.assertFalse(EmailSession.objects.exists())
+        dispatch.side_effect = None
+        self.assertEqual(self.client.post(self.send_email_url, data, format='json').status_code, status.HTTP_200_OK)
+
+
+class SuppressionTests(BaseTestCase):
+    def test_create_and_list_suppressions(self):
+        url = reverse('suppression-list-create')
+        response = self.client.post(url, {"email": " John@Example.com ", "reason": "bounced"})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['email'], "john@example.com")
+
+        response = self.client.post(url, {"email": "john@example.com"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("already suppressed", str(response.data))
+
+        response = self.client.get(url)
+        self.assertEqual([suppression['email'] for suppression in response.data['results']], ["john@example.com"])
+
+    def test_delete_suppression(self):
+        suppression = Suppression.objects.create(user=self.user, email="john@example.com")
+        other_user = User.objects.create_user(email='otheruser@app.com', password='password123')
+        other = Suppression.objects.create(user=other_user, email="john@example.com")
+
+        response = self.client.delete(reverse('suppression-detail', kwargs={"pk": other.pk}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.delete(reverse('suppression-detail', kwargs={"pk": suppression.pk}))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(Suppression.objects.count(), 1)
+
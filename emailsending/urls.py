@@ -1,12 +1,17 @@
-from .views import EmailSessionView, EmailTemplateDetailView, EmailTemplatesListCreateApiView, SendMailView, ScheduleEmailView, RecurringEmailView
+from .views import EmailAttachmentDetailView, EmailAttachmentListCreateView, EmailDeliveryListView, EmailSessionView, SuppressionDetailView, SuppressionListCreateView, EmailTemplateDetailView, EmailTemplatesListCreateApiView, SendMailView, ScheduleEmailView, RecurringEmailView
 from django.urls import path
 
 
 urlpatterns = [
     path('templates/', EmailTemplatesListCreateApiView.as_view(), name='email-templates'),
     path('templates/<int:pk>/', EmailTemplateDetailView.as_view(), name='email-template-detail'),
+    path('attachments/', EmailAttachmentListCreateView.as_view(), name='email-attachments'),
+    path('attachments/<int:pk>/', EmailAttachmentDetailView.as_view(), name='email-attachment-detail'),
     path('send/', SendMailView.as_view(), name='send-mail'),
     path('schedule/', ScheduleEmailView.as_view(), name='schedule-email' ),
     path('schedule/recurring', RecurringEmailView.as_view(), name='recuring-email' ),
     path('sessions/', EmailSessionView.as_view(), name="email-sessions"),
+    path('sessions/<int:pk>/deliveries/', EmailDeliveryListView.as_view(), name="email-session-deliveries"),
+    path('suppressions/', SuppressionListCreateView.as_view(), name="suppression-list-create"),
+    path('suppressions/<int:pk>/', SuppressionDetailView.as_view(), name="suppression-detail"),
 ]
@@ -1,28 +1,420 @@
-import os
-import zoneinfo
+import hashlib
+import threading
+from functools import lru_cache
+from collections import OrderedDict, namedtuple
+from django.conf import settings
+from django.core.cache import cache
 from django.core.mail import EmailMessage
-from django.template.loader import render_to_string
-import tempfile
-import random
-import string
+from django.template import Context, Engine, TemplateSyntaxError
+from django.template.base import FilterExpression, Node, TextNode, Variable, VariableNode
+from django.template.smartif import TokenBase
+from django.utils.formats import localize
+from django.utils.html import conditional_escape
+from django.utils.timezone import template_localtime
+from emailsending.delivery import BatchSender, CampaignMessage
+from emailsending.plaintext import html_to_text
 
 
-def generate_html_file_name(identifier):
+TEMPLATE_CACHE_SIZE = 256
+
+# Analysis results are kept in the Django cache, which is per process with the default
+# LocMemCache and shared only with CACHE_BACKEND set to Redis. Otherwise each process
+# analyzes a template the first time it sends it
+TEMPLATE_INFO_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+
+# Template variables filled from contact columns, other than the id and email every recipient has
+CONTACT_VARIABLES = {
+    "first_name": "first_name",
+    "last_name": "last_name",
+}
+
+TemplateInfo = namedtuple('TemplateInfo', ['variables', 'static'])
+
+# The replacements django.utils.html.escape makes
+HTML_ESCAPES = str.maketrans({
+    "<": "&lt;",
+    ">": "&gt;",
+    "&": "&amp;",
+    '"': "&quot;",
+    "'": "&#x27;",
+})
+
+
+def template_hash(message):
+    """
+    Returns a stable content hash for an email template body.
+
+    Args:
+        message (str): The email message content.
+
+    Returns:
+        str: The hex digest identifying the template content.
+    """
+    return hashlib.sha256(message.encode('utf-8')).hexdigest()
+
+
+class TemplateCache:
+    """
+    Bounded LRU cache of compiled templates keyed by the content hash of their source.
+
+    `loader` compiles a template source, Django's template engine by default.
+    """
+    def __init__(self, maxsize=TEMPLATE_CACHE_SIZE, loader=None):
+        self.maxsize = maxsize
+        self.loader = loader or Engine.get_default().from_string
+        self._templates = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, message):
+        key = template_hash(message)
+        with self._lock:
+            template = self._templates.get(key)
+            if template is not None:
+                self._templates.move_to_end(key)
+                return template
+
+        template = self.loader(message)
+
+        with self._lock:
+            self._templates[key] = template
+            self._templates.move_to_end(key)
+            while len(self._templates) > self.maxsize:
+                self._templates.popitem(last=False)
+        return template
+
+    def clear(self):
+        with self._lock:
+            self._templates.clear()
+
+    def __len__(self):
+        return len(self._templates)
+
+
+template_cache = TemplateCache()
+
+
+def compile_template(message):
     """
-    Generates a unique filename based on the given identifier and a random 15-character alphanumeric string.
+    Compiles the email template content once and caches the result.
     
     Args:
-        identifier (str): The identifier to use in the filename.
+        message (str): The email message content.
     
     Returns:
-        str: The generated filename with a random 15-character string.
+        Template: The compiled template, ready to be rendered per contact.
     """
-    # Generate a random 15-character alphanumeric string
-    random_string = ''.join(random.choices(string.ascii_letters + string.digits, k=15))
-    
-    # Combine the identifier and random string to create the filename
-    return f"emailtemplate_{identifier}_{random_string}.html"
-        
+    return template_cache.get(message)
+
+
+class SegmentTemplate:
+    """
+    A template made only of text and plain {{ variable }} placeholders.
+
+    The source is split once into literal parts with a slot for each placeholder,
+    and each render fills the slots and joins the parts. Values are autoescaped the
+    way Django's engine does it, so the output is identical to a full render.
+    """
+    def __init__(self, parts, placeholders, autoescape=True):
+        self.parts = parts
+        self.placeholders = placeholders
+        self.autoescape = autoescape
+
+    @classmethod
+    def from_template(cls, template):
+        """
+        Splits a compiled Django template into segments.
+
+        Returns:
+            SegmentTemplate: The segmented template, or None when the template uses
+                tags, filters, attribute lookups or literals and needs the full engine.
+        """
+        engine = template.engine
+        if engine.string_if_invalid:
+            return None
+        parts, placeholders = [], []
+        for node in template.nodelist:
+            if isinstance(node, TextNode):
+                parts.append(node.s)
+                continue
+            if not isinstance(node, VariableNode):
+                return None
+            expression = node.filter_expression
+            variable = expression.var
+            if expression.filters or not isinstance(variable, Variable) or not variable.lookups or len(variable.lookups) != 1:
+                return None
+            placeholders.append((len(parts), variable.lookups[0]))
+            parts.append('')
+        return cls(parts, placeholders, autoescape=engine.autoescape)
+
+    def render(self, context):
+        """
+        Renders the template with a plain dict of values.
+        """
+        parts = list(self.parts)
+        for index, name in self.placeholders:
+            value = context.get(name, '')
+            if type(value) is str:
+                # Plain strings are by far the common case, escape them without building a SafeString
+                parts[index] = value.translate(HTML_ESCAPES) if self.autoescape else value
+                continue
+            if not isinstance(value, str):
+                # Numbers and dates are formatted as the engine would
+                value = str(localize(template_localtime(value)))
+            parts[index] = conditional_escape(value) if self.autoescape else value
+        return ''.join(parts)
+
+
+class EngineTemplate:
+    """
+    A compiled Django template rendered with a plain dict of values, like SegmentTemplate.
+    """
+    def __init__(self, template):
+        self.template = template
+
+    def render(self, context):
+        return self.template.render(Context(context, autoescape=self.template.engine.autoescape))
+
+
+def load_renderer(message):
+    """
+    Compiles a template into the fastest renderer that produces the same output.
+
+    The segments of a SegmentTemplate are kept in the Django cache, so other
+    processes build the renderer without parsing the template again.
+    """
+    key = f'emailsending:segments:{template_hash(message)}'
+    segments = cache.get(key)
+    if segments:
+        return SegmentTemplate(*segments)
+    template = compile_template(message)
+    if segments is None:
+        # Not seen before, False records that the template needs the full engine
+        renderer = SegmentTemplate.from_template(template)
+        cache.set(key, (renderer.parts, renderer.placeholders, renderer.autoescape) if renderer else False, TEMPLATE_INFO_CACHE_TIMEOUT)
+        if renderer:
+            return renderer
+    return EngineTemplate(template)
+
+
+renderer_cache = TemplateCache(loader=load_renderer)
+
+
+def get_renderer(message):
+    """
+    Returns the cached renderer of a template, a SegmentTemplate when it only has
+    plain placeholders and the full Django engine otherwise.
+
+    Args:
+        message (str): The email message content.
+
+    Returns:
+        SegmentTemplate | EngineTemplate: An object whose render() takes a dict of values.
+    """
+    return renderer_cache.get(message)
+
+
+def _collect_variables(value, names):
+    if isinstance(value, Variable):
+        if value.lookups:
+            names.add(value.lookups[0])
+    elif isinstance(value, FilterExpression):
+        # The variable itself and any variable passed to its filters
+        _collect_variables(value.var, names)
+        for _, args in value.filters:
+            for _, arg in args:
+                _collect_variables(arg, names)
+    elif isinstance(value, (Node, TokenBase)):
+        for attribute, child in vars(value).items():
+            if attribute not in ('origin', 'token'):
+                _collect_variables(child, names)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            _collect_variables(item, names)
+    elif isinstance(value, dict):
+        for item in value.values():
+            _collect_variables(item, names)
+
+
+def analyze_template(message):
+    """
+    Compiles a template and works out which context variables it reads.
+
+    The result is stored in the Django cache under the template's content hash,
+    where template_info() finds it at send time.
+
+    Args:
+        message (str): The email message content.
+
+    Returns:
+        TemplateInfo: The sorted variable names, and whether the template is plain
+            text that renders the same for every contact.
+
+    Raises:
+        TemplateSyntaxError: If the template does not compile.
+    """
+    template = compile_template(message)
+    names = set()
+    _collect_variables(list(template.nodelist), names)
+    info = TemplateInfo(
+        variables=sorted(names),
+        static=all(isinstance(node, TextNode) for node in template.nodelist),
+    )
+    cache.set(f'emailsending:template:{template_hash(message)}', info, TEMPLATE_INFO_CACHE_TIMEOUT)
+    return info
+
+
+def template_info(message):
+    """
+    Returns the TemplateInfo of a template, from the cache when it was analyzed before.
+    """
+    info = cache.get(f'emailsending:template:{template_hash(message)}')
+    if info is None:
+        info = analyze_template(message)
+    return info
+
+
+def remember_template_info(message, variables, static):
+    """
+    Caches analysis stored with a saved template, so send paths do not repeat it.
+    """
+    info = TemplateInfo(variables=list(variables), static=static)
+    cache.set(f'emailsending:template:{template_hash(message)}', info, TEMPLATE_INFO_CACHE_TIMEOUT)
+    return info
+
+
+def recipient_fields(info):
+    """
+    Returns the contact columns to fetch to render a template, for stream_recipients.
+    """
+    return ('id', 'email') + tuple(field for name, field in CONTACT_VARIABLES.items() if name in info.variables)
+
+
+def contact_renderer(message, info=None):
+    """
+    Returns a function that renders the template for a recipient.
+
+    A static template is rendered once and shared, without building a context per
+    contact. It is still rendered, as its source may hold {# comments #}.
+
+    Args:
+        message (str): The email message content.
+        info (TemplateInfo): The template's analysis, looked up when not given.
+
+    Returns:
+        callable: Takes a Recipient record and returns the personalized content.
+    """
+    info = info or template_info(message)
+    renderer = get_renderer(message)
+    if info.static:
+        content = renderer.render({})
+        return lambda contact: content
+    return lambda contact: renderer.render(contact_context(contact))
+
+
+@lru_cache(maxsize=None)
+def text_engine():
+    """
+    Returns an engine configured like the default one that does not autoescape,
+    for the plain text versions of templates.
+    """
+    engine = Engine.get_default()
+    return Engine(
+        libraries=engine.libraries,
+        builtins=engine.builtins[len(Engine.default_builtins):],
+        string_if_invalid=engine.string_if_invalid,
+        autoescape=False,
+    )
+
+
+class HTMLTextTemplate:
+    """
+    Renders the HTML template and converts the result, for templates whose plain
+    text version cannot be derived from their source.
+    """
+    def __init__(self, renderer):
+        self.renderer = renderer
+
+    def render(self, context):
+        return html_to_text(self.renderer.render(context))
+
+
+def derive_text_template(message):
+    """
+    Converts a template's HTML source into the source of its plain text version.
+
+    Returns:
+        str: The text template source, or None when the converted source does not
+            compile or reads variables the HTML template does not, for instance
+            when tags were split by markup that is dropped.
+    """
+    source = html_to_text(message)
+    try:
+        template = text_engine().from_string(source)
+    except TemplateSyntaxError:
+        return None
+    names = set()
+    _collect_variables(list(template.nodelist), names)
+    if not names <= set(template_info(message).variables):
+        return None
+    return source
+
+
+def load_text_renderer(message):
+    """
+    Builds the plain text renderer of a template.
+
+    The text source is derived once per template version and kept in the Django
+    cache. It is compiled like the HTML template, so text with plain placeholders
+    renders with the same SegmentTemplate substitution.
+    """
+    key = f'emailsending:text:{template_hash(message)}'
+    source = cache.get(key)
+    if source is None:
+        # False records that the text has to be converted from each rendered message
+        source = derive_text_template(message) or False
+        cache.set(key, source, TEMPLATE_INFO_CACHE_TIMEOUT)
+    if source is False:
+        return HTMLTextTemplate(get_renderer(message))
+    template = text_engine().from_string(source)
+    return SegmentTemplate.from_template(template) or EngineTemplate(template)
+
+
+text_renderer_cache = TemplateCache(loader=load_text_renderer)
+
+
+def get_text_renderer(message):
+    """
+    Returns the cached renderer of a template's plain text version.
+
+    Args:
+        message (str): The email message content.
+
+    Returns:
+        SegmentTemplate | EngineTemplate | HTMLTextTemplate: An object whose render() takes a dict of values.
+    """
+    return text_renderer_cache.get(message)
+
+
+def contact_text_renderer(message, info=None):
+    """
+    Returns a function that renders the plain text version of the template for a recipient.
+
+    The text of a static template is rendered once and shared.
+
+    Args:
+        message (str): The email message content.
+        info (TemplateInfo): The template's analysis, looked up when not given.
+
+    Returns:
+        callable: Takes a Recipient record and returns the personalized text.
+    """
+    info = info or template_info(message)
+    renderer = get_text_renderer(message)
+    if info.static:
+        text = renderer.render({})
+        return lambda contact: text
+    return lambda contact: renderer.render(contact_context(contact))
+
 
 def format_email(message, context):
     """
@@ -35,26 +427,26 @@ def format_email(message, context):
     Returns:
         str: The rendered email content.
     """
-    # Generate a unique filename
-    contact_id = context.get('contact_id')
-    filename = generate_html_file_name(contact_id)
-    
-    # Create a temporary file
-    temp_file_path = os.path.join('templates', filename)
-    
-    try:
-        # Write the message content to the temporary file
-        with open(temp_file_path, 'w') as file:
-            file.write(message)
-        
-        # Render the template with context
-        rendered_content = render_to_string(filename, context)
-    
-    finally:
-        # Remove the temporary file
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
-    return rendered_content
+    return get_renderer(message).render(context)
+
+
+def contact_context(contact):
+    """
+    Builds the template context for a contact, using "Guest" for missing names.
+
+    Args:
+        contact (Recipient): The record streamed by emailcontacts.recipients.stream_recipients,
+            which may only hold the columns the template needs.
+
+    Returns:
+        dict: The context data to render the template.
+    """
+    return {
+        "first_name": getattr(contact, 'first_name', None) or "Guest",
+        "last_name": getattr(contact, 'last_name', None) or "Guest",
+        "email": contact.email,
+        "contact_id": contact.id,
+    }
 
 
 def send_email(subject, message, recipient):
@@ -80,13 +472,14 @@ def format_messages(subject, message, contact_list, sender_email):
     Sends multiple emails to different contacts using Django's send_mass_mail.
     """
     messages = []
+    template = compile_template(message)
     for contact in contact_list:
-        personalized_message = format_email(message, {
+        personalized_message = template.render(Context({
             "first_name": contact['first_name'],
             "last_name": contact['last_name'],
             "email": contact['email'],
             "contact_id": contact['id'],
-        })
+        }))
         
         # Prepare the email tuple: (subject, message, from_email, [recipient_email])
         email_tuple = (
@@ -102,26 +495,25 @@ def format_messages(subject, message, contact_list, sender_email):
 
     # send_mass_mail(messages, fail_silently=False)
 
-from django.core.mail import send_mail
-
 def send_html_emails(subject, html_message, contact_list, sender_email):
     """
-    Sends multiple emails with HTML content to different contacts using send_mail.
+    Sends multiple emails with HTML content to different contacts over a single connection.
     """
-    for contact in contact_list:
-        personalized_message = format_email(html_message, {
+    template = compile_template(html_message)
+    text_renderer = get_text_renderer(html_message) if settings.EMAIL_TEXT_ALTERNATIVE else None
+    campaign = CampaignMessage(subject, sender_email, text=text_renderer is not None)
+
+    def build(contact):
+        context = {
             "first_name": contact['first_name'],
             "last_name": contact['last_name'],
             "email": contact['email'],
             "contact_id": contact['id'],
-        })
-        
-        # Send the email with HTML content
-        send_mail(
-            subject=subject,
-            message=None,  # Plain text version (optional, leave as None if not required)
-            from_email=sender_email,  # Sender email address
-            recipient_list=[contact['email']],  # Recipient's email
-            fail_silently=False,
-            html_message=personalized_message  # Send HTML message
-        )
+        }
+        text = text_renderer.render(context) if text_renderer else ''
+        return campaign.build(template.render(Context(context)), contact['email'], text)  # Recipient's email
+
+    messages = (build(contact) for contact in contact_list)
+
+    with BatchSender() as sender:
+        return sender.send(messages)
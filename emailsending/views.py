@@ -1,16 +1,15 @@
-from datetime import timezone
-import zoneinfo
-import json
-from django.utils.timezone import now
-from rest_framework import generics, status
+from django.db import IntegrityError, transaction
+from django.shortcuts import get_object_or_404
+from rest_framework import generics, serializers, status
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from emailcontacts.permissions import  IsGroupOwner, IsOwner
-from django_celery_beat.models import CrontabSchedule, PeriodicTask, IntervalSchedule
-from emailsending.serializers import EmailSessionSerializer, EmailTemplatesSerializers, SendNowSerializer, ScheduleSerializer, RecurringEmailSerilaizer
-from emailsending.tasks import send_email_task
-from emailsending.utils import format_email, send_email, format_messages
-from .models import EmailSession, EmailTemplate
+from emailsending.serializers import EmailAttachmentSerializer, EmailDeliverySerializer, EmailSessionSerializer, EmailTemplatesSerializers, SendNowSerializer, ScheduleSerializer, RecurringEmailSerilaizer, SuppressionSerializer
+from emailcontacts.recipients import has_recipients
+from emailsending.quotas import charge_session
+from liftsmail.pagination import CreatedAtCursorPagination
+from emailsending.tasks import dispatch_email_session
+from .models import EmailAttachment, EmailDelivery, EmailSession, EmailTemplate, Suppression
 from django.core.mail import send_mass_mail
 
 
@@ -32,14 +31,99 @@ class EmailTemplateDetailView(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = EmailTemplatesSerializers
     permission_classes = [IsAuthenticated,IsOwner]
 
+    def perform_destroy(self, instance):
+        # The attachment rows go with the template, their stored files are removed here
+        files = [attachment.file for attachment in instance.attachments.all()]
+        super().perform_destroy(instance)
+        for file in files:
+            file.delete(save=False)
+
+
+class EmailAttachmentListCreateView(generics.ListCreateAPIView):
+    """
+    Lists and uploads the user's attachments. Filter a template's attachments with ?template=<id>.
+    """
+    serializer_class = EmailAttachmentSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = CreatedAtCursorPagination
+
+    def get_queryset(self):
+        queryset = EmailAttachment.objects.filter(user=self.request.user)
+        template = self.request.query_params.get('template')
+        if template is not None:
+            if not template.isdigit():
+                raise serializers.ValidationError({"template": "A template id is required"})
+            queryset = queryset.filter(template_id=template)
+        return queryset
+
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
+
+
+class EmailAttachmentDetailView(generics.RetrieveDestroyAPIView):
+    serializer_class = EmailAttachmentSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return EmailAttachment.objects.filter(user=self.request.user)
+
+    def perform_destroy(self, instance):
+        file = instance.file
+        instance.delete()
+        file.delete(save=False)
+
 class EmailSessionView(generics.ListAPIView):
     queryset  = EmailSession.objects.all()
     serializer_class = EmailSessionSerializer
     permission_classes = [IsAuthenticated, IsGroupOwner]
+    pagination_class = CreatedAtCursorPagination
 
     def get_queryset(self):
         return EmailSession.objects.filter(user=self.request.user)
 
+
+class EmailDeliveryListView(generics.ListAPIView):
+    """
+    Lists the per-recipient delivery records of one of the user's email sessions.
+    """
+    serializer_class = EmailDeliverySerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = CreatedAtCursorPagination
+
+    def get_queryset(self):
+        if getattr(self, 'swagger_fake_view', False):
+            return EmailDelivery.objects.none()
+        session = get_object_or_404(EmailSession, pk=self.kwargs['pk'], user=self.request.user)
+        return EmailDelivery.objects.filter(session=session)
+
+DUPLICATE_SUPPRESSION_ERROR = {'email': ['This email is already suppressed.']}
+
+
+# Addresses the user never sends to, across all groups
+class SuppressionListCreateView(generics.ListCreateAPIView):
+    serializer_class = SuppressionSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = CreatedAtCursorPagination
+
+    def get_queryset(self):
+        return Suppression.objects.filter(user=self.request.user)
+
+    def perform_create(self, serializer):
+        try:
+            with transaction.atomic():
+                serializer.save(user=self.request.user)
+        except IntegrityError:
+            raise serializers.ValidationError(DUPLICATE_SUPPRESSION_ERROR)
+
+
+class SuppressionDetailView(generics.RetrieveDestroyAPIView):
+    serializer_class = SuppressionSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return Suppression.objects.filter(user=self.request.user)
+
+
 class SendMailView(generics.CreateAPIView):
     serializer_class = SendNowSerializer
     permission_classes = [IsAuthenticated]
@@ -52,75 +136,30 @@ class SendMailView(generics.CreateAPIView):
         template = serializer.validated_data['template']
         group = serializer.validated_data['group_id']
 
-        message = template["body"]
-        subject = template["subject"]
-
-        contacts = group.contacts.all()
-
-        if not contacts:
+        if not has_recipients(group.id):
             return Response({"detail": "This group has no contacts"}, status=400)
 
-        for contact in contacts:
-            context = {
-                "first_name": contact.first_name if contact.first_name else "Guest",
-                'last_name': contact.last_name if contact.last_name else "Guest",
-                'email': contact.email,
-                "contact_id": contact.id
-            }
-            
-            new_message = format_email(message, context)
-            send_email_task.delay(message=new_message, subject=subject, recipient=contact.email)
-        serializer.save()
-        return self.create(request, *args, **kwargs)
+        # Rendering and delivery happen in chunk tasks, the request only records the session
+        with charge_session(request.user.id, group.id) as emails:
+            email_session = serializer.save(quota_emails=emails)
+            try:
+                dispatch_email_session.delay(email_session.id, template["subject"], template["body"], transactional=True)
+            except Exception:
+                # A session that is never sent is not kept, and its charge is refunded
+                email_session.delete()
+                raise
+        return Response({"message": "Emails sent successfully", "session": email_session.id}, status=status.HTTP_200_OK)
 
 class ScheduleEmailView(generics.CreateAPIView):
     serializer_class = ScheduleSerializer
     permission_classes = [IsAuthenticated]
 
-    def post(self, request, *args, **kwargs):
-        serializer = self.get_serializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
-        schedule_time = serializer.validated_data['schedule_time']
-        group = serializer.validated_data['group_id']
-        template = serializer.validated_data['template_id']
-        message = template.body
-        subject = template.subject
-
-        schedule, _ = CrontabSchedule.objects.get_or_create(
-            minute=schedule_time.minute,
-            hour=schedule_time.hour,
-            day_of_month=schedule_time.day,
-            month_of_year=schedule_time.month,
-            day_of_week=schedule_time.strftime('%w'),
-            timezone=zoneinfo.ZoneInfo('Africa/Lagos')
-            )
-        cleaned_body = template.body.replace('\n', '').replace('<br>', '<br>').replace('\r', '<br>')
-        contact_list = [
-            {
-                "first_name": contact.first_name or "Guest",
-                'last_name': contact.last_name or "Guest",
-                'email': contact.email,
-                "id": contact.id
-            }
-            for contact in group.contacts.all()
-        ]
-        sender_email=request.user.email
-
-        try:
-            PeriodicTask.objects.create(
-                crontab=schedule,
-                name=f'mail_{group.id}_{now().timestamp()}',
-                task='emailsending.tasks.send_bulk_emails',
-                args=json.dumps([subject, cleaned_body, sender_email, contact_list]),
-                one_off=True,
-            )
-        except Exception as e:
-            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        return self.create(request, *args, **kwargs)
-
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
-        return super().perform_create(serializer)
+        # dispatch_due_sessions sends the session once its next run is due, contacts and template are read then
+        with charge_session(self.request.user.id, serializer.validated_data['group_id'].id) as emails:
+            serializer.save(
+                user=self.request.user, one_off=True, next_run_at=serializer.validated_data['schedule_time'], quota_emails=emails,
+            )
 
 class RecurringEmailView(generics.CreateAPIView):
     serializer_class = RecurringEmailSerilaizer
@@ -132,41 +171,13 @@ class RecurringEmailView(generics.CreateAPIView):
         serializer.is_valid(raise_exception=True)
         validated_data = serializer.validated_data
 
-        group = validated_data.get('group_id')
-        template = validated_data.get('template_id')
-        interval = validated_data.get('interval')
-        repeats_every = validated_data.get('repeats_every')
-        time = validated_data.get('time')
-        starts = validated_data.get('starts')
-        ends = validated_data.get('ends')
-        cleaned_body = template.body.replace('\n', '').replace('<br>', '<br>').replace('\r', '<br>')
-
-        schedule, _ = self.get_crontab_schedule(repeats_every, time, interval, starts)
-
-        contact_list = [
-            {
-                "first_name": contact.first_name or "Guest",
-                'last_name': contact.last_name or "Guest",
-                'email': contact.email,
-                "id": contact.id
-            }
-            for contact in group.contacts.all()
-        ]
-        sender_email=request.user.email
-
-        try:
-            PeriodicTask.objects.create(
-                crontab=schedule,
-                name=f'mail_{group.id}_{now().timestamp()}',
-                task='emailsending.tasks.send_bulk_emails',
-                args=json.dumps([template.subject, cleaned_body, sender_email, contact_list]),
-                start_time=starts,
-                expires=ends,
-                one_off=False,
-            )
-        except Exception as e:
-            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        return self.create(request, *args, **kwargs)
+        # The serializer turns the schedule into an RRULE and its first run, dispatch_due_sessions
+        # sends each occurrence to the group's contacts at that time
+        self.perform_create(serializer)
+        # The repeat fields are stored as an RRULE rather than as given, so echo the validated input
+        data = self.get_serializer(instance=validated_data).data
+        headers = self.get_success_headers(data)
+        return Response(data, status=status.HTTP_201_CREATED, headers=headers)
     
     def get_serializer_context(self):
         context = super().get_serializer_context()
@@ -174,42 +185,11 @@ class RecurringEmailView(generics.CreateAPIView):
         return context
 
     def perform_create(self, serializer):
+        # The schedule itself sends nothing, dispatch_due_sessions charges each of its runs
         serializer.save(user=self.request.user)
-        return super().perform_create(serializer)
-
-    def get_crontab_schedule(self, repeats_every, time, interval, starts):
-        if repeats_every == 'day':
-            return CrontabSchedule.objects.get_or_create(
-                minute=time.minute, hour=time.hour,
-                day_of_month=f'*/{interval}', month_of_year='*',
-                day_of_week='*', timezone=zoneinfo.ZoneInfo('Africa/Lagos')
-            )
-        elif repeats_every == 'week':
-            return CrontabSchedule.objects.get_or_create(
-                minute=time.minute, hour=time.hour,
-                day_of_month='*', month_of_year='*',
-                day_of_week=starts.strftime('%w'), timezone=zoneinfo.ZoneInfo('Africa/Lagos')
-            )
-        elif repeats_every == 'month':
-            return CrontabSchedule.objects.get_or_create(
-                minute=time.minute, hour=time.hour,
-                day_of_month=starts.day, month_of_year=f'*/{interval}',
-                day_of_week='*', timezone=zoneinfo.ZoneInfo('Africa/Lagos')
-            )
-        elif repeats_every == 'year':
-            return CrontabSchedule.objects.get_or_create(
-                minute=time.minute, hour=time.hour,
-                day_of_month=starts.day, month_of_year=starts.month,
-                day_of_week='*', timezone=zoneinfo.ZoneInfo('Africa/Lagos')
-            )
 
 # Schedules supported for now
 # Every X days
 # Every x weeks - once per week
-# Every x month - once per month
-# Every 1 year 
-
-
-# Todo
-# 5 email sessions per user
-# 50 emails per user
\ No newline at end of file
+# Every x months - once per month
+# Every x years
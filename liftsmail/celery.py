@@ -1,6 +1,7 @@
 from __future__ import absolute_import, unicode_literals
 import os
 from celery import Celery
+from celery.signals import worker_process_init, worker_process_shutdown
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'liftsmail.settings')
 
@@ -8,4 +9,17 @@ app = Celery('liftsmail')
 
 app.config_from_object('django.conf:settings', namespace='CELERY')
 
-app.autodiscover_tasks()
\ No newline at end of file
+app.autodiscover_tasks()
+
+
+@worker_process_init.connect
+def open_email_pool(**kwargs):
+    # Each worker process keeps its own SMTP sessions, opened after the fork
+    from emailsending.pool import init_pool
+    init_pool()
+
+
+@worker_process_shutdown.connect
+def close_email_pool(**kwargs):
+    from emailsending.pool import close_pool
+    close_pool()
\ No newline at end of file
@@ -13,8 +13,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 import os
 from datetime import timedelta
 from pathlib import Path
-from decouple import config
-import emailsending.tasks
+from decouple import Csv, config
 from celery.schedules import crontab
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -133,6 +132,8 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+MEDIA_ROOT = BASE_DIR / 'media'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -145,16 +146,153 @@ REST_FRAMEWORK = {
     ],
 }
 
+# Default page size of paginated lists, clients can ask for up to API_MAX_PAGE_SIZE with ?page_size=
+API_PAGE_SIZE = config('API_PAGE_SIZE', default=50, cast=int)
+API_MAX_PAGE_SIZE = config('API_MAX_PAGE_SIZE', default=200, cast=int)
+
 AUTH_USER_MODEL = 'account.CustomUser'
 
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
+# Backend used by the bulk send tasks, defaults to EMAIL_BACKEND.
+# Set it to 'emailsending.backends.AsyncSMTPEmailBackend' to send campaigns over concurrent SMTP sessions
+EMAIL_BULK_BACKEND = config('EMAIL_BULK_BACKEND', default=None)
+
+# SMTP sessions kept open by AsyncSMTPEmailBackend
+EMAIL_ASYNC_SMTP_CONNECTIONS = config('EMAIL_ASYNC_SMTP_CONNECTIONS', default=8, cast=int)
+
+# Bulk connections kept open by each Celery worker process (see emailsending.pool).
+# A connection idle for EMAIL_POOL_NOOP_AFTER seconds is checked with NOOP before reuse,
+# and it is replaced after EMAIL_POOL_MAX_MESSAGES messages or EMAIL_POOL_MAX_AGE seconds
+EMAIL_POOL_SIZE = config('EMAIL_POOL_SIZE', default=1, cast=int)
+EMAIL_POOL_MAX_MESSAGES = config('EMAIL_POOL_MAX_MESSAGES', default=5000, cast=int)
+EMAIL_POOL_MAX_AGE = config('EMAIL_POOL_MAX_AGE', default=600, cast=int)
+EMAIL_POOL_NOOP_AFTER = config('EMAIL_POOL_NOOP_AFTER', default=30, cast=int)
+
+# Number of messages pushed through one send_messages() call on a shared connection
+EMAIL_SEND_BATCH_SIZE = config('EMAIL_SEND_BATCH_SIZE', default=100, cast=int)
+
+# Contacts inserted per bulk_create call when importing a file
+CONTACT_IMPORT_BATCH_SIZE = config('CONTACT_IMPORT_BATCH_SIZE', default=1000, cast=int)
+
+# Uploads larger than this many bytes are imported by a Celery task
+CONTACT_IMPORT_ASYNC_THRESHOLD = config('CONTACT_IMPORT_ASYNC_THRESHOLD', default=1024 * 1024, cast=int)
+
+# Class used to check that a contact's domain accepts mail. 'emailcontacts.validation.StaticResolver'
+# skips DNS and only rejects CONTACT_INVALID_DOMAINS, for running without network access
+CONTACT_DOMAIN_RESOLVER = config('CONTACT_DOMAIN_RESOLVER', default='emailcontacts.validation.DNSResolver')
+CONTACT_INVALID_DOMAINS = config('CONTACT_INVALID_DOMAINS', default='', cast=Csv())
+
+# Seconds a domain check is cached for and shared between validation jobs
+CONTACT_DOMAIN_CACHE_TTL = config('CONTACT_DOMAIN_CACHE_TTL', default=60 * 60 * 24, cast=int)
+
+# Contacts read and updated per query by the validation job
+CONTACT_VALIDATION_BATCH_SIZE = config('CONTACT_VALIDATION_BATCH_SIZE', default=1000, cast=int)
+
+# Token buckets on outgoing mail, in messages per second with a burst allowance.
+# They are shared by every worker through Redis and a chunk is only sent once all of
+# them allow it. `backends` is keyed by EMAIL_BACKEND path and `users` by user id,
+# overriding the `user` default for that sender. Remove a level to leave it unlimited.
+EMAIL_RATE_LIMITS = {
+    'global': {'rate': config('EMAIL_RATE_LIMIT_GLOBAL', default=50, cast=float), 'burst': 200},
+    'backends': {},
+    'user': {'rate': config('EMAIL_RATE_LIMIT_USER', default=10, cast=float), 'burst': 100},
+    'users': {},
+}
+
+# Recipients rendered and delivered by a single chunk task
+EMAIL_CHUNK_SIZE = config('EMAIL_CHUNK_SIZE', default=500, cast=int)
+
+# Chunk tasks of each lane allowed to run at the same time. Slots are handed out
+# round-robin by sending user, and transactional chunks are always started first
+EMAIL_LANE_CONCURRENCY = {
+    'transactional': config('EMAIL_TRANSACTIONAL_CONCURRENCY', default=4, cast=int),
+    'bulk': config('EMAIL_BULK_CONCURRENCY', default=8, cast=int),
+}
+
+# Sessions sent now with at most this many chunks go in the transactional lane, larger ones are bulk
+EMAIL_TRANSACTIONAL_MAX_CHUNKS = config('EMAIL_TRANSACTIONAL_MAX_CHUNKS', default=2, cast=int)
+
+# Seconds after which a delivery left in 'sending' by a crashed task is marked 'unknown', as
+# it may have been delivered. Until then the task may still be sending it
+EMAIL_DELIVERY_CLAIM_TIMEOUT = config('EMAIL_DELIVERY_CLAIM_TIMEOUT', default=900, cast=int)
+
+# Attempts made on a recipient before its delivery is left as failed
+EMAIL_DELIVERY_MAX_ATTEMPTS = config('EMAIL_DELIVERY_MAX_ATTEMPTS', default=3, cast=int)
+
+# Largest file, in bytes, that can be uploaded as an email attachment
+EMAIL_ATTACHMENT_MAX_SIZE = config('EMAIL_ATTACHMENT_MAX_SIZE', default=10 * 1024 * 1024, cast=int)
+
+# Send a plain text alternative, derived once per template, before the HTML part
+EMAIL_TEXT_ALTERNATIVE = config('EMAIL_TEXT_ALTERNATIVE', default=True, cast=bool)
+
+# Email sessions and emails a user may send per EMAIL_QUOTA_WINDOW seconds, 0 for no limit.
+# Checked when a session is created, or when a run of a recurring session is due. Emails are
+# counted from the group's recipients and the counters are kept in Redis
+EMAIL_QUOTA_WINDOW = config('EMAIL_QUOTA_WINDOW', default=60 * 60 * 24, cast=int)
+EMAIL_QUOTAS = {
+    'sessions': config('EMAIL_QUOTA_SESSIONS', default=5, cast=int),
+    'emails': config('EMAIL_QUOTA_EMAILS', default=50, cast=int),
+}
+
+# Timezone the time and dates of recurring email sessions are given in
+EMAIL_SCHEDULE_TIMEZONE = config('EMAIL_SCHEDULE_TIMEZONE', default='Africa/Lagos')
+
+# Due email sessions claimed per scheduler transaction
+EMAIL_SCHEDULER_BATCH_SIZE = config('EMAIL_SCHEDULER_BATCH_SIZE', default=100, cast=int)
+
+# Suppression lists with at least this many addresses are checked through a cached Bloom filter,
+# only the addresses it matches are confirmed in the database
+EMAIL_SUPPRESSION_BLOOM_THRESHOLD = config('EMAIL_SUPPRESSION_BLOOM_THRESHOLD', default=10000, cast=int)
+EMAIL_SUPPRESSION_BLOOM_ERROR_RATE = config('EMAIL_SUPPRESSION_BLOOM_ERROR_RATE', default=0.01, cast=float)
+
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(days=3),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=5),
 }
 
-CELERY_BROKER_URL = 'redis://redis:6379' 
+REDIS_URL = config('REDIS_URL', default='redis://redis:6379')
+
+CELERY_BROKER_URL = REDIS_URL
+
+# Holds the analysis of compiled email templates. Set CACHE_BACKEND to
+# 'django.core.cache.backends.redis.RedisCache' to share it between the web and worker processes
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default=REDIS_URL),
+    }
+}
 # CELERY_RESULT_BACKEND = 'redis://redis:6379' 
 CELERY_RESULT_BACKEND = 'django-db'
 CELERY_RESULT_EXTENDED = True
+
+# Latency sensitive sends and the scheduler's bookkeeping run on the transactional queue,
+# campaign chunks on the bulk queue and everything else on the default one
+CELERY_TASK_ROUTES = {
+    'emailsending.tasks.send_email_task': {'queue': 'transactional'},
+    'emailsending.tasks.dispatch_email_session': {'queue': 'transactional'},
+    'emailsending.tasks.chunk_finished': {'queue': 'transactional'},
+    'emailsending.tasks.start_waiting_chunks': {'queue': 'transactional'},
+    'emailsending.tasks.send_email_chunk': {'queue': 'bulk'},
+    'emailsending.tasks.send_bulk_emails': {'queue': 'bulk'},
+}
+
+# A worker consuming several queues drains them in the order given to -Q
+CELERY_BROKER_TRANSPORT_OPTIONS = {'queue_order_strategy': 'priority'}
+
+# Synced into django_celery_beat's periodic tasks when beat starts
+CELERY_BEAT_SCHEDULE = {
+    'dispatch-due-email-sessions': {
+        'task': 'emailsending.tasks.dispatch_due_sessions',
+        'schedule': config('EMAIL_SCHEDULER_INTERVAL', default=60, cast=int),
+    },
+    'start-waiting-chunks': {
+        'task': 'emailsending.tasks.start_waiting_chunks',
+        'schedule': config('EMAIL_SCHEDULER_INTERVAL', default=60, cast=int),
+    },
+    'validate-contacts': {
+        'task': 'emailcontacts.tasks.validate_all_contacts',
+        'schedule': crontab(hour=3, minute=0),
+    },
+}